@@ -0,0 +1,120 @@
+"""
+Compares several clauses on the same collection field evaluated with one CTE per clause (how
+the SQL was generated before) and with one CTE for all clauses (conditional aggregation, see
+SQLQuery.get_merged_where_cte).
+
+Creates the tables `bench_collection` and `bench_collection__pos` in the database given by the
+usual environment variables (DB_HOST etc.), with the given number of entries and 3 rows per entry
+in the child table. Uses the Sequence engine of MariaDB to generate rows. The tables are dropped
+afterwards.
+
+Usage: python benchmarks/collection_clauses.py [number of entries]
+"""
+
+import statistics
+import sys
+import time
+
+from karps.config import Field, MainConfig, get_env
+from karps.database.database import get_cursor
+from karps.database.query import select
+from karps.query.query import get_query, parse_query
+
+TABLE = "bench_collection"
+POS_VALUES = ["nn", "vb", "av", "ab", "pp", "pn", "kn", "in"]
+QUERIES = [
+    "and(equals|pos|nn||equals|pos|vb)",
+    "or(equals|pos|nn||equals|pos|vb||equals|pos|av)",
+    "and(equals|pos|nn||not(equals|pos|vb)||not(equals|pos|av))",
+]
+REPEAT = 3
+
+main_config = MainConfig(
+    tags={},
+    fields={
+        "baseform": Field(name="baseform", type="string"),
+        "pos": Field(name="pos", type="string", collection=True),
+    },
+)
+
+
+def create_tables(cursor, num_entries: int):
+    cursor.execute(f"DROP TABLE IF EXISTS `{TABLE}`, `{TABLE}__pos`")
+    cursor.execute(f"CREATE TABLE `{TABLE}` (`__id` INT PRIMARY KEY, `baseform` VARCHAR(100))")
+    cursor.execute(
+        f"CREATE TABLE `{TABLE}__pos` (`__parent_id` INT, `pos` VARCHAR(10), INDEX (`__parent_id`), INDEX (`pos`))"
+    )
+    cursor.execute(f"INSERT INTO `{TABLE}` SELECT seq, CONCAT('word', seq) FROM seq_1_to_{num_entries}")
+    # three pos per entry, picked so that the combinations vary between entries
+    pos_case = "ELT(1 + (s.seq * (3 + o.seq)) % {n}, {values})".format(
+        n=len(POS_VALUES), values=", ".join(f"'{value}'" for value in POS_VALUES)
+    )
+    cursor.execute(f"INSERT INTO `{TABLE}__pos` SELECT s.seq, {pos_case} FROM seq_1_to_{num_entries} s, seq_0_to_2 o")
+    cursor.execute(f"ANALYZE TABLE `{TABLE}`, `{TABLE}__pos`")
+    cursor.fetchall()
+
+
+def separate_ctes(q: str) -> tuple[str, tuple]:
+    """
+    One CTE, `pos_<n>__where`, per clause
+    """
+    _, (where, params), collection_queries = get_query(main_config, "baseform", parse_query(q))
+    ctes = []
+    cte_params = []
+    for field, idx, (collection_where, collection_params) in collection_queries:
+        ctes.append(
+            f"`{field}_{idx}__where` AS (SELECT `__parent_id` FROM `{TABLE}__{field}`"
+            f" WHERE {collection_where} GROUP BY `__parent_id`)"
+        )
+        cte_params.extend(collection_params)
+        where = where.replace(
+            f"IFNULL(`{field}__where`.`__match_{idx}`, 0)",
+            f"EXISTS (SELECT 1 FROM `{field}_{idx}__where` WHERE TABLE_PREFIX__id = __parent_id)",
+        )
+    where = where.replace("TABLE_PREFIX", f"`{TABLE}`.")
+    return f"WITH {', '.join(ctes)} SELECT COUNT(*) FROM `{TABLE}` WHERE {where}", tuple(cte_params) + params
+
+
+def merged_cte(q: str) -> tuple[str, tuple]:
+    _, where, collection_queries = get_query(main_config, "baseform", parse_query(q))
+    sql_q = select([("baseform", None)]).from_table(TABLE)
+    for field, idx, collection_where in collection_queries:
+        sql_q.join(field, count=idx, where=collection_where)
+    _, count_query = sql_q.where(where).to_string(paged=True)
+    assert count_query
+    return count_query
+
+
+def measure(cursor, sql: str, params: tuple) -> tuple[float, int]:
+    times = []
+    result = 0
+    for _ in range(REPEAT):
+        bf = time.perf_counter()
+        cursor.execute(sql, params)
+        result = cursor.fetchall()[0][0]
+        times.append(time.perf_counter() - bf)
+    return statistics.median(times), result
+
+
+def main():
+    num_entries = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    env = get_env()
+    with get_cursor(env) as cursor:
+        create_tables(cursor, num_entries)
+        try:
+            print(f"{num_entries} entries, {3 * num_entries} rows in {TABLE}__pos\n")
+            print(f"{'query':<60} {'separate (ms)':>14} {'merged (ms)':>12} {'speedup':>8}")
+            for q in QUERIES:
+                separate_took, separate_count = measure(cursor, *separate_ctes(q))
+                merged_took, merged_count = measure(cursor, *merged_cte(q))
+                assert separate_count == merged_count, (q, separate_count, merged_count)
+                print(
+                    f"{q:<60} {separate_took * 1000:>14.1f} {merged_took * 1000:>12.1f}"
+                    f" {separate_took / merged_took:>7.1f}x"
+                )
+        finally:
+            cursor.execute(f"DROP TABLE IF EXISTS `{TABLE}`, `{TABLE}__pos`")
+
+
+if __name__ == "__main__":
+    main()
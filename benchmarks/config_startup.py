@@ -0,0 +1,103 @@
+"""
+Compares the time it takes for a new worker to load the configuration from the YAML files
+and from the bundle written by karp-s-cli.
+
+Each measurement is done in a new Python process, like a newly started worker.
+
+Usage: python benchmarks/config_startup.py [number of resources ...]
+"""
+
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from karps.config import Env, get_bundle_path, write_bundle
+from karps.util import yaml
+
+FIELDS_PER_RESOURCE = 20
+REPEAT = 5
+
+# run in the subprocess, prints the time it takes to get the first snapshot
+MEASURE = """
+import time
+from karps.config import ConfigRegistry, Env
+bf = time.perf_counter()
+snapshot = ConfigRegistry(Env(host="", user="", password="", database="", base_path={base_path!r})).get()
+took = time.perf_counter() - bf
+assert len(snapshot.resources) == {num_resources}
+print(took)
+"""
+
+
+def create_config(base_path: Path, num_resources: int):
+    config_dir = base_path / "config"
+    (config_dir / "resources").mkdir(parents=True)
+    field_names = [f"field{idx}" for idx in range(FIELDS_PER_RESOURCE * 5)]
+    resource_ids = [f"resource{idx}" for idx in range(num_resources)]
+    with open(config_dir / "config.yaml", "w") as fp:
+        yaml.dump({"tags": {"tag": {"label": "Tag", "description": {"swe": "Tagg", "eng": "Tag"}}}}, fp)
+    with open(config_dir / "fields.yaml", "w") as fp:
+        fields = [
+            {
+                "name": name,
+                "type": "text",
+                "collection": idx % 3 == 0,
+                "label": {"swe": name, "eng": name},
+                "resource_id": resource_ids,
+            }
+            for idx, name in enumerate(field_names)
+        ]
+        yaml.dump(fields, fp)
+    for idx, resource_id in enumerate(resource_ids):
+        resource_fields = field_names[idx % 5 :: 5][:FIELDS_PER_RESOURCE]
+        with open(config_dir / "resources" / f"{resource_id}.yaml", "w") as fp:
+            yaml.dump(
+                {
+                    "resource_id": resource_id,
+                    "label": {"swe": resource_id, "eng": resource_id},
+                    "description": {"swe": "En beskrivning", "eng": "A description"},
+                    "fields": [{"name": name, "primary": i < 5} for i, name in enumerate(resource_fields)],
+                    "entry_word": {"field": resource_fields[0], "description": {"swe": "ord", "eng": "word"}},
+                    "updated": 1700000000000,
+                    "size": 1000,
+                    "link": "https://spraakbanken.gu.se",
+                    "tags": ["tag"],
+                },
+                fp,
+            )
+
+
+def measure(base_path: Path, num_resources: int) -> float:
+    times = []
+    for _ in range(REPEAT):
+        p = subprocess.run(
+            [sys.executable, "-c", MEASURE.format(base_path=str(base_path), num_resources=num_resources)],
+            capture_output=True,
+            check=True,
+            encoding="utf-8",
+        )
+        times.append(float(p.stdout))
+    return statistics.median(times)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10, 100, 1000]
+    print(f"{'resources':>10} {'yaml (ms)':>10} {'bundle (ms)':>12} {'speedup':>8}")
+    for num_resources in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            base_path = Path(tmp_dir)
+            create_config(base_path, num_resources)
+            env = Env(host="", user="", password="", database="", base_path=tmp_dir)
+            yaml_took = measure(base_path, num_resources)
+            write_bundle(env)
+            bundle_took = measure(base_path, num_resources)
+            get_bundle_path(env).unlink()
+        print(
+            f"{num_resources:>10} {yaml_took * 1000:>10.1f} {bundle_took * 1000:>12.1f} {yaml_took / bundle_took:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
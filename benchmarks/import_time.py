@@ -0,0 +1,65 @@
+"""
+Measures the cost of importing karps.api (what each worker does on boot) using `python -X importtime`.
+
+Reports the total and the modules with the highest cumulative and self import times.
+
+Usage: python benchmarks/import_time.py [module] [number of modules to show]
+"""
+
+from collections import defaultdict
+import os
+import statistics
+import subprocess
+import sys
+
+REPEAT = 5
+
+
+def measure(module: str) -> list[tuple[str, int, int]]:
+    """
+    Returns a list of (module, self_us, cumulative_us) parsed from the -X importtime output.
+    """
+    env = os.environ.copy()
+    # karps.api reads the environment on import, but does not connect to the database
+    for var in ("DB_HOST", "DB_USER", "DB_PASSWORD", "DB_DATABASE"):
+        env.setdefault(var, "benchmark")
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        check=True,
+        encoding="utf-8",
+        env=env,
+    )
+    result = []
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        result.append((name.strip(), int(self_us), int(cumulative_us)))
+    return result
+
+
+def main():
+    module = sys.argv[1] if len(sys.argv) > 1 else "karps.api"
+    top = int(sys.argv[2]) if len(sys.argv) > 2 else 15
+
+    self_times = defaultdict(list)
+    cumulative_times = defaultdict(list)
+    for _ in range(REPEAT):
+        for name, self_us, cumulative_us in measure(module):
+            self_times[name].append(self_us)
+            cumulative_times[name].append(cumulative_us)
+
+    def median_ms(times: dict[str, list[int]], name: str) -> float:
+        return statistics.median(times[name]) / 1000
+
+    print(f"import {module}: {median_ms(cumulative_times, module):.1f} ms (median of {REPEAT} runs)\n")
+    for title, times in (("cumulative", cumulative_times), ("self", self_times)):
+        print(f"{'module':<50} {title + ' (ms)':>16}")
+        for name in sorted(times, key=lambda name: median_ms(times, name), reverse=True)[:top]:
+            print(f"{name:<50} {median_ms(times, name):>16.1f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
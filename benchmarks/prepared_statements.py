@@ -0,0 +1,114 @@
+"""
+Compares running the statements of repeated /search requests with a normal cursor (the SQL is
+parsed and planned for each statement) and with server-side prepared statements
+(PreparedStatementCursor, only the params are sent after the first request).
+
+Creates the tables `bench_prepared` and `bench_prepared__pos` in the database given by the usual
+environment variables (DB_HOST etc.), with the given number of entries. Each query is run with
+different values, so that the prepared statements are reused. Both cursors use
+the same connection. The tables are dropped afterwards.
+
+Usage: python benchmarks/prepared_statements.py [number of entries] [number of requests]
+"""
+
+import statistics
+import sys
+import time
+
+from mysql.connector.cursor import MySQLCursor
+
+from karps.config import Field, MainConfig, get_env
+from karps.database.database import PreparedStatementCursor, fetchall, get_connection
+from karps.database.query import limit_clause, select
+from karps.query.query import get_query, parse_query
+
+TABLE = "bench_prepared"
+POS_VALUES = ["nn", "vb", "av", "ab", "pp", "pn", "kn", "in"]
+# query templates, {} is replaced by a value that differs between requests
+QUERIES = [
+    "equals|baseform|word{}",
+    "startswith|baseform|word{}",
+    "and(startswith|baseform|word{}||equals|pos|nn)",
+    "or(equals|baseform|word{}||equals|baseform|word1{}||equals|baseform|word2{})",
+]
+
+main_config = MainConfig(
+    tags={},
+    fields={
+        "baseform": Field(name="baseform", type="string"),
+        "pos": Field(name="pos", type="string", collection=True),
+    },
+)
+
+
+def create_tables(cursor, num_entries: int):
+    cursor.execute(f"DROP TABLE IF EXISTS `{TABLE}`, `{TABLE}__pos`")
+    cursor.execute(f"CREATE TABLE `{TABLE}` (`__id` INT PRIMARY KEY, `baseform` VARCHAR(100), INDEX (`baseform`))")
+    cursor.execute(
+        f"CREATE TABLE `{TABLE}__pos` (`__parent_id` INT, `pos` VARCHAR(10), INDEX (`__parent_id`), INDEX (`pos`))"
+    )
+    cursor.execute(f"INSERT INTO `{TABLE}` SELECT seq, CONCAT('word', seq) FROM seq_1_to_{num_entries}")
+    pos_case = "ELT(1 + seq % {n}, {values})".format(
+        n=len(POS_VALUES), values=", ".join(f"'{value}'" for value in POS_VALUES)
+    )
+    cursor.execute(f"INSERT INTO `{TABLE}__pos` SELECT seq, {pos_case} FROM seq_1_to_{num_entries}")
+    cursor.execute(f"ANALYZE TABLE `{TABLE}`, `{TABLE}__pos`")
+    cursor.fetchall()
+
+
+def search_statements(q: str) -> list[tuple[str, tuple]]:
+    """
+    The count statement and the data statement for the first page, as run by run_paged_searches
+    """
+    _, where, collection_queries = get_query(main_config, "baseform", parse_query(q))
+    sql_q = select([("__id", None), ("baseform", None)]).from_table(TABLE)
+    for field, idx, collection_where in collection_queries:
+        sql_q.join(field, count=idx, where=collection_where)
+    (data_sql, data_params), count_query = sql_q.where(where).to_string(paged=True)
+    assert count_query
+    limit_str, limit_params = limit_clause(10, 0)
+    return [count_query, (data_sql + limit_str, data_params + limit_params)]
+
+
+def measure(cursor: MySQLCursor, template: str, num_requests: int) -> float:
+    """
+    Returns the median time per request
+    """
+    times = []
+    for i in range(num_requests):
+        bf = time.perf_counter()
+        # the SQL is built for each request, as it is when the SQL cache is cold
+        for sql, params in search_statements(template.format(i)):
+            fetchall(cursor, sql, params)  # pyright: ignore[reportArgumentType]
+        times.append(time.perf_counter() - bf)
+    return statistics.median(times)
+
+
+def main():
+    num_entries = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    num_requests = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    env = get_env()
+    connection = get_connection(env)
+    connection.autocommit = True
+    cursor = connection.cursor()
+    prepared_cursor = PreparedStatementCursor(connection)
+    create_tables(cursor, num_entries)
+    try:
+        print(f"{num_entries} entries, {num_requests} requests per query\n")
+        print(f"{'query':<75} {'text (ms)':>10} {'prepared (ms)':>14} {'speedup':>8}")
+        for template in QUERIES:
+            text_took = measure(cursor, template, num_requests)
+            prepared_took = measure(prepared_cursor, template, num_requests)  # pyright: ignore[reportArgumentType]
+            print(
+                f"{template:<75} {text_took * 1000:>10.3f} {prepared_took * 1000:>14.3f}"
+                f" {text_took / prepared_took:>7.2f}x"
+            )
+    finally:
+        prepared_cursor.close()
+        cursor.execute(f"DROP TABLE IF EXISTS `{TABLE}`, `{TABLE}__pos`")
+        cursor.close()
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
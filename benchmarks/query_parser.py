@@ -0,0 +1,34 @@
+"""
+Compares the throughput of parse_query (hand-written parser) with the parser generated
+by TatSu from query.ebnf.
+
+Usage: python benchmarks/query_parser.py [number of parses per query]
+"""
+
+import sys
+import timeit
+
+from karps.query.query import parse_query, parse_query_tatsu
+
+QUERIES = [
+    "equals|baseform|bord",
+    "startswith|baseform|hus",
+    "gte|frequency|10",
+    'equals|baseform|"a \\" b"',
+    "and(equals|pos|nn||or(contains|baseform|ord||regexp|baseform|^a.*))",
+    "and(" + "||".join(f"equals|field{idx}|value{idx}" for idx in range(20)) + ")",
+]
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(f"{'query':<40} {'tatsu (/s)':>12} {'parser (/s)':>12} {'speedup':>8}")
+    for q in QUERIES:
+        tatsu_took = min(timeit.repeat(lambda: parse_query_tatsu(q), number=number, repeat=3))
+        took = min(timeit.repeat(lambda: parse_query(q), number=number, repeat=3))
+        name = q if len(q) <= 40 else q[:37] + "..."
+        print(f"{name:<40} {number / tatsu_took:>12.0f} {number / took:>12.0f} {tatsu_took / took:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
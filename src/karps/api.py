@@ -1,22 +1,22 @@
+from contextlib import asynccontextmanager
 import json
+import signal
 from typing import Any, Sequence
-from fastapi import FastAPI, Depends, Query, Request, Response
+from fastapi import FastAPI, Depends, Header, Query, Request, Response
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from karps.config import (
     Env,
+    ConfigRegistry,
     ConfigResponse,
+    ConfigSnapshot,
     ResourceConfig,
     get_env,
-    get_allowed_fields,
-    get_resource_config,
-    get_resource_configs,
-    load_config,
 )
 from karps.logging import setup_sql_logger
 from karps.search import count, search
-from karps.models import SearchResult, UserErrorSchema
+from karps.models import SearchResult, Totals, UserErrorSchema
 from karps.errors import errors
 from karps.auth.deps import get_allowed_resources
 
@@ -53,7 +53,21 @@ When sorting by multiple fields, the sort will be applied in the given order. `a
 """
 
 
+# karp-s-cli sends this signal to the workers when the configuration has changed, requests that are
+# already running finish with the configuration they started with
+RELOAD_SIGNAL = signal.SIGUSR2
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # installed when each worker starts: gunicorn resets the signal handlers of a worker after forking it and,
+    # with --preload, the module is only imported in the main process, which uses SIGUSR2 itself
+    signal.signal(RELOAD_SIGNAL, lambda signum, frame: config_registry.invalidate())
+    yield
+
+
 app = FastAPI(
+    lifespan=lifespan,
     title="Karp-s API",
     description=api_description,
     version="1.0-dev",
@@ -83,7 +97,7 @@ async def exception_handler2(request: Request, exc: errors.CodeUserError):
     if exc.details:
         content["details"] = exc.details
     return JSONResponse(
-        status_code=500,
+        status_code=errors.error_codes[type(exc)].status_code,
         content=content,
     )
 
@@ -92,6 +106,8 @@ env: Env = get_env()
 if env.sql_query_logging:
     setup_sql_logger(env.logging_dir)
 
+config_registry = ConfigRegistry(env)
+
 
 compile_param_description = """
 A list of fields to compile statistics on, for example `baseform`, `pos`, `normalized_form`
@@ -195,15 +211,27 @@ def get_q_param():
     return Query(
         None,
         title="Query",
-        description='The query. See http://ws.spraakbanken.gu.se/ws/karp/v7 for a description of the query language, however, Karp-s does not support nesting boolean queries, the "not"-boolean query, sub-queries, exists, missing and freetext.',
+        description='The query. See http://ws.spraakbanken.gu.se/ws/karp/v7 for a description of the query language, however, Karp-s does not support nesting boolean queries, the "not"-boolean query, sub-queries, exists and missing. freetext searches the fields that have a fulltext index.',
     )
 
 
 default_500: dict[int | str, dict[str, Any]] = {500: {"description": "Application error", "model": UserErrorSchema}}
+search_responses: dict[int | str, dict[str, Any]] = {
+    400: {"description": "searchAfter is invalid", "model": UserErrorSchema},
+    **default_500,
+}
+
+
+def get_config_snapshot() -> ConfigSnapshot:
+    """
+    FastAPI caches dependencies per request, so every use of this in a request gets the same snapshot
+    """
+    return config_registry.get()
 
 
 def get_resource_configs_param():
     def inner(
+        snapshot: ConfigSnapshot = Depends(get_config_snapshot),
         allowed_resources: list[str] = Depends(get_allowed_resources),
         resources: list[str] = Depends(
             get_list_param(alias="resources", title="Resources", description=resources_param_description)
@@ -211,7 +239,7 @@ def get_resource_configs_param():
     ) -> list[ResourceConfig]:
         resource_configs = []
         for resource in resources:
-            resource_config = get_resource_config(env, resource)
+            resource_config = snapshot.get_resource_config(resource)
             if resource_config.limited_access and resource_config.resource_id not in allowed_resources:
                 raise errors.UserAccessError(resource_config.resource_id)
             resource_configs.append(resource_config)
@@ -220,28 +248,62 @@ def get_resource_configs_param():
     return inner
 
 
-@app.get("/config", summary="Get config", response_model_exclude_unset=True)
-def get_config(allowed_resources: list[str] = Depends(get_allowed_resources)) -> ConfigResponse:
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # weak comparison, W/ prefixes are ignored
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+@app.get(
+    "/config",
+    summary="Get config",
+    response_model=ConfigResponse,
+    response_model_exclude_unset=True,
+    responses={304: {"description": "The config has not changed since the request with the given ETag"}},
+)
+def get_config(
+    snapshot: ConfigSnapshot = Depends(get_config_snapshot),
+    allowed_resources: list[str] = Depends(get_allowed_resources),
+    if_none_match: str | None = Header(None, include_in_schema=False),
+) -> Response:
     """
     Returns a description of the contents of each installed resource/lexicon. For example the available fields and their types.
 
     Some resources have `limitedAccess: true` - they will not be searchable without access.
 
     Some resources have `protectedMetadata: true` - they will not be returned by this call without access.
+
+    The response has an `ETag` header. Send it in `If-None-Match` to get `304 Not Modified` when the config is unchanged.
     """
-    config = load_config(env)
-    resources = list(get_resource_configs(env, allowed=allowed_resources))
-    fields = get_allowed_fields(config, allowed=allowed_resources)
-    return ConfigResponse(tags=config.tags, fields=fields, resources=resources)
+    config_response = snapshot.get_config_response(allowed=allowed_resources)
+    headers = {"ETag": config_response.etag}
+    if _etag_matches(if_none_match, config_response.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(config_response.body, media_type="application/json", headers=headers)
 
 
-@app.get("/search", summary="Search", responses=default_500)
+@app.get("/search", summary="Search", responses=search_responses)
 def do_search(
+    snapshot: ConfigSnapshot = Depends(get_config_snapshot),
     resource_configs: list[ResourceConfig] = Depends(get_resource_configs_param()),
     q: str | None = get_q_param(),
     size: int = 10,
     _from: int = Query(0, alias="from"),
     sort: list[tuple[str, str]] = Depends(get_sort_param()),
+    search_after: str | None = Query(
+        None,
+        alias="searchAfter",
+        description="`searchAfter` from the previous page, instead of `from`. Faster than `from` for later pages.",
+    ),
+    totals: Totals = Query(
+        "exact",
+        description="How `total` and `resourceHits` are given: `exact`, `estimate` (from the table statistics, faster"
+        " for large resources) or `none` (not given). Only the first page can skip counting, later pages with `from`"
+        " need the exact counts (use `searchAfter` instead).",
+    ),
 ) -> SearchResult:
     """
     From each provided resource, return the entries that match the query q.
@@ -251,12 +313,26 @@ def do_search(
 
     The sort is done within each resource, the results from each resource are not mixed.
     """
-    main_config = load_config(env)
-    return search(env, main_config, resource_configs, q=q, size=size, _from=_from, sort=sort)
+    main_config = snapshot.main_config
+    schema = snapshot.get_schema(resource_configs)
+    return search(
+        env,
+        main_config,
+        resource_configs,
+        q=q,
+        size=size,
+        _from=_from,
+        sort=sort,
+        schema=schema,
+        sql_cache=snapshot.sql_queries,
+        search_after=search_after,
+        totals=totals,
+    )
 
 
 @app.get("/count", summary="Count", response_model_exclude_none=True, responses=default_500)
 def do_count(
+    snapshot: ConfigSnapshot = Depends(get_config_snapshot),
     resource_configs: list[ResourceConfig] = Depends(get_resource_configs_param()),
     q: str | None = get_q_param(),
     compile: list[str] = Depends(
@@ -277,8 +353,19 @@ def do_count(
     Sorting is supported for fields that are used in `compile`. The default fields are all the fields in `compile`
     (**ascending** order) (they themselves sorted alphabetically, just like the columns).
     """
-    main_config = load_config(env)
-    headers, table, total = count(env, main_config, resource_configs, q=q, compile=compile, columns=columns, sort=sort)
+    main_config = snapshot.main_config
+    schema = snapshot.get_schema(resource_configs)
+    headers, table, total = count(
+        env,
+        main_config,
+        resource_configs,
+        q=q,
+        compile=compile,
+        columns=columns,
+        sort=sort,
+        schema=schema,
+        sql_cache=snapshot.sql_queries,
+    )
     headers_dumped = [header.model_dump(by_alias=True) for header in headers]
     # TODO fix response model for API-reference reasons
     result_str = json.dumps({"headers": headers_dumped, "table": table, "total": total}, ensure_ascii=False)
@@ -4,11 +4,16 @@ import logging
 import os
 from pathlib import Path
 import shutil
+import signal
 import subprocess
 import sys
 from typing import Any, Iterable, cast
 
-from karps.config import Env, get_env
+from karps.config import ConfigRegistry, Env, get_env, write_bundle
+from karps.logging import read_sql_log
+from karps.database.cubes import create_cubes
+from karps.database.indexes import create_indexes, find_missing_indexes
+from karps.database.text_index import create_text_indexes
 from karps.util import yaml
 from karps.util.git import GitRepo
 
@@ -24,8 +29,20 @@ def main():
     Supported subcommands:
     - init: create the needed structure (also run for every other command)
     - add <resource>: add a resource from the incoming directory
-    - reload: reloads the workers of the API
+    - reload: restarts the workers of the API (needed for serving new code)
+    - reload-config: makes the running workers load the configuration, without restarting them
     - reconfigure: recreates the configuration based on each resource in the incoming directory
+    - remove <resource>: removes a resource from the incoming directory and reconfigures
+    - text-indexes [<resource> ...]: builds the text indexes enabled in fields.yaml (all resources if none given),
+      must be run again after the data of a resource has been loaded or updated (add and reconfigure also build them)
+    - cubes [<resource> ...]: precomputes the counts of the cubes in config.yaml (all resources if none given),
+      must be run again after the data of a resource has been loaded or updated (add and reconfigure also build them)
+    - indexes [--log] [--create] [<resource> ...]: reports the columns that are queried, sorted or joined on
+      without an index and the expected benefit of each index. With --log, the query columns are taken from
+      the SQL log in LOGGING_DIR, with --create, the indexes are created (without locking the tables)
+
+    add, reconfigure and remove also write the configuration bundle loaded by the workers
+    and make the workers load the new configuration.
     """
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
     config: Env = get_env()
@@ -36,23 +53,50 @@ def main():
     if sys.argv[1] == "add":
         resource_id = sys.argv[2]
         resource_dir = main_dir / "incoming" / resource_id
-        return process_resource(main_dir, resource_dir, repo)
+        error = process_resource(main_dir, resource_dir, repo)
+        create_bundle(config)
+        if not error:
+            build_resource_indexes(config, [resource_id])
+        reload_config(config)
+        return error
     elif sys.argv[1] == "reload":
         restart_workers(config)
+    elif sys.argv[1] == "reload-config":
+        reload_config(config)
+    elif sys.argv[1] == "text-indexes":
+        build_text_indexes(config, sys.argv[2:])
+        # the workers cache which text indexes have been built with the configuration
+        reload_config(config)
+    elif sys.argv[1] == "cubes":
+        build_cubes(config, sys.argv[2:])
+        # the workers cache which cubes are up to date with the configuration
+        reload_config(config)
+    elif sys.argv[1] == "indexes":
+        args = sys.argv[2:]
+        options = {arg for arg in args if arg.startswith("--")}
+        build_indexes(
+            config,
+            [arg for arg in args if arg not in options],
+            use_log="--log" in options,
+            create="--create" in options,
+        )
     elif sys.argv[1] == "reconfigure":
         ignore_labels = False
         if len(sys.argv) > 2 and sys.argv[2] == "--ignore-labels":
             ignore_labels = True
         # if ignore_labels - ignore if incoming resources conflict on the label of fields
         error = reconfigure(main_dir, repo, ignore_labels=ignore_labels)
-        restart_workers(config)
+        create_bundle(config)
+        build_resource_indexes(config, [])
+        reload_config(config)
         return error
     elif sys.argv[1] == "remove":
         resource_id = sys.argv[2]
         resource_dir = main_dir / "incoming" / resource_id
         shutil.rmtree(resource_dir, ignore_errors=True)
         reconfigure(main_dir, repo)
-        restart_workers(config)
+        create_bundle(config)
+        reload_config(config)
     else:
         raise RuntimeError(f"karp-s-cli: commands not supported {sys.argv}")
 
@@ -75,6 +119,100 @@ def restart_workers(config: Env):
         logger.info("karp-s-backend reloaded")
 
 
+# same as karps.api.RELOAD_SIGNAL, not imported since importing the API has side effects
+RELOAD_SIGNAL = signal.SIGUSR2
+
+
+def reload_config(config: Env):
+    """
+    Sends RELOAD_SIGNAL to each gunicorn worker. The workers load the new configuration
+    for new requests, while requests that are already running are not affected.
+    """
+    pid_file = Path(config.base_path) / "run" / "gunicorn.pid"
+    if not pid_file.exists():
+        logger.warning(f"cannot find {pid_file}, is karp-s-backend running?")
+        return
+    main_pid = pid_file.read_text().strip()
+    # the workers are the child processes of the gunicorn main process
+    p = subprocess.run(["pgrep", "-P", main_pid], capture_output=True, check=False, encoding="utf-8")
+    worker_pids = [int(pid) for pid in p.stdout.split()]
+    if not worker_pids:
+        logger.warning("failed to reload configuration of karp-s-backend, no workers found")
+        return
+    for pid in worker_pids:
+        try:
+            os.kill(pid, RELOAD_SIGNAL)
+        except ProcessLookupError:
+            # the worker has exited since pgrep was run
+            pass
+    logger.info(f"karp-s-backend configuration reloaded in {len(worker_pids)} workers")
+
+
+def build_text_indexes(config: Env, resource_ids: list[str]):
+    snapshot = ConfigRegistry(config).get()
+    for resource_id in resource_ids or snapshot.resources:
+        if resource_id not in snapshot.resources:
+            raise RuntimeError(f"karp-s-cli: resource {resource_id} does not exist")
+        create_text_indexes(config, snapshot.main_config, snapshot.resources[resource_id])
+        logger.info(f"text indexes built for {resource_id}")
+
+
+def build_resource_indexes(config: Env, resource_ids: list[str]):
+    """
+    Builds the text indexes and the cubes of the resources (all resources if none given). Searches work without
+    them (they are only used when they have been built for the current version of the resource), so failures,
+    for example when the data of a resource has not been loaded yet, are only logged.
+    """
+    snapshot = ConfigRegistry(config).get()
+    for resource_id in resource_ids or list(snapshot.resources):
+        for name, build in [("text-indexes", build_text_indexes), ("cubes", build_cubes)]:
+            try:
+                build(config, [resource_id])
+            except Exception:
+                logger.exception(f"failed to build {name} for {resource_id}, run karp-s-cli {name} {resource_id}")
+
+
+def build_cubes(config: Env, resource_ids: list[str]):
+    snapshot = ConfigRegistry(config).get()
+    if not snapshot.main_config.cubes:
+        return
+    for resource_id in resource_ids or snapshot.resources:
+        if resource_id not in snapshot.resources:
+            raise RuntimeError(f"karp-s-cli: resource {resource_id} does not exist")
+        create_cubes(config, snapshot.main_config, snapshot.resources[resource_id])
+        logger.info(f"cubes built for {resource_id}")
+
+
+def build_indexes(config: Env, resource_ids: list[str], use_log=False, create=False):
+    snapshot = ConfigRegistry(config).get()
+    for resource_id in resource_ids:
+        if resource_id not in snapshot.resources:
+            raise RuntimeError(f"karp-s-cli: resource {resource_id} does not exist")
+    resources = [snapshot.resources[resource_id] for resource_id in resource_ids or snapshot.resources]
+    sql_log = read_sql_log(config.logging_dir) if use_log else None
+    missing = find_missing_indexes(config, snapshot.main_config, resources, sql_log=sql_log)
+    if not missing:
+        logger.info("no missing indexes")
+        return
+    for index in missing:
+        logger.info(f"missing index {index.table}.{index.column} ({', '.join(sorted(index.uses))}): {index.benefit()}")
+    if create:
+        create_indexes(config, missing)
+
+
+def create_bundle(config: Env):
+    """
+    Write the pre-validated configuration bundle that the workers load instead of the YAML files
+    """
+    try:
+        bundle_path = write_bundle(config)
+    except Exception:
+        # the workers will ignore the old bundle and read the YAML files
+        logger.exception("failed to write configuration bundle, the configuration is probably invalid")
+    else:
+        logger.info(f"wrote configuration bundle: {bundle_path}")
+
+
 def reconfigure(main_dir: Path, repo, ignore_labels=False) -> bool:
     for path in glob.glob(str(main_dir / "resources/*")):
         Path(path).unlink()
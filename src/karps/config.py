@@ -1,9 +1,16 @@
 from contextlib import contextmanager
-from dataclasses import dataclass
+from dataclasses import dataclass, field as dataclass_field
 import functools
+import hashlib
+import io
+import logging
 import os
 from pathlib import Path
-from typing import Any, Iterable, Iterator, Sequence
+import pickle
+import threading
+import time
+from types import MappingProxyType
+from typing import Any, Iterable, Iterator, Literal, Mapping, Sequence
 import environs
 import glob
 
@@ -13,6 +20,11 @@ from pydantic import ConfigDict, RootModel, Field as PydanticField, SerializerFu
 import yaml
 
 from karps.models import BaseModel
+from karps.util.cache import LRUCache
+from karps.util.git import GitRepo
+
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -27,6 +39,19 @@ class Env:
     auth_jwt_pubkey_path: Path | None = None
     sbauth_url: str | None = None
     sbauth_api_key: str | None = None
+    # if set, statements that the database estimates to examine more rows than this are rejected. The budget is per
+    # statement, not per resource: the counts of all resources of a /search are one statement (see union_counts),
+    # so the estimates of the resources are added and compared with the budget together
+    query_cost_budget: int | None = None
+    # use server-side prepared statements, see karps.database.database.PreparedStatementCursor
+    prepared_statements: bool = False
+    # fetch the hits of a page from all resources in one statement, see karps.database.query.union_data_queries
+    merge_page_queries: bool = False
+    # fetch the values of collection fields for the hits of a page after the page, see SQLQuery.defer_data_joins
+    two_phase_fetch: bool = False
+    # pages that start at this offset or later in a resource are fetched with a deferred join,
+    # see karps.database.query.SQLQuery.to_deferred_join_string
+    deferred_join_offset: int | None = None
 
 
 @functools.cache
@@ -54,6 +79,11 @@ def get_env() -> Env:
     _set_if_present(kwargs, "AUTH_JWT_PUBKEY_PATH", env.path)
     _set_if_present(kwargs, "SBAUTH_URL", env.str)
     _set_if_present(kwargs, "SBAUTH_API_KEY", env.str)
+    _set_if_present(kwargs, "QUERY_COST_BUDGET", env.int)
+    _set_if_present(kwargs, "PREPARED_STATEMENTS", env.bool)
+    _set_if_present(kwargs, "MERGE_PAGE_QUERIES", env.bool)
+    _set_if_present(kwargs, "TWO_PHASE_FETCH", env.bool)
+    _set_if_present(kwargs, "DEFERRED_JOIN_OFFSET", env.int)
 
     return Env(**kwargs)
 
@@ -84,6 +114,20 @@ class ConfigField(BaseModel):
     protected_metadata: bool = PydanticField(
         default=False, description="The field is only available for users with access"
     )
+    epsilon: float | None = PydanticField(
+        default=None,
+        description="For float fields, values within epsilon of the value in a query are equal to it (default 0.01).",
+    )
+    text_indexes: list[Literal["reverse", "trigram", "fulltext"]] = PydanticField(
+        default_factory=list,
+        description="For text fields, extra indexes built by `karp-s-cli text-indexes`. `reverse` is used for "
+        "endswith-queries, `trigram` for contains-queries and `fulltext` for freetext-queries.",
+    )
+    contains_mode: Literal["like", "fulltext"] = PydanticField(
+        default="like",
+        description="With `fulltext` (needs the fulltext index), contains-queries use the fulltext index and only find "
+        "the value at the start of a word.",
+    )
 
     def model_post_init(self, _):
         if self.label is None:
@@ -102,6 +146,10 @@ class ConfigField(BaseModel):
 
         # only include if true
         data.pop("protected_metadata", None)
+        # only used for queries
+        data.pop("epsilon", None)
+        data.pop("text_indexes", None)
+        data.pop("contains_mode", None)
 
         return data
 
@@ -153,9 +201,9 @@ class ResourceConfig(BaseModel):
         description="The tags for this resource, see top-level `tags`, for tag labels and description.",
     )
 
-    @property
-    def field_names(self):
-        return [resource_field.name for resource_field in self.fields]
+    @functools.cached_property
+    def field_names(self) -> frozenset[str]:
+        return frozenset(resource_field.name for resource_field in self.fields)
 
 
 class Tag(BaseModel):
@@ -171,9 +219,40 @@ class ConfigResponse(BaseModel):
     fields: dict[str, ConfigField] = PydanticField(..., description="All fields available in this instance.")
 
 
+class Cube(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    name: str = PydanticField(..., description="Used in the name of the summary tables, `<resource_id>__cube__<name>`.")
+    compile: list[str] = PydanticField(default_factory=list, description="The compile fields of the /count requests.")
+    columns: list[str] = PydanticField(
+        default_factory=list, description="The column fields (and cell fields) of the /count requests."
+    )
+
+    @functools.cached_property
+    def fields(self) -> frozenset[str]:
+        """
+        The fields that the hits are grouped on. /count always groups on resource_id, for the total row.
+        """
+        return frozenset([*self.compile, *self.columns, "resource_id"])
+
+
 class MainConfig(BaseModel):
     tags: dict[str, Tag]
     fields: dict[str, Field]
+    cubes: list[Cube] = PydanticField(
+        default_factory=list,
+        description="Counts that are precomputed by `karp-s-cli cubes`, used by /count requests without q.",
+    )
+
+    def get_cube(self, fields: Iterable[str]) -> "Cube | None":
+        """
+        The cube with the counts of the groups of fields, if there is one
+        """
+        fields = frozenset(fields)
+        for cube in self.cubes:
+            if cube.fields == fields:
+                return cube
+        return None
 
 
 @contextmanager
@@ -243,57 +322,342 @@ def load_config(env: Env) -> MainConfig:
     return MainConfig(**main)
 
 
-def format_hit(
-    main_config: MainConfig, resource_config: ResourceConfig, hit: list[str | int | bool | None]
-) -> dict[str, object]:
-    field_lookup = main_config.fields
+def get_config_version(env: Env) -> str:
+    """
+    A cheap fingerprint of the configuration directory. karp-s-cli commits every change to the
+    config repo, so HEAD changes whenever a resource is added or removed. The modification times
+    of config.yaml, fields.yaml, the resources directory and the newest resource file catch changes
+    made by hand (or when the directory is not a git repo), also when a resource file is edited in place.
+    """
+    config_dir = Path(env.base_path) / "config"
+    parts = [GitRepo(config_dir).head() or ""]
+    for path in (config_dir, config_dir / "config.yaml", config_dir / "fields.yaml", config_dir / "resources"):
+        try:
+            parts.append(str(path.stat().st_mtime_ns))
+        except OSError:
+            parts.append("-")
+    resource_mtimes = []
+    for path in (config_dir / "resources").glob("*.yaml"):
+        try:
+            resource_mtimes.append(path.stat().st_mtime_ns)
+        except OSError:
+            # removed since the glob
+            pass
+    parts.append(str(max(resource_mtimes)) if resource_mtimes else "-")
+    return ":".join(parts)
+
+
+@dataclass(frozen=True)
+class SerializedConfigResponse:
+    body: bytes
+    etag: str
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """
+    The main configuration and all resource configurations, loaded at the same time. A snapshot is
+    never changed, a new one is created when the configuration changes.
+    """
+
+    version: str
+    main_config: MainConfig
+    resources: dict[str, ResourceConfig]
+    # schemas for the resource sets that has been requested, see get_schema
+    schemas: LRUCache[frozenset[str], "ResourceSchema"] = dataclass_field(
+        default_factory=lambda: LRUCache(maxsize=256), repr=False, compare=False
+    )
+    # serialized /config responses, see get_config_response
+    config_responses: LRUCache[frozenset[str], "SerializedConfigResponse"] = dataclass_field(
+        default_factory=lambda: LRUCache(maxsize=64), repr=False, compare=False
+    )
+    # SQL statements per request signature, see karps.search
+    sql_queries: LRUCache[tuple, Any] = dataclass_field(
+        default_factory=lambda: LRUCache(maxsize=1024), repr=False, compare=False
+    )
 
-    def fmt():
-        for resource_field, val in zip(resource_config.fields, hit):
-            field = field_lookup[resource_field.name]
-            yield field.name, val
+    @functools.cached_property
+    def protected_resource_ids(self) -> frozenset[str]:
+        """
+        The resources that affects the contents of /config if the user has access to them
+        """
+        resource_ids = {rc.resource_id for rc in self.resources.values() if rc.protected_metadata}
+        for field in self.main_config.fields.values():
+            if field.protected_metadata:
+                resource_ids.update(field.resource_id)
+        return frozenset(resource_ids)
+
+    def get_config_response(self, allowed: Iterable[str] = ()) -> "SerializedConfigResponse":
+        """
+        Returns the /config response for a user with access to allowed. Users that have access to the
+        same protected resources get the same response, so it is only serialized once per such set.
+        """
+        scope = self.protected_resource_ids.intersection(allowed)
+        return self.config_responses.get_or_create(scope, lambda: self._serialize_config_response(scope))
+
+    def _serialize_config_response(self, scope: frozenset[str]) -> "SerializedConfigResponse":
+        resources = list(self.get_resource_configs(allowed=scope))
+        fields = get_allowed_fields(self.main_config, allowed=scope)
+        response = ConfigResponse(tags=self.main_config.tags, fields=fields, resources=resources)
+        body = response.model_dump_json(by_alias=True, exclude_unset=True).encode("utf-8")
+        max_updated = max((rc.updated for rc in resources), default=0)
+        digest = hashlib.sha1(":".join([self.version, *sorted(scope)]).encode("utf-8")).hexdigest()[:16]
+        return SerializedConfigResponse(body=body, etag=f'"{max_updated}-{digest}"')
+
+    def get_schema(self, resources: Sequence[ResourceConfig]) -> "ResourceSchema":
+        return self.schemas.get_or_create(
+            frozenset(resource.resource_id for resource in resources),
+            lambda: ResourceSchema.build(self.main_config, resources),
+        )
+
+    def get_resource_config(self, resource_id: str) -> ResourceConfig:
+        try:
+            return self.resources[resource_id]
+        except KeyError:
+            raise errors.UserError("One or more of the resources are missing")
+
+    def get_resource_configs(self, restrict=True, allowed: Sequence[str] = ()) -> Iterator[ResourceConfig]:
+        """
+        See get_resource_configs for restrict and allowed
+        """
+        for rc in self.resources.values():
+            if not (restrict and rc.protected_metadata and rc.resource_id not in allowed):
+                yield rc
 
-    return dict(fmt())
 
+# bump when the layout of the bundle changes
+BUNDLE_FORMAT_VERSION = 1
 
-def ensure_fields_exist(resources: list[ResourceConfig], fields: Iterable[str]):
+
+def get_bundle_path(env: Env) -> Path:
+    # kept outside of the config directory, since it must not affect get_config_version
+    return Path(env.base_path) / "config.bundle"
+
+
+def _get_models_fingerprint() -> tuple:
     """
-    Used in statistics for compile/column param. Queries are allowed to use fields not available in all resources
+    Pickled models can only be loaded by code with the same model fields
     """
-    for resource in resources:
-        for field in fields:
-            if field not in ("resource_id", "entry_word") and field not in resource.field_names:
-                raise errors.UserError(f"{field} does not exist in {resource.resource_id}")
+    models = (MainConfig, Cube, Field, ConfigField, Tag, ResourceConfig, ResourceField, EntryWord)
+    return tuple((model.__name__, tuple(model.model_fields)) for model in models)
 
 
-def get_bool_fields(main_config: MainConfig, resources: list[ResourceConfig]) -> Iterable[str]:
-    fields: set[str] = set()
-    for resource in resources:
-        for resource_field in resource.fields:
-            if main_config.fields[resource_field.name].type == "bool":
-                fields.add(resource_field.name)
-    return fields
+def write_bundle(env: Env) -> Path:
+    """
+    Validates the YAML configuration and writes it as a pickle that the workers can load
+    without parsing and validating YAML. Used by karp-s-cli after each change of the configuration.
+    """
+    version = get_config_version(env)
+    snapshot = load_yaml_snapshot(env, version)
+    header = (BUNDLE_FORMAT_VERSION, _get_models_fingerprint(), version)
+    payload = (snapshot.main_config, snapshot.resources)
+    bundle_path = get_bundle_path(env)
+    tmp_path = bundle_path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as fp:
+        pickle.dump(header, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(payload, fp, protocol=pickle.HIGHEST_PROTOCOL)
+    # replace is atomic, so a worker never reads a half-written bundle
+    tmp_path.replace(bundle_path)
+    return bundle_path
+
+
+def load_bundle_snapshot(env: Env, version: str) -> ConfigSnapshot | None:
+    """
+    Returns None if the bundle is missing or was not created from the current configuration.
+    """
+    try:
+        data = get_bundle_path(env).read_bytes()
+    except OSError:
+        return None
+    buffer = io.BytesIO(data)
+    try:
+        header = pickle.load(buffer)
+        if header != (BUNDLE_FORMAT_VERSION, _get_models_fingerprint(), version):
+            return None
+        main_config, resources = pickle.load(buffer)
+    except Exception:
+        logger.warning("Failed to load config bundle, using YAML configuration", exc_info=True)
+        return None
+    return ConfigSnapshot(version=version, main_config=main_config, resources=resources)
 
 
-def get_collection_fields(main_config: MainConfig, resources: list[ResourceConfig]) -> Iterable[str]:
-    fields: set[str] = set()
-    for resource in resources:
-        for resource_field in resource.fields:
-            if main_config.fields[resource_field.name].collection:
-                fields.add(resource_field.name)
-    return fields
+def load_yaml_snapshot(env: Env, version: str) -> ConfigSnapshot:
+    main_config = load_config(env)
+    resources = {rc.resource_id: rc for rc in get_resource_configs(env, restrict=False)}
+    return ConfigSnapshot(version=version, main_config=main_config, resources=resources)
 
 
-def get_table_fields(main_config: MainConfig, resources: list[ResourceConfig]) -> dict[str, list[str]]:
-    fields: dict[str, list[str]] = {}
-    for resource in resources:
-        for resource_field in resource.fields:
-            field = main_config.fields[resource_field.name]
-            if field.type == "table":
-                if resource_field.name in fields:
-                    raise errors.UserError(
-                        f"{field} has different sub-fields in selected resources ({field.fields.keys()} vs. {fields[resource_field.name]})"
-                    )
-                else:
-                    fields[resource_field.name] = list(field.fields.keys())
-    return fields
+def load_snapshot(env: Env, version: str) -> ConfigSnapshot:
+    """
+    Use the bundle written by karp-s-cli if it is up to date, otherwise the YAML files
+    """
+    return load_bundle_snapshot(env, version) or load_yaml_snapshot(env, version)
+
+
+class ConfigRegistry:
+    """
+    Keeps the configuration of the process in memory. The configuration files are only parsed
+    again when the fingerprint of the config directory (see get_config_version) changes or
+    when invalidate has been called. The fingerprint is computed at most once per check_interval
+    seconds, karp-s-cli also calls invalidate (with RELOAD_SIGNAL) after each change.
+
+    The new snapshot is created before it replaces the old one, so a request that has gotten a
+    snapshot can keep using it.
+    """
+
+    def __init__(self, env: Env, check_interval: float = 1.0):
+        self.env = env
+        self.check_interval = check_interval
+        self._snapshot: ConfigSnapshot | None = None
+        self._invalidated = False
+        # time.monotonic() when the fingerprint was last computed
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """
+        Makes the next call to get load the configuration, even if the config version is unchanged.
+        Only sets a flag, so it is safe to call from a signal handler.
+        """
+        self._invalidated = True
+
+    def get(self) -> ConfigSnapshot:
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and not self._invalidated and now - self._checked_at < self.check_interval:
+            return snapshot
+        version = get_config_version(self.env)
+        self._checked_at = now
+        if snapshot is None or self._invalidated or snapshot.version != version:
+            with self._lock:
+                # another thread may have reloaded while we were waiting for the lock
+                snapshot = self._snapshot
+                if snapshot is None or self._invalidated or snapshot.version != version:
+                    # reset before loading, so that an invalidation during loading causes another reload
+                    self._invalidated = False
+                    old_snapshot = self._snapshot
+                    snapshot = load_snapshot(self.env, version)
+                    self._snapshot = snapshot
+                    if old_snapshot is not None:
+                        stats = old_snapshot.sql_queries.stats()
+                        logger.info(
+                            f"configuration reloaded, SQL cache of previous configuration: {stats.hits} hits, "
+                            f"{stats.misses} misses (hit rate {stats.hit_rate:.2f})"
+                        )
+        return snapshot
+
+
+@dataclass(frozen=True)
+class ResourceSchema:
+    """
+    Field information for a set of resources, built once (see ConfigSnapshot.get_schema)
+    and used instead of scanning the fields of each resource for every request.
+    """
+
+    # resource_id -> the fields available in the resource
+    field_names: Mapping[str, frozenset[str]]
+    # resource_id -> the keys of the entry for each column in a hit, see format_hit
+    hit_keys: Mapping[str, tuple[str, ...]]
+    bool_fields: frozenset[str]
+    collection_fields: frozenset[str]
+    # field name -> names of the sub-fields
+    table_fields: Mapping[str, tuple[str, ...]]
+
+    @classmethod
+    def build(cls, main_config: MainConfig, resources: Iterable[ResourceConfig]) -> "ResourceSchema":
+        field_names = {}
+        hit_keys = {}
+        bool_fields: set[str] = set()
+        collection_fields: set[str] = set()
+        table_fields: dict[str, tuple[str, ...]] = {}
+        for resource in resources:
+            field_names[resource.resource_id] = resource.field_names
+            keys = []
+            for resource_field in resource.fields:
+                field = main_config.fields[resource_field.name]
+                keys.append(field.name)
+                if field.type == "bool":
+                    bool_fields.add(field.name)
+                if field.collection:
+                    collection_fields.add(field.name)
+                if field.type == "table":
+                    if field.name in table_fields:
+                        raise errors.UserError(
+                            f"{field} has different sub-fields in selected resources ({field.fields.keys()} vs. {table_fields[field.name]})"
+                        )
+                    table_fields[field.name] = tuple(field.fields.keys())
+            hit_keys[resource.resource_id] = tuple(keys)
+        return cls(
+            field_names=MappingProxyType(field_names),
+            hit_keys=MappingProxyType(hit_keys),
+            bool_fields=frozenset(bool_fields),
+            collection_fields=frozenset(collection_fields),
+            table_fields=MappingProxyType(table_fields),
+        )
+
+
+def format_hit(schema: ResourceSchema, resource_id: str, hit: Sequence[object]) -> dict[str, object]:
+    return dict(zip(schema.hit_keys[resource_id], hit))
+
+
+# (resource_id, field, index) -> the updated timestamp of the resource when the index was built, see
+# karps.database.text_index.get_text_index_versions
+type TextIndexVersions = Mapping[tuple[str, str, str], int]
+
+
+def _is_usable(resource_config: ResourceConfig, field: str, index: str, versions: TextIndexVersions) -> bool:
+    version = versions.get((resource_config.resource_id, field, index))
+    if version is None:
+        return False
+    # the reverse column and the fulltext index are kept up to date by the database, the trigram table is not
+    return index != "trigram" or version == resource_config.updated
+
+
+def with_text_indexes(
+    main_config: MainConfig, resource_config: ResourceConfig, versions: TextIndexVersions | None
+) -> MainConfig:
+    """
+    main_config, with only the text indexes that have been built for the resource (and, for trigram tables, not
+    since the resource was updated) in the fields, so that queries use LIKE instead of missing or outdated indexes.
+    Without versions, all the indexes in the configuration are used.
+    """
+    if versions is None:
+        return main_config
+    fields = {}
+    for resource_field in resource_config.fields:
+        field = main_config.fields.get(resource_field.name)
+        if field is None or not field.text_indexes:
+            continue
+        text_indexes = [
+            index for index in field.text_indexes if _is_usable(resource_config, field.name, index, versions)
+        ]
+        if text_indexes != field.text_indexes:
+            update: dict[str, object] = {"text_indexes": text_indexes}
+            if "fulltext" not in text_indexes:
+                update["contains_mode"] = "like"
+            fields[field.name] = field.model_copy(update=update)
+    if not fields:
+        return main_config
+    return main_config.model_copy(update={"fields": {**main_config.fields, **fields}})
+
+
+def uses_text_indexes(main_config: MainConfig, resources: Iterable[ResourceConfig]) -> bool:
+    """
+    If any of the fields of resources has text indexes configured
+    """
+    return any(
+        main_config.fields[resource_field.name].text_indexes
+        for resource_config in resources
+        for resource_field in resource_config.fields
+        if resource_field.name in main_config.fields
+    )
+
+
+def ensure_fields_exist(schema: ResourceSchema, fields: Iterable[str]):
+    """
+    Used in statistics for compile/column param. Queries are allowed to use fields not available in all resources
+    """
+    for resource_id, field_names in schema.field_names.items():
+        for field in fields:
+            if field not in ("resource_id", "entry_word") and field not in field_names:
+                raise errors.UserError(f"{field} does not exist in {resource_id}")
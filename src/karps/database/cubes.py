@@ -0,0 +1,88 @@
+import logging
+
+import mysql.connector
+from mysql.connector import errorcode
+
+from karps.config import Cube, Env, MainConfig, ResourceConfig
+from karps.database.database import get_cursor, get_search
+from karps.database.query import SQLQuery, select
+from karps.query.query import NullQuery
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["create_cubes", "cube_queries", "get_cube_versions"]
+
+# the version of each cube table, the updated timestamp of the resource config it was built from
+CUBES_TABLE = "__cubes"
+
+
+def cube_table(resource_id: str, cube: Cube) -> str:
+    return f"{resource_id}__cube__{cube.name}"
+
+
+def create_cubes(env: Env, main_config: MainConfig, resource_config: ResourceConfig):
+    """
+    Builds a summary table for each cube (MainConfig.cubes): the entries of the resource counted per group of
+    the cube's fields, the same rows as the innermost level of group_counts. /count requests without q that
+    group on the same fields sum the rows of the tables instead of counting the entries.
+
+    A table is used as long as the resource config has the same updated timestamp as when it was built, so the
+    cubes must be rebuilt when the data of a resource is loaded or updated.
+    """
+    with get_cursor(env) as cursor:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS `{CUBES_TABLE}` (`resource_id` VARCHAR(100) NOT NULL,"
+            " `cube` VARCHAR(100) NOT NULL, `updated` BIGINT NOT NULL, PRIMARY KEY (`resource_id`, `cube`))"
+        )
+        for cube in main_config.cubes:
+            table = cube_table(resource_config.resource_id, cube)
+            fields = sorted(cube.fields)
+            missing = [field for field in fields if field != "resource_id" and field not in main_config.fields]
+            if missing:
+                raise RuntimeError(f"cube {cube.name} uses fields that do not exist: {', '.join(missing)}")
+            _, [sql_q] = get_search(main_config, [resource_config], NullQuery(), selection=fields)
+            counts = select([("COUNT(*)", "count")] + [(field, None) for field in fields])
+            sql, params = counts.from_inner_query([(resource_config, sql_q)]).group_by(fields).to_string()[0]
+            cursor.execute(f"CREATE OR REPLACE TABLE `{table}` AS {sql}", params)
+            cursor.execute(
+                f"REPLACE INTO `{CUBES_TABLE}` (`resource_id`, `cube`, `updated`) VALUES (%s, %s, %s)",
+                (resource_config.resource_id, cube.name, resource_config.updated),
+            )
+            logger.info(f"created {table}")
+        cursor.execute("COMMIT")
+
+
+def get_cube_versions(env: Env, cube: Cube) -> dict[str, int]:
+    """
+    The resources that the cube has been built for, with the updated timestamp of the resource config at the time
+    """
+    with get_cursor(env) as cursor:
+        try:
+            cursor.execute(f"SELECT `resource_id`, `updated` FROM `{CUBES_TABLE}` WHERE `cube` = %s", (cube.name,))
+        except mysql.connector.Error as e:
+            # no cubes have been built
+            if e.errno == errorcode.ER_NO_SUCH_TABLE:
+                return {}
+            raise
+        return {str(resource_id): int(str(updated)) for resource_id, updated in cursor.fetchall()}
+
+
+def cube_queries(
+    cube: Cube, resources: list[ResourceConfig], versions: dict[str, int]
+) -> list[tuple[ResourceConfig | None, SQLQuery]] | None:
+    """
+    Queries for the counted groups of each resource, from the cube tables, for group_counts. None if the cube
+    has not been built for a resource since its config was updated.
+    """
+    if any(versions.get(resource.resource_id) != resource.updated for resource in resources):
+        return None
+    fields = sorted(cube.fields)
+    return [
+        (
+            None,
+            select([("count", None)] + [(field, None) for field in fields]).from_table(
+                cube_table(resource.resource_id, cube)
+            ),
+        )
+        for resource in resources
+    ]
@@ -1,18 +1,28 @@
+from collections import OrderedDict, defaultdict
 from contextlib import contextmanager
-import json
 import sys
+import threading
 import time
-from typing import Any, Iterable, Iterator, Sequence, cast
+from typing import Any, Iterable, Iterator, Mapping, Sequence, cast
 import mysql.connector
 from mysql.connector.abstracts import MySQLConnectionAbstract
-from mysql.connector.cursor import MySQLCursor
+from mysql.connector.cursor import MySQLCursor, MySQLCursorPrepared
 
-from karps.config import Env, MainConfig, ResourceConfig
-from karps.errors.errors import GroupConcatError, UserError
+from karps.config import Env, MainConfig, ResourceConfig, ResourceSchema, TextIndexVersions, with_text_indexes
+from karps.errors.errors import GroupConcatError, QueryCostError, UserError
 from karps.logging import get_sql_logger
-from karps.models import CountRequest, Request
-from karps.query.query import Query, get_query
-from karps.database.query import ELEMENT_SEPARATOR, FIELD_SEPARATOR, SQLQuery, select
+from karps.query.query import Query, ReadyQuery, get_query, normalize_query
+from karps.database.query import (
+    ELEMENT_SEPARATOR,
+    FIELD_SEPARATOR,
+    SQLQuery,
+    data_join_query,
+    limit_clause,
+    select,
+    shape_fingerprint,
+    union_counts,
+    union_data_queries,
+)
 
 
 def get_connection(config: Env) -> MySQLConnectionAbstract:
@@ -45,7 +55,151 @@ def get_cursor(config: Env) -> Iterator[MySQLCursor]:
         connection.close()
 
 
-def fetchall(cursor: MySQLCursor, sql: str, params: tuple[Any]) -> tuple[list[str], list[tuple]]:
+def estimate_rows_examined(cursor: MySQLCursor, sql: str, params: tuple[Any]) -> int:
+    """
+    Uses EXPLAIN to estimate the number of rows the database must examine for sql. The tables in a
+    SELECT are joined with nested loops, so the estimates for each table are multiplied, and the
+    SELECTs (subqueries, CTEs, UNION parts) are added.
+    """
+    cursor.execute(f"EXPLAIN {sql}", params)
+    columns = [desc[0] for desc in cursor.description or ()]
+    rows_per_select: dict[Any, int] = defaultdict(lambda: 1)
+    for row in cursor.fetchall():
+        plan = dict(zip(columns, row))
+        rows_per_select[plan["id"]] *= max(int(str(plan["rows"] or 1)), 1)
+    return sum(rows_per_select.values())
+
+
+def estimate_count(cursor: MySQLCursor, count_sql: str, params: tuple[Any], table: str) -> int:
+    """
+    Uses the table statistics (EXPLAIN EXTENDED) to estimate the number of rows that count_sql, a count query from
+    SQLQuery.to_string on table, counts: the rows the database expects to read from table times the fraction of
+    them that are expected to match the WHERE clause.
+    """
+    cursor.execute(f"EXPLAIN EXTENDED {count_sql}", params)
+    columns = [desc[0] for desc in cursor.description or ()]
+    estimate = 0
+    for row in cursor.fetchall():
+        plan = dict(zip(columns, row))
+        if plan["table"] == table and not estimate:
+            filtered = float(str(plan.get("filtered") or 100))
+            estimate = round(int(str(plan["rows"] or 0)) * filtered / 100)
+    return estimate
+
+
+def estimate_counts(config: Env, resources: Sequence[ResourceConfig], count_queries: Sequence[ReadyQuery]) -> list[int]:
+    """
+    Estimates the number of hits of the count query of each resource, see estimate_count. An estimate is never
+    larger than the size of the resource.
+    """
+    with get_query_cursor(config) as cursor:
+        return [
+            min(estimate_count(cursor, count_sql, count_params, resource_config.resource_id), resource_config.size)
+            for resource_config, (count_sql, count_params) in zip(resources, count_queries)
+        ]
+
+
+class PreparedStatementCursor:
+    """
+    Used instead of a MySQLCursor when PREPARED_STATEMENTS is set. Each statement is prepared on the server
+    the first time a statement with its shape (see shape_fingerprint) is executed on the connection, after that
+    only the params are sent. A MySQLCursorPrepared only holds one statement, so there is one per shape, the least
+    recently used are closed when there are more than maxsize.
+    """
+
+    def __init__(self, connection: MySQLConnectionAbstract, maxsize: int = 256):
+        self.connection = connection
+        self.maxsize = maxsize
+        # the SQL that was prepared and the cursor for each shape
+        self._statements: OrderedDict[str, tuple[str, MySQLCursorPrepared]] = OrderedDict()
+        self._cursor: MySQLCursorPrepared | None = None
+
+    def _get_statement(self, sql: str) -> tuple[str, MySQLCursorPrepared]:
+        key = shape_fingerprint(sql)
+        if key in self._statements:
+            self._statements.move_to_end(key)
+            return self._statements[key]
+        statement = (sql, cast(MySQLCursorPrepared, self.connection.cursor(prepared=True)))
+        self._statements[key] = statement
+        while len(self._statements) > self.maxsize:
+            _, (_, cursor) = self._statements.popitem(last=False)
+            # also deallocates the statement on the server
+            cursor.close()
+        return statement
+
+    def execute(self, sql: str, params: tuple[Any, ...] = ()):
+        prepared_sql, cursor = self._get_statement(sql)
+        self._cursor = cursor
+        try:
+            # the connector only reuses the prepared statement when given the same str object as before
+            cursor.execute(prepared_sql, params)
+        except (mysql.connector.InterfaceError, mysql.connector.OperationalError):
+            if self.connection.is_connected():
+                raise
+            # the connection was lost (for example wait_timeout), the statements are gone with it
+            self._statements.clear()
+            self.connection.reconnect()
+            self.execute(sql, params)
+
+    def fetchall(self):
+        return cast(MySQLCursorPrepared, self._cursor).fetchall()
+
+    @property
+    def description(self):
+        return self._cursor.description if self._cursor else None
+
+    @property
+    def statement(self):
+        return self._cursor.statement if self._cursor else None
+
+    @property
+    def warnings(self):
+        return self._cursor.warnings if self._cursor else None
+
+    def close(self):
+        for _, cursor in self._statements.values():
+            cursor.close()
+        self._statements.clear()
+
+
+# each thread of a worker keeps a connection with its prepared statements
+_prepared_cursors = threading.local()
+
+
+@contextmanager
+def get_query_cursor(config: Env) -> Iterator[MySQLCursor]:
+    """
+    The cursor used for the queries of /search and /count. Same as get_cursor, unless
+    PREPARED_STATEMENTS is set, then the thread's PreparedStatementCursor is used.
+    """
+    if not config.prepared_statements:
+        with get_cursor(config) as cursor:
+            yield cursor
+        return
+    cursor = getattr(_prepared_cursors, "cursor", None)
+    if cursor is None:
+        connection = get_connection(config)
+        connection.get_warnings = True
+        # the connection is kept between requests, without autocommit each request would see old data
+        connection.autocommit = True
+        cursor = PreparedStatementCursor(connection)
+        _prepared_cursors.cursor = cursor
+    # PreparedStatementCursor has the methods of MySQLCursor used by fetchall
+    yield cast(MySQLCursor, cursor)
+
+
+def fetchall(
+    cursor: MySQLCursor, sql: str, params: tuple[Any], cost_budget: int | None = None
+) -> tuple[list[str], list[tuple]]:
+    """
+    Executes sql and returns the column names and rows. If cost_budget is given, raises QueryCostError without
+    executing sql if the estimated number of examined rows is larger than cost_budget, see estimate_rows_examined.
+    """
+    if cost_budget is not None:
+        estimate = estimate_rows_examined(cursor, sql, params)
+        if estimate > cost_budget:
+            sql_logger.info("", {"q": sql, "rejected": True, "estimate": estimate})
+            raise QueryCostError(estimate, cost_budget)
     execute_took = "-1"
     fetchall_took = "-1"
     warnings = ()
@@ -74,13 +228,13 @@ def fetchall(cursor: MySQLCursor, sql: str, params: tuple[Any]) -> tuple[list[st
         )
 
 
-def _check_sort_allowed(resource_config, sort):
+def _check_sort_allowed(resource_id: str, field_names: frozenset[str], sort):
     """
     Raise if any field name used in sort is not available in the given resource
     """
     for field, _ in sort:
-        if field not in resource_config.field_names:
-            raise UserError(f'Sort by "{field}" is not supported in "{resource_config.resource_id}"')
+        if field not in field_names:
+            raise UserError(f'Sort by "{field}" is not supported in "{resource_id}"')
 
 
 def _get_data_selection(resource_config: ResourceConfig, selection: Iterable[str]) -> list[tuple[str, str | None]]:
@@ -99,27 +253,43 @@ def _get_data_selection(resource_config: ResourceConfig, selection: Iterable[str
         sel.append((f"'{resource_config.resource_id}'", "resource_id"))
     if "entry_word" in selection:
         sel.append((resource_config.entry_word.field, "entry_word"))
+    if "__id" in selection:
+        # after the fields, format_hit only uses the columns of the fields
+        sel.append(("__id", None))
     return sel
 
 
 def _get_search(
     main_config: MainConfig,
+    schema: ResourceSchema,
     resource_config: ResourceConfig,
     q: Query,
     selection: Iterable[str] = ("*"),
     sort: Sequence[tuple[str, str]] = (),
+    text_index_versions: TextIndexVersions | None = None,
 ) -> SQLQuery | None:
     fields = main_config.fields
+    field_names = schema.field_names[resource_config.resource_id]
 
     sel = _get_data_selection(resource_config, selection)
     sql_q = select(sel).from_table(resource_config.resource_id)
 
     # get sql where clause from query
-    query_fields, main_query, collection_queries = get_query(main_config, resource_config.entry_word.field, q)
+    # freetext-queries search the fields of the resource that have a fulltext index (LIKE is used if the index has not
+    # been built, see to_where_clause)
+    freetext_fields = [
+        resource_field.name
+        for resource_field in resource_config.fields
+        if resource_field.name in field_names and "fulltext" in fields[resource_field.name].text_indexes
+    ]
+    q = normalize_query(main_config, q, resource_config.entry_word.field, freetext_fields=freetext_fields)
+    # the clauses only use the text indexes that have been built for the resource
+    query_config = with_text_indexes(main_config, resource_config, text_index_versions)
+    query_fields, main_query, collection_queries = get_query(query_config, resource_config.entry_word.field, q)
 
     ignore_resource = False
     for field in query_fields:
-        if field not in resource_config.field_names:
+        if field not in field_names:
             # if a query is posed with a field that is not supported in the resource, ignore the resource
             ignore_resource = True
             break
@@ -147,139 +317,164 @@ def _get_search(
         sql_q.where(main_query)
 
     if sort:
-        if sort[0][0] == "_default":
-            order = sort[0][1]
-            # use the resource's default field
-            sql_q.order_by([(resource_config.entry_word.field, order)])
-        else:
-            # update any use of entryWord to the actual field
-            resource_sort = [
-                (resource_config.entry_word.field if field in ["entryWord", "entry_word"] else field, order)
-                for (field, order) in sort
-            ]
-            # check that the sort fields are available in resource
-            _check_sort_allowed(resource_config, resource_sort)
-            sql_q.order_by(resource_sort)
+        sql_q.order_by(get_resource_sort(resource_config, field_names, sort))
     return sql_q
 
 
+def get_resource_sort(
+    resource_config: ResourceConfig, field_names: frozenset[str], sort: Sequence[tuple[str, str]]
+) -> list[tuple[str, str]]:
+    """
+    The columns that the hits of resource_config are sorted on. __id is added last, so that the order is the
+    same every time and can be used for keyset pagination (see SQLQuery.after)
+    """
+    if sort[0][0] == "_default":
+        order = sort[0][1]
+        # use the resource's default field
+        resource_sort = [(resource_config.entry_word.field, order)]
+    else:
+        # update any use of entryWord to the actual field
+        resource_sort = [
+            (resource_config.entry_word.field if field in ["entryWord", "entry_word"] else field, order)
+            for (field, order) in sort
+        ]
+        # check that the sort fields are available in resource
+        _check_sort_allowed(resource_config.resource_id, field_names, resource_sort)
+    return [*resource_sort, ("__id", "asc")]
+
+
 def get_search(
     main_config: MainConfig,
     resources: list[ResourceConfig],
     q: Query,
     selection: Iterable[str] = ("*"),
     sort: Sequence[tuple[str, str]] = (),
+    schema: ResourceSchema | None = None,
+    text_index_versions: TextIndexVersions | None = None,
 ) -> tuple[list[ResourceConfig], list[SQLQuery]]:
     """
     For each resource, creates a select statement with a where clause with constraints from q
     Returns a tuple of resource IDs and corresponding queries, because it is possble that
     not all requested resources are supported for the search.
+
+    text_index_versions are the text indexes that have been built (see get_text_index_versions), the clauses
+    do not use indexes that are missing or outdated. If None, all the text indexes in the configuration are used.
     """
+    if schema is None:
+        schema = ResourceSchema.build(main_config, resources)
     res_resources = []
     res_q = []
     for resource_config in resources:
-        sql_q = _get_search(main_config, resource_config, q, selection, sort)
+        sql_q = _get_search(main_config, schema, resource_config, q, selection, sort, text_index_versions)
         if sql_q:
             res_resources.append(resource_config)
             res_q.append(sql_q)
     return res_resources, res_q
 
 
-def add_aggregation(
+def get_count_sort(compile: Sequence[str], sort: Sequence[tuple[str, str]]) -> Sequence[tuple[str, str]]:
+    """
+    The rows of /count are sorted on the fields of compile, the default sort is all of them
+    """
+    if not sort or sort[0][0] == "_default":
+        order = sort[0][1] if sort else "asc"
+        return [(field, order) for field in compile]
+    for field, _ in sort:
+        if field not in compile:
+            raise UserError(f'Sort by "{field}" is not supported in with compile: {", ".join(compile)}')
+    return sort
+
+
+def group_counts(
     queries: Sequence[tuple[ResourceConfig | None, SQLQuery]],
+    fields: Sequence[str],
+    groupings: Mapping[str, Sequence[str]],
     compile: Sequence[str],
-    column: tuple[str, str],
     sort: Sequence[tuple[str, str]] = (),
-):
-    def inner(
-        queries: Sequence[tuple[ResourceConfig | None, SQLQuery]],
-        compile: Sequence[str],
-        collect: Sequence[str] = [],
-        innermost=False,
-    ) -> SQLQuery:
-        """
-        Takes a string containing an list of SQL queries and does aggregations on
-        the fields given in columns
-
-        TODO if compile field is collection, the json_field must be expanded to as many rows as there are in the fields, use JSON_TABLE
-        each result column and the field to be presented in it must be included in the inner rows
-        """
-        if compile[-1] == "_count" if len(compile) > 0 else False:
-            sel: list[tuple[str, str | None]] = []
-        elif innermost:
-            sel = [("COUNT(*)", "count")]
-        else:
-            sel = [("IFNULL(SUM(count), 0)", "count")]
-        for c in compile:
-            if c != "_count":
-                if (c, None) not in sel:
-                    sel.append((c, None))
-        # TODO handle different sizes of collect
-        for field in collect[0:1]:
-            inner_fields = []
-            if len(collect) > 1:
-                if len(collect) > 2:
-                    raise Exception()
-                for tmpfield in collect[1:]:
-                    if tmpfield != "_count":
-                        inner_fields.append(f"'{tmpfield}', `entry_data`")
-            if field != "_count":
-                sel.append(
-                    (
-                        # TODO move all sql generation into karps.database.query
-                        f"CONCAT('[', GROUP_CONCAT(JSON_OBJECT('{field}', `{field}`,'count', `count`{',' + ','.join(inner_fields) if inner_fields else ''})), ']')",
-                        "`entry_data`",
-                    )
-                )
-
-        s = select(sel).from_inner_query(queries)
-        if compile and compile[-1] != "_count":
-            s.group_by(compile)
-        return s
-
-    agg_s = None
-    # columns[0][1] could be "_count", which just does _count on columns[0][0]
-    # first aggregation
-    agg_s = inner(queries, compile=list(compile) + list(column), innermost=True)
-    # second level, this will be used for data columns
-    if column:
-        agg_s = inner(
-            [(None, agg_s)],
-            compile=(list(compile) + [column[0]]),
-            collect=[column[1]],
-            innermost=column[1] == "_count",
-        )
-    # final level, adds sorting
-    s = inner([(None, agg_s)], compile=compile, collect=column)
+    count: str = "COUNT(*)",
+) -> SQLQuery:
+    """
+    Counts the hits of queries grouped on all of fields, in one pass over the hits. Each row is a group with
+    its count and the values of fields. The rows can be combined into the groups of fewer fields: for each
+    grouping (name: fields), the column name has a number that is the same for the rows that have equal values
+    for the fields, as compared by the database (with the collation of the columns, unlike in Python).
+    The rows are sorted on compile, see get_count_sort.
+
+    If queries select groups that are already counted (from the tables of a cube), count is "SUM(`count`)".
+    """
+    counts = select([(count, "count")] + [(field, None) for field in fields]).from_inner_query(queries)
+    counts.group_by(fields)
+    sel: list[tuple[str, str | None]] = [("count", None)] + [(field, None) for field in fields]
+    for name, grouping_fields in groupings.items():
+        order = ", ".join(f"`{field}`" for field in grouping_fields)
+        sel.append((f"DENSE_RANK() OVER (ORDER BY {order})", f"`{name}`"))
+    return select(sel).from_inner_query([(None, counts)]).order_by(get_count_sort(compile, sort))
+
+
+def fetch_data_joins(
+    config: Env, table: str, data_joins: Mapping[str, tuple[str | None, Sequence[str]]], ids: Sequence[Any]
+) -> dict[str, dict[Any, Any]]:
+    """
+    The values of the collection fields in data_joins (see SQLQuery.defer_data_joins) for the entries with ids, as
+    they would be selected by the data query, by column name and entry id. One query per field.
+    """
+    values: dict[str, dict[Any, Any]] = {join[0] or field: {} for field, join in data_joins.items()}
+    if not ids:
+        return values
+    ids_clause = (f"`__parent_id` IN ({', '.join(['%s'] * len(ids))})", tuple(ids))
+    with get_query_cursor(config) as cursor:
+        for join_field, join in data_joins.items():
+            sql, params = data_join_query(table, join_field, join).where(ids_clause).to_string()[0]
+            _, rows = fetchall(cursor, sql, params)
+            values[join[0] or join_field] = {parent_id: value for parent_id, value in rows}
+    return values
+
+
+def create_table_rows(keys: Iterable[str], vals: list[str]):
+    """
+    This takes a list of values to turn into objects for tables rows when field.type == "table"
+    """
+    return [dict(zip(keys, val.split(FIELD_SEPARATOR))) for val in vals]
 
-    if not sort or sort[0][0] == "_default":
-        order = sort[0][1] if sort else "asc"
-        sorts = [(field, order) for field in compile]
-        s.order_by(sorts)
-    else:
-        for field, _ in sort:
-            if field not in compile:
-                raise UserError(f'Sort by "{field}" is not supported in with compile: {", ".join(compile)}')
-        s.order_by(sort)
-    return s
+
+def decode_value(
+    column: str,
+    value: Any,
+    bool_fields: Iterable = (),
+    collection_fields: Iterable = (),
+    table_fields: Mapping[str, Sequence[str]] = {},
+) -> Any:
+    """
+    Turns the value of a field, as selected by get_search, into the value of the hit
+    """
+    if column in collection_fields:
+        vals = value.split(ELEMENT_SEPARATOR) if value else []
+        if column in table_fields:
+            # TODO does not parse booleans
+            return create_table_rows(table_fields[column], vals)
+        if column in bool_fields:
+            vals = [val == 1 for val in vals]
+        return vals
+    if column in bool_fields:
+        # parse boolean
+        return value == 1
+    return value
 
 
 def run_searches(
     config: Env,
-    sql_queries: Iterable[SQLQuery],
-    request: CountRequest,
+    sql_queries: Iterable[ReadyQuery],
     bool_fields: Iterable = (),
     collection_fields: Iterable = (),
-    table_fields: dict[str, list[str]] = {},  # TODO default val
+    table_fields: Mapping[str, Sequence[str]] = {},  # TODO default val
 ) -> Iterator[tuple[list[str], list[list[Any]]]]:
     results, _ = run_paged_searches(
         config,
-        sql_queries,
+        [(sql_query, None) for sql_query in sql_queries],
         paged=False,
         bool_fields=bool_fields,
         collection_fields=collection_fields,
         table_fields=table_fields,
-        request=request,
     )
     for columns, result in results:
         yield columns, result
@@ -287,25 +482,42 @@ def run_searches(
 
 def run_paged_searches(
     config: Env,
-    in_sql_queries: Iterable[SQLQuery],
+    sql_queries: Sequence[tuple[ReadyQuery, ReadyQuery | None]],
     size: int = 10,
     _from: int = 0,
     paged=True,
     bool_fields: Iterable = (),
     collection_fields: Iterable = (),
-    table_fields: dict[str, list[str]] = {},  # TODO default val
-    request: Request = Request(),
+    table_fields: Mapping[str, Sequence[str]] = {},  # TODO default val
+    page_columns: Sequence[tuple[Sequence[str], Sequence[tuple[str, str]]]] | None = None,
+    counts: Sequence[int] | None = None,
+    deferred_join_queries: Sequence[ReadyQuery | None] | None = None,
 ) -> tuple[Iterable[tuple[list[str], list[list[Any]]] | None], list[int]]:
-    sql_queries = [s.to_string(paged=paged) for s in in_sql_queries]
+    """
+    sql_queries are the results of SQLQuery.to_string (with paged=paged) for each resource, without size and from
 
-    # fetch the total counts for each resource/query
-    count_res: list[int] = []
-    with get_cursor(config) as cursor:
-        for _, count_query in sql_queries:
-            if count_query:
-                (count_query, params) = count_query
-                _, count_result = fetchall(cursor, count_query, params)
-                count_res.append(count_result[0][0])
+    If the number of hits of each query is already known, it is given in counts and the count queries are not run.
+
+    deferred_join_queries are the data queries as deferred joins (SQLQuery.to_deferred_join_string), they are used
+    instead of the data queries for pages that start at DEFERRED_JOIN_OFFSET or later in a resource.
+
+    If MERGE_PAGE_QUERIES is set and page_columns, the columns and order by-columns of each query (see
+    union_data_queries), are given, the data queries of a page are run as one statement.
+    """
+    # fetch the total counts for each resource/query, in one statement
+    count_queries = [count_query for _, count_query in sql_queries if count_query]
+    count_res: list[int] = list(counts) if counts is not None else []
+    # the data queries examine the same rows as the count queries, so they only need to be checked if no count
+    # query has been run (not paged or the counts are known)
+    data_cost_budget = config.query_cost_budget
+    if count_queries and counts is None:
+        data_cost_budget = None
+        count_sql, count_params = union_counts(count_queries)
+        with get_query_cursor(config) as cursor:
+            # the count query examines the same rows as the data queries
+            _, count_result = fetchall(cursor, count_sql, count_params, cost_budget=config.query_cost_budget)
+        count_by_idx = {int(str(idx)): int(str(count)) for idx, count in count_result}
+        count_res = [count_by_idx[idx] for idx in range(len(count_queries))]
 
     # if the query uses paging, be must add the limits from user supplied _from and size
     # but also count_res, which contain the number of hits in each resource
@@ -315,7 +527,7 @@ def run_paged_searches(
         total_count = 0
         query_from = _from
         # use count_res to know which queries to execute
-        for count, in_sql_query in zip(count_res, in_sql_queries):
+        for idx, (count, (data_query, _)) in enumerate(zip(count_res, sql_queries)):
             total_count += count
             # the number of rows to get from this query is min of available rows or needed rows
             query_size = min(total_count - query_from, count, max(0, size - row_count))
@@ -323,10 +535,17 @@ def run_paged_searches(
                 if query_from != 0:
                     # adapt query_from to current resource
                     query_from = count - (total_count - query_from)
-                # I think from_page is an incorrect name and from_entry/row is correct
-                sql_queries_updated.append(
-                    in_sql_query.from_page(query_from).add_size(query_size).to_string(paged=True)
-                )
+                (data_sql, data_params) = data_query
+                limit_str, limit_params = limit_clause(query_size, query_from)
+                deferred_join_query = deferred_join_queries[idx] if deferred_join_queries else None
+                if (
+                    deferred_join_query
+                    and config.deferred_join_offset is not None
+                    and query_from >= config.deferred_join_offset
+                ):
+                    # the deferred join has the limits in the page CTE, its params are last
+                    (data_sql, data_params), limit_str = deferred_join_query, ""
+                sql_queries_updated.append(((data_sql + limit_str, data_params + limit_params), None))
                 row_count += query_size
                 # only the first executed query need to have from != 0
                 query_from = 0
@@ -336,11 +555,43 @@ def run_paged_searches(
     else:
         sql_queries_updated = sql_queries
 
-    def create_table_rows(keys: Iterable[str], vals: list[str]):
-        """
-        This takes a list of values to turn into objects for tables rows when field.type == "table"
-        """
-        return [dict(zip(keys, val.split(FIELD_SEPARATOR))) for val in vals]
+    def decode_rows(result_columns: list[str], result: Sequence[Sequence[Any]]) -> list[list[Any]]:
+        new_result = []
+        for row in result:
+            new_row = []
+            for i, column in enumerate(result_columns):
+                if column == "count":
+                    new_row.append(int(row[i]))
+                else:
+                    new_row.append(decode_value(column, row[i], bool_fields, collection_fields, table_fields))
+            new_result.append(new_row)
+        return new_result
+
+    if config.merge_page_queries and page_columns and paged and sum(q is not None for q in sql_queries_updated) > 1:
+        # one statement for the page, the rows are split by the resource column
+        (union_sql, union_params), all_columns = union_data_queries(
+            [
+                (resource_query[0], *resource_columns) if resource_query else None
+                for resource_query, resource_columns in zip(sql_queries_updated, page_columns)
+            ]
+        )
+        with get_query_cursor(config) as cursor:
+            _, union_result = fetchall(cursor, union_sql, union_params, cost_budget=data_cost_budget)
+        resource_rows = defaultdict(list)
+        for row in union_result:
+            resource_rows[int(str(row[0]))].append(row[2:])
+
+        def merged_res():
+            for idx, resource_query in enumerate(sql_queries_updated):
+                if resource_query is None:
+                    yield None
+                else:
+                    result_columns = list(page_columns[idx][0])
+                    positions = [all_columns.index(column) for column in result_columns]
+                    result = [[row[pos] for pos in positions] for row in resource_rows[idx]]
+                    yield (result_columns, decode_rows(result_columns, result))
+
+        return merged_res(), count_res
 
     def res():
         # a generator to avoid fetching any data we do not need
@@ -350,57 +601,8 @@ def run_paged_searches(
                 yield None
             else:
                 (sql_query, params) = resource_query[0]
-                with get_cursor(config) as cursor:
-                    result_columns, result = fetchall(cursor, sql_query, params)
-                new_result = []
-                for row in result:
-                    new_row = []
-                    for i, column in enumerate(result_columns):
-                        if isinstance(request, CountRequest) and i > len(request.compile):
-                            # for statistics, data shown but not used in compile are returned in a column
-                            # in JSON format. in the JSON, there are counts for each level and possibly values
-                            if row[i] is None:
-                                # this can happen if there are zero hits
-                                entries_data = []
-                            else:
-                                entries_data = json.loads(str(row[i]))
-                            for elem in entries_data:
-                                for key in elem:
-                                    if key not in [request.columns[0], "count"]:
-                                        elem[key] = json.loads(str(elem[key]))
-                                        #  elem[key] is a list. Each element in elem[key] is
-                                        # an object with keys <field> and count, if <field> is a collection,
-                                        # the value must be separated
-                                        field = request.columns[1]
-                                        if field in collection_fields:
-                                            for x in elem[key]:
-                                                if x[field]:
-                                                    vals = x[field].split(ELEMENT_SEPARATOR)
-                                                    if field in table_fields:
-                                                        x[field] = create_table_rows(table_fields[field], vals)
-                                                    else:
-                                                        x[field] = vals
-                                                else:
-                                                    x[field] = []
-                            new_row.append(entries_data)
-                        elif column == "count":
-                            new_row.append(int(row[i]))
-                        elif column in collection_fields:
-                            vals = row[i].split(ELEMENT_SEPARATOR) if row[i] else []
-                            if column in table_fields:
-                                # TODO does not parse booleans
-                                new_row.append(create_table_rows(table_fields[column], vals))
-                            else:
-                                if column in bool_fields:
-                                    vals = [val == 1 for val in vals]
-                                new_row.append(vals)
-                        else:
-                            res = row[i]
-                            if column in bool_fields:
-                                # parse boolean
-                                res = res == 1
-                            new_row.append(res)
-                    new_result.append(new_row)
-                yield (result_columns, new_result)
+                with get_query_cursor(config) as cursor:
+                    result_columns, result = fetchall(cursor, sql_query, params, cost_budget=data_cost_budget)
+                yield (result_columns, decode_rows(result_columns, result))
 
     return res(), count_res
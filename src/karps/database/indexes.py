@@ -0,0 +1,174 @@
+from dataclasses import dataclass, field as dataclass_field
+import logging
+import math
+import re
+from typing import Any, Iterable
+
+from mysql.connector.cursor import MySQLCursor
+
+from karps.config import Env, MainConfig, ResourceConfig
+from karps.database.database import get_cursor
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["MissingIndex", "create_indexes", "find_missing_indexes"]
+
+# a column compared in a where clause, as written by get_query
+_WHERE_COLUMN = re.compile(r"`(\w+)`\s*(?:=|!=|<|>|LIKE\b|IN\b|BETWEEN\b|REGEXP\b|IS\b)")
+_ORDER_BY = re.compile(r"ORDER BY ((?:`\w+`(?: DESC| ASC)?(?:, )?)+)")
+_TABLE = re.compile(r"(?:FROM|JOIN) `(\w+)`")
+
+
+@dataclass
+class MissingIndex:
+    """
+    A column of a resource's tables that queries filter, sort or join on, without an index that starts with it
+    """
+
+    table: str
+    column: str
+    # query, sort and/or join
+    uses: set[str] = dataclass_field(default_factory=set)
+    rows: int = 0
+    distinct: int = 0
+    # the logged statements that use the column and the time they took
+    statements: int = 0
+    seconds: float = 0.0
+
+    @property
+    def index_name(self) -> str:
+        return f"{self.column}_idx"
+
+    def benefit(self) -> str:
+        """
+        The expected benefit of the index: a lookup of a value reads the rows with the value instead of scanning
+        the table, a sorted page is read in order instead of sorting the table
+        """
+        parts = []
+        if self.uses & {"query", "join"} and self.distinct:
+            parts.append(f"a lookup reads ~{math.ceil(self.rows / self.distinct)} rows instead of {self.rows}")
+        if "sort" in self.uses:
+            parts.append(f"a sorted page is read without sorting {self.rows} rows")
+        if self.statements:
+            parts.append(f"used by {self.statements} logged statements that took {self.seconds:.2f} s")
+        return ", ".join(parts)
+
+
+def find_missing_indexes(
+    env: Env,
+    main_config: MainConfig,
+    resources: Iterable[ResourceConfig],
+    sql_log: Iterable[dict[str, Any]] | None = None,
+) -> list[MissingIndex]:
+    """
+    Finds the columns that need an index and do not have one:
+
+    - query: the columns of the fields of a resource, in the resource table or, for collection fields, in the
+      table of the field. With sql_log (the records of the SQL logger), only the columns that the logged
+      statements filter on.
+    - sort: the column of the entry word of a resource, the default sort.
+    - join: `__parent_id` of the tables of collection fields, used to join the values to the entries.
+
+    The most expensive columns in the log come first, then the largest tables.
+    """
+    candidates = _get_candidates(main_config, resources)
+    if sql_log is not None:
+        _add_log_usage(candidates, sql_log)
+        candidates = {
+            key: candidate
+            for key, candidate in candidates.items()
+            if candidate.uses != {"query"} or candidate.statements
+        }
+    missing = []
+    with get_cursor(env) as cursor:
+        for candidate in candidates.values():
+            if _get_column_type(cursor, candidate.table, candidate.column) is None:
+                # the data of the resource has not been loaded
+                continue
+            if _is_indexed(cursor, candidate.table, candidate.column):
+                continue
+            cursor.execute(f"SELECT COUNT(*), COUNT(DISTINCT `{candidate.column}`) FROM `{candidate.table}`")
+            rows, distinct = cursor.fetchone() or (0, 0)
+            candidate.rows, candidate.distinct = int(str(rows)), int(str(distinct))
+            missing.append(candidate)
+    return sorted(missing, key=lambda candidate: (-candidate.seconds, -candidate.rows))
+
+
+def create_indexes(env: Env, missing: Iterable[MissingIndex]):
+    """
+    Creates the indexes online, the tables can be read and written while the indexes are built
+    """
+    with get_cursor(env) as cursor:
+        for index in missing:
+            column_type = _get_column_type(cursor, index.table, index.column) or ""
+            # text columns can only be indexed on a prefix
+            index_length = "(255)" if "text" in column_type or "blob" in column_type else ""
+            cursor.execute(
+                f"ALTER TABLE `{index.table}` ADD INDEX `{index.index_name}` (`{index.column}`{index_length}),"
+                " ALGORITHM=INPLACE, LOCK=NONE"
+            )
+            logger.info(f"created {index.table}.{index.index_name}")
+
+
+def _get_candidates(
+    main_config: MainConfig, resources: Iterable[ResourceConfig]
+) -> dict[tuple[str, str], MissingIndex]:
+    candidates: dict[tuple[str, str], MissingIndex] = {}
+
+    def add(table: str, column: str, use: str):
+        candidates.setdefault((table, column), MissingIndex(table, column)).uses.add(use)
+
+    for resource_config in resources:
+        resource_id = resource_config.resource_id
+        for resource_field in resource_config.fields:
+            field = main_config.fields[resource_field.name]
+            # values of collection fields are stored in a table per field
+            table = f"{resource_id}__{field.name}" if field.collection else resource_id
+            if field.collection:
+                add(table, "__parent_id", "join")
+            # the values of table fields are in the columns of the sub-fields
+            if field.type != "table":
+                add(table, field.name, "query")
+        add(resource_id, resource_config.entry_word.field, "sort")
+    return candidates
+
+
+def _add_log_usage(candidates: dict[tuple[str, str], MissingIndex], sql_log: Iterable[dict[str, Any]]):
+    for record in sql_log:
+        sql = record.get("q")
+        if not sql:
+            continue
+        tables = set(_TABLE.findall(sql))
+        columns = set(_WHERE_COLUMN.findall(sql))
+        for order_by in _ORDER_BY.findall(sql):
+            columns.update(re.findall(r"`(\w+)`", order_by))
+        # the values of collection fields are always joined on __parent_id
+        columns.add("__parent_id")
+        took = float(record.get("execute_took_s") or 0)
+        for table in tables:
+            for column in columns:
+                candidate = candidates.get((table, column))
+                if candidate:
+                    candidate.statements += 1
+                    # -1 if the statement failed
+                    candidate.seconds += max(took, 0)
+
+
+def _get_column_type(cursor: MySQLCursor, table: str, column: str) -> str | None:
+    cursor.execute(
+        "SELECT COLUMN_TYPE FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s"
+        " AND COLUMN_NAME = %s",
+        (table, column),
+    )
+    row = cursor.fetchone()
+    return str(row[0]) if row else None
+
+
+def _is_indexed(cursor: MySQLCursor, table: str, column: str) -> bool:
+    # an index can only be used for the column if the column is the first one in the index
+    cursor.execute(
+        "SELECT 1 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s"
+        " AND COLUMN_NAME = %s AND SEQ_IN_INDEX = 1",
+        (table, column),
+    )
+    return bool(cursor.fetchall())
@@ -1,4 +1,7 @@
-from typing import Sequence
+from collections import defaultdict
+import copy
+import hashlib
+from typing import Any, Iterable, Sequence
 
 from karps.config import ResourceConfig
 from karps.query.query import ReadyQuery
@@ -74,18 +77,92 @@ class SQLQuery:
         self.where_clause = clause
         return self
 
+    def after(self, values: Sequence[Any]):
+        """
+        Only selects the rows that are sorted after the row with the given values for the order by-columns,
+        see keyset_clause
+        """
+        after_str, after_params = keyset_clause(self._order_by or (), values)
+        if self.where_clause:
+            where_str, where_params = self.where_clause
+            self.where_clause = (f"({where_str}) AND {after_str}", (*where_params, *after_params))
+        else:
+            self.where_clause = (after_str, after_params)
+        return self
+
     def from_page(self, page):
         self._from = page
         return self
 
+    def get_columns(self) -> list[str]:
+        """
+        The names of the columns in the result of the query
+        """
+        return [alias or value for value, alias in self.selection]
+
+    def get_order_by(self) -> Sequence[tuple[str, str]]:
+        return self._order_by or ()
+
+    def defer_data_joins(self, keep: Iterable[str] = ()) -> dict[str, tuple[str | None, Sequence[str]]]:
+        """
+        Removes the data joins of the collection fields, except the ones in keep, and their columns from the
+        selection, so that their values can be fetched for only the rows that are needed, with data_join_query.
+        Returns the removed data joins.
+        """
+        deferred = {field: join for field, join in self.data_joins.items() if field not in keep}
+        deferred_columns = {join[0] or field for field, join in deferred.items()}
+        self.data_joins = {field: join for field, join in self.data_joins.items() if field not in deferred}
+        self.selection = [(value, alias) for value, alias in self.selection if (alias or value) not in deferred_columns]
+        return deferred
+
     def add_size(self, size):
         self.size = size
         return self
 
+    def get_merged_where_fields(self) -> list[str]:
+        """
+        The collection fields with more than one clause in the query, see get_ctes
+        """
+        joins_per_field = defaultdict(int)
+        for join in self.joins:
+            joins_per_field[join[0]] += 1
+        return [field for field, num_joins in joins_per_field.items() if num_joins > 1]
+
+    def get_merged_where_cte(self, field: str) -> tuple[str, list[str]]:
+        """
+        Evaluates all the clauses on a collection field in one pass over the field's table, with a
+        column, `__match_<idx>`, for each clause (conditional aggregation). The result has one row per
+        entry where at least one clause matches.
+        """
+        match_columns = []
+        match_params = []
+        any_match = []
+        any_match_params = []
+        for join_field, (where_str, where_params), _, idx in self.joins:
+            if join_field != field:
+                continue
+            where_str = replace_table_placeholders(where_str, f"{self.table}__{field}")
+            match_columns.append(f"MAX({where_str}) AS `__match_{idx}`")
+            match_params.extend(where_params)
+            any_match.append(f"({where_str})")
+            any_match_params.extend(where_params)
+        q_str = (
+            f"SELECT `__parent_id`, {', '.join(match_columns)} FROM `{self.table}__{field}`"
+            f" WHERE {' OR '.join(any_match)} GROUP BY `__parent_id`"
+        )
+        return f"`{field}__where` AS ({q_str})", match_params + any_match_params
+
     def get_ctes(self, count) -> tuple[list[str], list[str]]:
         ctes = []
         params = []
+        merged_where_fields = self.get_merged_where_fields()
+        for field in merged_where_fields:
+            where_cte, inner_params = self.get_merged_where_cte(field)
+            ctes.append(where_cte)
+            params.extend(inner_params)
         for join in self.joins:
+            if join[0] in merged_where_fields:
+                continue
             # query on collection field
             where = join[1]
             where_cte = None
@@ -106,31 +183,39 @@ class SQLQuery:
 
         if not count:
             for join_field, join in self.data_joins.items():
-                join_name = f"`{join[0]}`" if join[0] else f"`{join_field}`"
-                if len(join[1]) > 1:
-                    concat_ws = f"CONCAT_WS('{FIELD_SEPARATOR}', {','.join([f'`{inner_field_name}`' for inner_field_name in join[1]])})"
-                else:
-                    concat_ws = join_name
                 # TODO add table name to name of cte?
-                q_str, inner_params = (
-                    select(
-                        [
-                            ("__parent_id", None),
-                            (
-                                f"GROUP_CONCAT({concat_ws} ORDER BY __parent_id SEPARATOR '{ELEMENT_SEPARATOR}')",
-                                join_name,
-                            ),
-                        ]
-                    )
-                    .from_table(f"{self.table}__{join_field}")
-                    .group_by(["__parent_id"])
-                    .to_string()[0]
-                )
+                q_str, inner_params = data_join_query(self.table, join_field, join).to_string()[0]
                 data_cte = f"`{join_field}__data` AS (" + q_str + ")"
                 ctes.append(data_cte)
                 params.extend(inner_params)
         return ctes, params
 
+    def to_deferred_join_string(self) -> ReadyQuery | None:
+        """
+        The data query of to_string as a deferred join. A CTE, `__page`, selects only the ids of the rows of a page,
+        with the where clause, the sort and LIMIT %s OFFSET %s (the params are added by the caller, see limit_clause).
+        The outer query selects the columns and the data of the collection fields for only those ids. Skipping rows
+        then only handles ids, which is faster for pages with a large offset. None if the query is not on a table
+        or is not sorted.
+        """
+        if not self.table or not self._order_by:
+            return None
+        ctes, params = self.get_ctes(count=False)
+        # the page query only needs the data of collection fields that it is sorted on
+        sort_fields = {field for field, _ in self._order_by}
+        page = copy.copy(self)
+        page.selection = [("__id", "`__page_id`")]
+        page.data_joins = {field: join for field, join in self.data_joins.items() if (join[0] or field) in sort_fields}
+        page_sql, page_params = page.to_string(top_level=False)[0]
+        ctes.append(f"`__page` AS ({page_sql} LIMIT %s OFFSET %s)")
+        params.extend(page_params)
+        # the where clauses are already applied in the page query
+        outer = copy.copy(self)
+        outer.joins = []
+        outer.where_clause = ("TABLE_PREFIX__id IN (SELECT `__page_id` FROM `__page`)", ())
+        outer_sql, _ = outer.to_string(top_level=False)[0]
+        return "WITH " + ", ".join(ctes) + " " + outer_sql, tuple(params)
+
     def to_string(self, paged=False, top_level=True) -> tuple[ReadyQuery, ReadyQuery | None]:
         """
         Builds the query from the given parameters
@@ -185,6 +270,7 @@ class SQLQuery:
                         or value[0:6] == "CONCAT"
                         or value[0:3] == "SUM"
                         or value[0:6] == "IFNULL"
+                        or value[0:10] == "DENSE_RANK"
                     ):
                         v = value
                     else:
@@ -198,8 +284,12 @@ class SQLQuery:
                     selection = "__id"
                 else:
                     selection = ", ".join(sel)
+            table_prefix = f"`{self.table}`." if self.table else ""
+
             if self.table:
                 s += f"SELECT {selection} FROM `{self.table}`"
+                for field in self.get_merged_where_fields():
+                    s += f" LEFT JOIN `{field}__where` ON `{field}__where`.__parent_id = {table_prefix}__id"
             elif self.inner_queries:
                 queries: list[str] = []
                 for _, inner_query in self.inner_queries:
@@ -210,8 +300,6 @@ class SQLQuery:
             else:
                 raise RuntimeError("error in SQL generation")
 
-            table_prefix = f"`{self.table}`." if self.table else ""
-
             # use left joins for data fetching (skip when just counting rows)
             if not count:
                 # add in joins needed for data from CTE:s
@@ -222,7 +310,7 @@ class SQLQuery:
 
             if self.where_clause:
                 where_str, where_params = self.where_clause
-                s += f" WHERE {where_str.replace('TABLE_PREFIX', table_prefix)}"
+                s += f" WHERE {replace_table_placeholders(where_str, self.table)}"
                 params.extend(where_params)
 
             if self._group_by:
@@ -240,12 +328,149 @@ class SQLQuery:
 
             # count queries and inner queries should not have size limits
             if not count and top_level and self.size is not None:
-                s += f" LIMIT {self.size} OFFSET {self._from}"
+                limit_str, limit_params = limit_clause(self.size, self._from)
+                s += limit_str
+                params.extend(limit_params)
 
             return s, tuple(params)
 
         return inner(), inner(count=True) if paged and top_level else None
 
 
+def data_join_query(table: str | None, join_field: str, join: tuple[str | None, Sequence[str]]) -> SQLQuery:
+    """
+    The values of a collection field (for table fields, the rows) of each entry, concatenated
+    with ELEMENT_SEPARATOR (and FIELD_SEPARATOR), see SQLQuery.join
+    """
+    join_name = f"`{join[0]}`" if join[0] else f"`{join_field}`"
+    if len(join[1]) > 1:
+        concat_ws = (
+            f"CONCAT_WS('{FIELD_SEPARATOR}', {','.join([f'`{inner_field_name}`' for inner_field_name in join[1]])})"
+        )
+    else:
+        concat_ws = join_name
+    return (
+        select(
+            [
+                ("__parent_id", None),
+                (f"GROUP_CONCAT({concat_ws} ORDER BY __parent_id SEPARATOR '{ELEMENT_SEPARATOR}')", join_name),
+            ]
+        )
+        .from_table(f"{table}__{join_field}")
+        .group_by(["__parent_id"])
+    )
+
+
+def replace_table_placeholders(where_str: str, table: str | None) -> str:
+    """
+    Clauses can refer to the table they are used on (see karps.query.query.get_query), with TABLE_PREFIX
+    for qualifying columns and TABLE_NAME for the name of side tables
+    """
+    table_prefix = f"`{table}`." if table else ""
+    return where_str.replace("TABLE_PREFIX", table_prefix).replace("TABLE_NAME", table or "")
+
+
+def limit_clause(size: int, _from: int) -> ReadyQuery:
+    """
+    Paging for a query returned by SQLQuery.to_string, so that the query can be built once for all pages.
+    The limits are params, so that all pages have the same shape (see shape_fingerprint).
+    """
+    return " LIMIT %s OFFSET %s", (size, _from)
+
+
+def union_counts(count_queries: Sequence[ReadyQuery]) -> ReadyQuery:
+    """
+    Combines the count queries of SQLQuery.to_string(paged=True), one per resource, into one statement with a
+    row, (index of the query in count_queries, count), per query. Each query is a derived table, so its CTEs
+    are kept as they are.
+    """
+    branches = []
+    params = []
+    for idx, (count_sql, count_params) in enumerate(count_queries):
+        branches.append(f"SELECT {idx} AS `__resource`, `__count_{idx}`.* FROM ({count_sql}) AS `__count_{idx}`")
+        params.extend(count_params)
+    return " UNION ALL ".join(branches), tuple(params)
+
+
+def union_data_queries(
+    data_queries: Sequence[tuple[ReadyQuery, Sequence[str], Sequence[tuple[str, str]]] | None],
+) -> tuple[ReadyQuery, list[str]]:
+    """
+    Combines the data queries for one page, one per resource (with LIMIT, see limit_clause) or None if the resource
+    has no hits on the page, into one statement. Each query is given with its columns and order by-columns
+    (SQLQuery.get_columns and SQLQuery.get_order_by).
+
+    The rows are (index of the query in data_queries, row number in the query, *all_columns) where all_columns are
+    the columns of all queries, NULL for columns a query does not have. A derived table does not keep its order, so
+    the row number is computed from the order by-columns.
+    """
+    all_columns = list(dict.fromkeys(column for query in data_queries if query for column in query[1]))
+    branches = []
+    params = []
+    for idx, data_query in enumerate(data_queries):
+        if data_query is None:
+            continue
+        (data_sql, data_params), columns, order_by = data_query
+        alias = f"__data_{idx}"
+        order_bys = [
+            f"`{alias}`.`{field}`" + (f" {order.upper()}" if order != "asc" else "") for field, order in order_by
+        ]
+        row_number = f"ROW_NUMBER() OVER (ORDER BY {', '.join(order_bys)})" if order_bys else "ROW_NUMBER() OVER ()"
+        selection = [f"`{alias}`.`{column}`" if column in columns else "NULL" for column in all_columns]
+        branches.append(
+            f"SELECT {idx} AS `__resource`, {row_number} AS `__row`, "
+            + ", ".join(f"{value} AS `{column}`" for value, column in zip(selection, all_columns))
+            + f" FROM ({data_sql}) AS `{alias}`"
+        )
+        params.extend(data_params)
+    return (" UNION ALL ".join(branches) + " ORDER BY `__resource`, `__row`", tuple(params)), all_columns
+
+
+def _keyset_comparisons(field: str, order: str, value: Any) -> tuple[ReadyQuery | None, ReadyQuery]:
+    """
+    Conditions for the values of field that are sorted after value and equal to value. None if no value
+    is sorted after value. MariaDB sorts NULL first in ascending order and last in descending order.
+    """
+    if value is None:
+        after = (f"`{field}` IS NOT NULL", ()) if order == "asc" else None
+        return after, (f"`{field}` IS NULL", ())
+    if order == "asc":
+        after = (f"`{field}` > %s", (value,))
+    else:
+        after = (f"(`{field}` < %s OR `{field}` IS NULL)", (value,))
+    return after, (f"`{field}` = %s", (value,))
+
+
+def keyset_clause(order_by: Sequence[tuple[str, str]], values: Sequence[Any]) -> ReadyQuery:
+    """
+    A condition for the rows that are sorted after the row that has values in the columns of order_by,
+    used for keyset pagination (search_after). The last column of order_by must be unique (__id), so
+    that no rows are sorted equal to the given row.
+    """
+    alternatives = []
+    params = []
+    equal_strs: list[str] = []
+    equal_params: list[Any] = []
+    for (field, order), value in zip(order_by, values, strict=True):
+        after, (equal_str, equal_value) = _keyset_comparisons(field, order, value)
+        if after:
+            after_str, after_value = after
+            alternatives.append(" AND ".join([*equal_strs, after_str]))
+            params.extend([*equal_params, *after_value])
+        equal_strs.append(equal_str)
+        equal_params.extend(equal_value)
+    if not alternatives:
+        return "FALSE", ()
+    return "(" + " OR ".join(f"({alternative})" for alternative in alternatives) + ")", tuple(params)
+
+
+def shape_fingerprint(sql: str) -> str:
+    """
+    Identifies the shape of a query built by SQLQuery.to_string. The values in the query are always params,
+    so queries that only differ in values have the same SQL and the same fingerprint.
+    """
+    return hashlib.blake2b(sql.encode("utf-8"), digest_size=16).hexdigest()
+
+
 def select(selection) -> SQLQuery:
     return SQLQuery(selection)
@@ -0,0 +1,152 @@
+import logging
+
+import mysql.connector
+from mysql.connector import errorcode
+from mysql.connector.cursor import MySQLCursor
+
+from karps.config import Env, Field, MainConfig, ResourceConfig
+from karps.database.database import get_cursor
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["create_text_indexes", "get_text_index_versions"]
+
+# the text indexes that have been built, with the updated timestamp of the resource config they were built for
+TEXT_INDEXES_TABLE = "__text_indexes"
+
+
+def create_text_indexes(env: Env, main_config: MainConfig, resource_config: ResourceConfig):
+    """
+    Builds the text indexes that are enabled for the fields of the resource (ConfigField.text_indexes):
+
+    - reverse: a persistent column, `<field>__reversed`, with the value reversed and an index on it.
+      An endswith-query becomes a prefix query on the reversed column.
+    - trigram: a table, `<resource>__<field>__trigram`, with all the trigrams of each value and the id of
+      the entry. A contains-query only checks the entries that have all the trigrams of the value.
+    - fulltext: a FULLTEXT index on the field, used by freetext-queries and by contains-queries if
+      ConfigField.contains_mode is fulltext.
+
+    The reverse column and the fulltext index are updated by the database, but the trigram tables must be rebuilt when the data changes.
+    Each index is recorded in the __text_indexes table, queries only use the indexes that are recorded, see karps.config.with_text_indexes.
+    """
+    with get_cursor(env) as cursor:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS `{TEXT_INDEXES_TABLE}` (`resource_id` VARCHAR(100) NOT NULL,"
+            " `field` VARCHAR(100) NOT NULL, `index` VARCHAR(20) NOT NULL, `updated` BIGINT NOT NULL,"
+            " PRIMARY KEY (`resource_id`, `field`, `index`))"
+        )
+        for resource_field in resource_config.fields:
+            field = main_config.fields[resource_field.name]
+            if field.type != "text" or not field.text_indexes:
+                continue
+            # values of collection fields are stored in a table per field
+            table = f"{resource_config.resource_id}__{field.name}" if field.collection else resource_config.resource_id
+            if "reverse" in field.text_indexes:
+                _create_reverse_column(cursor, table, field)
+            if "trigram" in field.text_indexes:
+                _create_trigram_table(cursor, table, field)
+            if "fulltext" in field.text_indexes:
+                _create_fulltext_index(cursor, table, field)
+            for index in field.text_indexes:
+                cursor.execute(
+                    f"REPLACE INTO `{TEXT_INDEXES_TABLE}` (`resource_id`, `field`, `index`, `updated`)"
+                    " VALUES (%s, %s, %s, %s)",
+                    (resource_config.resource_id, field.name, index, resource_config.updated),
+                )
+        cursor.execute("COMMIT")
+
+
+def get_text_index_versions(env: Env) -> dict[tuple[str, str, str], int]:
+    """
+    The text indexes that have been built, by (resource_id, field, index), with the updated timestamp of the
+    resource config at the time
+    """
+    with get_cursor(env) as cursor:
+        try:
+            cursor.execute(f"SELECT `resource_id`, `field`, `index`, `updated` FROM `{TEXT_INDEXES_TABLE}`")
+        except mysql.connector.Error as e:
+            # no text indexes have been built
+            if e.errno == errorcode.ER_NO_SUCH_TABLE:
+                return {}
+            raise
+        return {
+            (str(resource_id), str(field), str(index)): int(str(updated))
+            for resource_id, field, index, updated in cursor.fetchall()
+        }
+
+
+def _get_column_definition(cursor: MySQLCursor, table: str, column: str) -> tuple[str, str | None]:
+    cursor.execute(
+        "SELECT COLUMN_TYPE, COLLATION_NAME FROM information_schema.COLUMNS"
+        " WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table, column),
+    )
+    row = cursor.fetchone()
+    if row is None:
+        raise RuntimeError(f"column {column} does not exist in {table}")
+    column_type, collation = row
+    return str(column_type), str(collation) if collation else None
+
+
+def _collate(collation: str | None) -> str:
+    return f" COLLATE {collation}" if collation else ""
+
+
+def _create_reverse_column(cursor: MySQLCursor, table: str, field: Field):
+    reversed_column = f"{field.name}__reversed"
+    cursor.execute(
+        "SELECT 1 FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s"
+        " AND COLUMN_NAME = %s",
+        (table, reversed_column),
+    )
+    if cursor.fetchall():
+        logger.info(f"{table}.{reversed_column} already exists")
+        return
+    column_type, collation = _get_column_definition(cursor, table, field.name)
+    # text columns can only be indexed on a prefix
+    index_length = "" if column_type.startswith("varchar") else "(255)"
+    cursor.execute(
+        f"ALTER TABLE `{table}` ADD COLUMN `{reversed_column}` {column_type}{_collate(collation)}"
+        f" AS (REVERSE(`{field.name}`)) PERSISTENT,"
+        f" ADD INDEX `{reversed_column}_idx` (`{reversed_column}`{index_length})"
+    )
+    logger.info(f"created {table}.{reversed_column}")
+
+
+def _create_fulltext_index(cursor: MySQLCursor, table: str, field: Field):
+    index_name = f"{field.name}__fulltext"
+    cursor.execute(
+        "SELECT 1 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s"
+        " AND INDEX_NAME = %s",
+        (table, index_name),
+    )
+    if cursor.fetchall():
+        logger.info(f"{table}.{index_name} already exists")
+        return
+    cursor.execute(f"ALTER TABLE `{table}` ADD FULLTEXT INDEX `{index_name}` (`{field.name}`)")
+    logger.info(f"created {table}.{index_name}")
+
+
+def _create_trigram_table(cursor: MySQLCursor, table: str, field: Field):
+    trigram_table = f"{table}__trigram" if field.collection else f"{table}__{field.name}__trigram"
+    # the id in the trigram table is the id of the entry, for collection fields that is __parent_id
+    id_column = "__parent_id" if field.collection else "__id"
+    id_type, _ = _get_column_definition(cursor, table, id_column)
+    _, collation = _get_column_definition(cursor, table, field.name)
+    cursor.execute(f"DROP TABLE IF EXISTS `{trigram_table}`")
+    cursor.execute(
+        f"CREATE TABLE `{trigram_table}` (`__id` {id_type} NOT NULL,"
+        f" `trigram` VARCHAR(3){_collate(collation)} NOT NULL, PRIMARY KEY (`trigram`, `__id`))"
+    )
+    cursor.execute(f"SELECT MAX(CHAR_LENGTH(`{field.name}`)) FROM `{table}`")
+    (max_length,) = cursor.fetchone() or (None,)
+    if not max_length or int(str(max_length)) < 3:
+        logger.info(f"created {trigram_table}, no values long enough for trigrams")
+        return
+    # seq_1_to_N is a virtual table from MariaDB's Sequence engine, one row per start position
+    cursor.execute(
+        f"INSERT IGNORE INTO `{trigram_table}` (`__id`, `trigram`)"
+        f" SELECT `{id_column}`, SUBSTRING(`{field.name}`, seq, 3) FROM `{table}`"
+        f" JOIN seq_1_to_{int(str(max_length)) - 2} ON seq <= CHAR_LENGTH(`{field.name}`) - 2"
+    )
+    logger.info(f"created {trigram_table}")
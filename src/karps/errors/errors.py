@@ -33,10 +33,25 @@ class ApiKeyError(CodeUserError):
         super().__init__("API key was malformed, expired or it was not possible to verify key.")
 
 
+class QueryCostError(CodeUserError):
+    def __init__(self, estimate: int, budget: int):
+        super().__init__(
+            f"query is too expensive, an estimated {estimate} rows must be examined (the limit is {budget})",
+            details={"estimate": estimate, "budget": budget},
+        )
+
+
+class SearchAfterError(CodeUserError):
+    def __init__(self, reason: str):
+        super().__init__(f"searchAfter {reason}")
+
+
 @dataclass
 class ErrorRep:
     code: int
     description: str
+    # the HTTP status of the response
+    status_code: int = 500
 
 
 error_codes: dict[type[CodeUserError], ErrorRep] = {
@@ -52,6 +67,16 @@ error_codes: dict[type[CodeUserError], ErrorRep] = {
     ApiKeyError: ErrorRep(
         4, "Returned when an API key was given, but it was malformed, expired or it was not possible to verify the key."
     ),
+    QueryCostError: ErrorRep(
+        5,
+        "Returned when the database estimates that the query examines more rows than allowed. Use a more specific "
+        "query or fewer resources.",
+    ),
+    SearchAfterError: ErrorRep(
+        6,
+        "Returned when searchAfter is malformed or is not from a previous page of the same search.",
+        status_code=400,
+    ),
 }
 
 
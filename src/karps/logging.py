@@ -1,26 +1,36 @@
 from datetime import datetime
+import glob
 import json
 import logging
 from logging.handlers import RotatingFileHandler
 import os
 from pathlib import Path
+from typing import Any, Iterator
+
+SQL_LOG_FILE = "sql.jsonl"
 
 
 class JSONFormatter(logging.Formatter):
     def format(self, record: logging.LogRecord) -> str:
+        args = getattr(record, "args")
         payload = {
             "ts": datetime.now().isoformat(),
             # TODO disambiguate queries from /search and /count
             # TODO /search makes many queries - could be nice to connect them in the log
-            "q": getattr(record, "args")["q"],
-            "execute_took_s": getattr(record, "args")["execute_took"],
-            "fetchall_took_s": getattr(record, "args")["fetchall_took"],
+            "q": args["q"],
+            # not set for queries that were rejected before they were executed
+            "execute_took_s": args.get("execute_took"),
+            "fetchall_took_s": args.get("fetchall_took"),
             # log true/false depending on if the logging call was made when an exception has occurred
             "error": bool(record.exc_info),
         }
-        warnings = getattr(record, "args")["warnings"]
+        warnings = args.get("warnings")
         if warnings:
             payload["warnings"] = warnings
+        if args.get("rejected"):
+            # rejected by the query cost budget, with the estimated number of examined rows
+            payload["rejected"] = True
+            payload["estimate"] = args.get("estimate")
         return json.dumps(payload, ensure_ascii=False)
 
 
@@ -29,10 +39,24 @@ def setup_sql_logger(logging_dir: str):
     logger = logging.getLogger("sql")
     logger.propagate = False
     logger.setLevel("INFO")
-    h = RotatingFileHandler(os.path.join(logging_dir, "sql.jsonl"), maxBytes=50000000)
+    h = RotatingFileHandler(os.path.join(logging_dir, SQL_LOG_FILE), maxBytes=50000000)
     h.setFormatter(JSONFormatter())
     logger.addHandler(h)
 
 
 def get_sql_logger():
     return logging.getLogger("sql")
+
+
+def read_sql_log(logging_dir: str) -> Iterator[dict[str, Any]]:
+    """
+    The records written by the SQL logger, including the rotated files (sql.jsonl.1 etc.)
+    """
+    for path in sorted(glob.glob(os.path.join(logging_dir, SQL_LOG_FILE + "*"))):
+        with open(path) as fp:
+            for line in fp:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line may be partially written
+                    continue
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Annotated, Any, Sequence
+from typing import Annotated, Any, Literal, Sequence
 
 import pydantic
 
@@ -24,11 +24,20 @@ class HitResponse(BaseModel):
     resource_id: str
 
 
+# how the number of hits is given by /search
+type Totals = Literal["exact", "estimate", "none"]
+
+
 class SearchResult(BaseModel):
     hits: list[HitResponse]
-    resource_hits: dict[str, int]
+    resource_hits: dict[str, int] | None = pydantic.Field(
+        None, description="The number of hits in each resource. Not set if `totals` is `none`."
+    )
     resource_order: list[str]
-    total: int
+    total: int | None = pydantic.Field(None, description="The number of hits. Not set if `totals` is `none`.")
+    search_after: str | None = pydantic.Field(
+        None, description="Give as `searchAfter` to get the next page. Not set on the last page."
+    )
 
 
 class UserErrorResult(BaseModel):
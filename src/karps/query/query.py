@@ -1,21 +1,50 @@
 from collections import defaultdict
 from dataclasses import dataclass
-from typing import Any, cast
-import tatsu
+import re
+from typing import Any, Sequence, cast
 import tatsu.exceptions
-import importlib.resources
 
-from karps.config import MainConfig
+from karps.config import Field, MainConfig
 from karps.errors import errors
-
-with importlib.resources.files("karps.query").joinpath("query.ebnf").open() as fp:
-    grammar = fp.read()
-    parser = tatsu.compile(grammar)
+from karps.query.tatsu_parser import KarpQueryParser
+
+# generated from query.ebnf with `make generate-parser`, avoids compiling the grammar at import
+parser = KarpQueryParser()
+
+
+# the alternatives of the choices in query.ebnf that can fail, as TatSu lists them for the grammar (rules
+# that are choices themselves are expanded), the generated parser only reports "Failed" when no alternative matches
+_EXPECTED_ALTERNATIVES = {
+    "expression": (
+        "<and>",
+        "<any_arg_expr>",
+        "<freetext_expr>",
+        "<logical_expression>",
+        "<not>",
+        "<or>",
+        "<query_expression>",
+        "<text_arg_expr>",
+    ),
+    "any_value": ("<integer_value>", "<quoted_string_value>", "<string_value>", "<unquoted_string_value>", r"\\d+$"),
+    "string_value": ('"', "<quoted_string_value>", "<unquoted_string_value>", '[^|)("]+'),
+}
+
+
+def _get_parse_error_message(e: tatsu.exceptions.FailedParse) -> str:
+    """
+    The generated parser does not keep track of the expected alternatives when a choice fails, they are
+    given by the rule that failed
+    """
+    expected = _EXPECTED_ALTERNATIVES.get(e.stack[-1].name) if e.stack else None
+    if type(e) is tatsu.exceptions.FailedParse and expected:
+        return "Expected one of: " + " ".join(f"'{alternative}'" for alternative in expected)
+    return e.message
 
 
 class Query: ...
 
 
+@dataclass
 class NullQuery(Query): ...
 
 
@@ -26,12 +55,16 @@ class SubQuery(Query):
     value: object | None = None
 
 
+# the field of freetext-clauses, they are replaced by clauses on each field with a fulltext index by normalize_query
+FREETEXT_FIELD = "*"
+
+
 @dataclass
 class LogicalQuery(Query):
     """
     Uses the same query language as Karp, described here:
     https://spraakbanken4.it.gu.se/karp/v7/#tag/Searching
-    Sub-queries, freetext and multiple operands for `not(*)` is not supported
+    Sub-queries and multiple operands for `not(*)` is not supported
     """
 
     op: str
@@ -41,40 +74,277 @@ class LogicalQuery(Query):
 def parse_query(q: str | None) -> Query:
     if q:
         try:
-            # TODO restore typing
-            ast: Any = parser.parse(q)
-        except tatsu.exceptions.FailedParse as e:
-            raise errors.UserError("Parse error: " + e.message)
-
-        def recurse(ast):
-            if ast.op in ["and", "or", "not"]:
-                queries = []
-                for inner_ast in ast.args:
-                    queries.append(recurse(inner_ast))
-                if queries:
-                    if ast.op == "not" and len(queries) > 1:
-                        raise errors.UserError("Only one clause for not-operator supported")
-                    return LogicalQuery(op=ast.op.upper(), clauses=queries)
-                else:
+            return _QueryParser(q).parse()
+        except _ParseFailed:
+            # errors are rare, use TatSu to get the same error messages as the grammar gives
+            return parse_query_tatsu(q)
+    else:
+        return NullQuery()
+
+
+def parse_query_tatsu(q: str) -> Query:
+    """
+    Parses q with the parser generated from query.ebnf. parse_query uses the hand-written parser below,
+    which accepts the same language, and only uses this for error messages.
+    """
+    try:
+        # TODO restore typing
+        ast: Any = parser.parse(q)
+    except tatsu.exceptions.FailedParse as e:
+        raise errors.UserError("Parse error: " + _get_parse_error_message(e))
+
+    def recurse(ast):
+        if ast.op in ["and", "or", "not"]:
+            queries = []
+            for inner_ast in ast.args:
+                queries.append(recurse(inner_ast))
+            if queries:
+                if ast.op == "not" and len(queries) > 1:
+                    raise errors.UserError("Only one clause for not-operator supported")
+                return LogicalQuery(op=ast.op.upper(), clauses=queries)
+            else:
+                return NullQuery()
+        else:
+            if isinstance(ast.arg, list):
+                arg = "".join(ast.arg)
+                # unescape string values
+                arg = arg.replace('\\"', '"')
+            else:
+                arg = ast.arg
+            if ast.op == "freetext":
+                return SubQuery(op=ast.op, field=FREETEXT_FIELD, value=arg)
+            return SubQuery(op=ast.op, field=ast.field, value=arg)
+
+    return recurse(ast)
+
+
+class _ParseFailed(Exception): ...
+
+
+# the same as TatSu's default whitespace, skipped before each rule and token (but not inside patterns)
+_whitespace_re = re.compile(r"\s*")
+_identifier_re = re.compile(r"[^|]+")
+_unquoted_string_value_re = re.compile(r'[^|)("]+')
+_integer_value_re = re.compile(r"\d+$")
+
+_logical_ops = ("and", "or", "not")
+_text_value_ops = ("contains", "endswith", "regexp", "startswith")
+_any_arg_ops = ("equals", "gt", "gte", "lt", "lte")
+
+
+class _QueryParser:
+    """
+    Recursive-descent parser for the grammar in query.ebnf that creates Query objects directly.
+
+    It follows what the TatSu parser does: whitespace is skipped before tokens and rules, alphanumeric
+    tokens must not be followed by an alphanumeric character and regular expressions never backtrack.
+    Raises _ParseFailed without a message for invalid queries.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+        # "not" with several clauses is not reported until the whole query has been parsed
+        self.multi_clause_not = False
+
+    def parse(self) -> Query:
+        q = self.expression()
+        self.skip_whitespace()
+        if self.pos != len(self.text):
+            raise _ParseFailed()
+        if self.multi_clause_not:
+            raise errors.UserError("Only one clause for not-operator supported")
+        return q
+
+    def skip_whitespace(self):
+        self.pos = _whitespace_re.match(self.text, self.pos).end()  # pyright: ignore[reportOptionalMemberAccess]
+
+    def keyword(self, keywords: tuple[str, ...]) -> str | None:
+        self.skip_whitespace()
+        text, pos = self.text, self.pos
+        for keyword in keywords:
+            end = pos + len(keyword)
+            if text.startswith(keyword, pos) and not (end < len(text) and text[end].isalnum()):
+                self.pos = end
+                return keyword
+        return None
+
+    def token(self, token: str):
+        self.skip_whitespace()
+        if not self.text.startswith(token, self.pos):
+            raise _ParseFailed()
+        self.pos += len(token)
+
+    def pattern(self, pattern: re.Pattern) -> str:
+        self.skip_whitespace()
+        match = pattern.match(self.text, self.pos)
+        if not match:
+            raise _ParseFailed()
+        self.pos = match.end()
+        return match.group()
+
+    def expression(self) -> Query:
+        op = self.keyword(_logical_ops)
+        if op:
+            return self.logical_expression(op)
+        op = self.keyword(_text_value_ops)
+        if op:
+            field = self.field()
+            return SubQuery(op=op, field=field, value=self.string_value())
+        op = self.keyword(_any_arg_ops)
+        if op:
+            field = self.field()
+            self.skip_whitespace()
+            match = _integer_value_re.match(self.text, self.pos)
+            if match:
+                self.pos = match.end()
+                return SubQuery(op=op, field=field, value=match.group())
+            return SubQuery(op=op, field=field, value=self.string_value())
+        if self.keyword(("freetext",)):
+            self.token("|")
+            return SubQuery(op="freetext", field=FREETEXT_FIELD, value=self.string_value())
+        raise _ParseFailed()
+
+    def logical_expression(self, op: str) -> Query:
+        self.token("(")
+        clauses = []
+        self.skip_whitespace()
+        # an expression never starts with ")", so "and()" is the only way to get zero clauses
+        if op == "not" or not self.text.startswith(")", self.pos):
+            clauses.append(self.expression())
+            while True:
+                self.skip_whitespace()
+                if not self.text.startswith("||", self.pos):
+                    break
+                self.pos += 2
+                clauses.append(self.expression())
+        self.token(")")
+        if not clauses:
+            return NullQuery()
+        if op == "not" and len(clauses) > 1:
+            self.multi_clause_not = True
+        return LogicalQuery(op=op.upper(), clauses=clauses)
+
+    def field(self) -> str:
+        self.token("|")
+        field = self.pattern(_identifier_re)
+        self.token("|")
+        return field
+
+    def string_value(self) -> str:
+        self.skip_whitespace()
+        match = _unquoted_string_value_re.match(self.text, self.pos)
+        if match:
+            self.pos = match.end()
+            return match.group()
+        self.token('"')
+        # any character is allowed in quoted strings, but " must be escaped
+        text, pos = self.text, self.pos
+        while pos < len(text) and text[pos] != '"':
+            pos += 2 if text.startswith('\\"', pos) else 1
+        if pos == len(text):
+            raise _ParseFailed()
+        value = text[self.pos : pos].replace('\\"', '"')
+        self.pos = pos + 1
+        return value
+
+
+def normalize_query(
+    main_config: MainConfig, q: Query, word_column: str | None = None, freetext_fields: Sequence[str] = ()
+) -> Query:
+    """
+    Simplifies a query tree before it is translated to SQL, without changing which entries match:
+    - entry_word / entryWord is replaced by word_column (if given)
+    - freetext-clauses are replaced by an or-group with a clause for each of freetext_fields (the fields
+      with a fulltext index), without freetext_fields they are kept and match nothing, see get_query
+    - nested groups with the same operator are flattened and duplicate clauses removed
+    - empty groups (NullQuery) are folded, a group that contains one clause is replaced by the clause
+    - not(not(q)) is replaced by q
+    - equals-clauses in an or-group on the same scalar field are replaced by one "in"-clause
+    """
+
+    def recurse(q: Query) -> Query:
+        if isinstance(q, SubQuery):
+            if word_column and q.field in ["entry_word", "entryWord"]:
+                return SubQuery(op=q.op, field=word_column, value=q.value)
+            if q.op == "freetext" and freetext_fields:
+                clauses = [SubQuery(op=q.op, field=field, value=q.value) for field in freetext_fields]
+                return clauses[0] if len(clauses) == 1 else LogicalQuery(op="OR", clauses=clauses)
+            return q
+        if not isinstance(q, LogicalQuery):
+            return q
+        clauses = [recurse(clause) for clause in q.clauses]
+        if q.op == "NOT":
+            (clause,) = clauses
+            if isinstance(clause, LogicalQuery) and clause.op == "NOT":
+                return clause.clauses[0]
+            return LogicalQuery(op="NOT", clauses=[clause])
+
+        flat_clauses = []
+        for clause in clauses:
+            if isinstance(clause, NullQuery):
+                if q.op == "OR":
+                    # an empty group matches every entry, and so does the or-group
                     return NullQuery()
+                continue
+            if isinstance(clause, LogicalQuery) and clause.op == q.op:
+                inner_clauses = clause.clauses
             else:
-                if isinstance(ast.arg, list):
-                    arg = "".join(ast.arg)
-                    # unescape string values
-                    arg = arg.replace('\\"', '"')
-                else:
-                    arg = ast.arg
-                return SubQuery(op=ast.op, field=ast.field, value=arg)
+                inner_clauses = [clause]
+            for inner_clause in inner_clauses:
+                if inner_clause not in flat_clauses:
+                    flat_clauses.append(inner_clause)
+        if q.op == "OR":
+            flat_clauses = _merge_equals(main_config, flat_clauses)
+
+        if not flat_clauses:
+            return NullQuery()
+        if len(flat_clauses) == 1:
+            return flat_clauses[0]
+        return LogicalQuery(op=q.op, clauses=flat_clauses)
+
+    return recurse(q)
+
+
+def _is_scalar_equals(main_config: MainConfig, q: Query) -> bool:
+    """
+    True for equals-clauses that are translated to `field` = %s, see to_where_clause
+    """
+    if not (isinstance(q, SubQuery) and q.op == "equals" and q.field in main_config.fields):
+        return False
+    field = main_config.fields[q.field]
+    return not field.collection and field.type not in ["float", "integer", "bool"]
 
-        return recurse(ast)
-    else:
-        return NullQuery()
+
+def _merge_equals(main_config: MainConfig, clauses: list[Query]) -> list[Query]:
+    """
+    Replaces the equals-clauses on the same field by one "in"-clause, at the position of the first one
+    """
+    values: dict[str, list] = defaultdict(list)
+    for clause in clauses:
+        if _is_scalar_equals(main_config, clause):
+            values[cast(SubQuery, clause).field].append(cast(SubQuery, clause).value)
+
+    result = []
+    merged = set()
+    for clause in clauses:
+        if _is_scalar_equals(main_config, clause) and len(values[cast(SubQuery, clause).field]) > 1:
+            field = cast(SubQuery, clause).field
+            if field not in merged:
+                merged.add(field)
+                result.append(SubQuery(op="in", field=field, value=tuple(values[field])))
+        else:
+            result.append(clause)
+    return result
 
 
-def get_epsilon(q_number):
+# used for float fields that do not have epsilon set in fields.yaml
+DEFAULT_EPSILON = 0.01
+
+
+def get_epsilon(field: Field) -> float:
     # for smaller floats we might need a smaller epsilon and vice versa for larger floats (magnitude, not precision)
-    # this is work-in-progress and not fully tested
-    return 0.01
+    return field.epsilon if field.epsilon is not None else DEFAULT_EPSILON
 
 
 # a tuple of str and a tuple[Any], str must contain as many %s as there are elements in the inner tuple
@@ -102,6 +372,27 @@ def get_query(
 
     collection_field_count = defaultdict(int)
 
+    def get_field(q: SubQuery) -> str:
+        # If the field is entry_word / entryWord, use the specified word_column, as it can differ across resources.
+        return word_column if q.field in ["entry_word", "entryWord"] else q.field
+
+    # the distinct clauses on each collection field. If there is more than one, they are evaluated in
+    # one pass over the field's table, see SQLQuery.get_ctes
+    collection_field_clauses: dict[str, set[tuple[str, Any]]] = defaultdict(set)
+    # the index of the clauses that have been translated, the same clause used twice is only evaluated once
+    collection_clause_idx: dict[tuple[str, str, Any], int] = {}
+
+    def find_collection_clauses(q: Query):
+        if isinstance(q, LogicalQuery):
+            for inner_q in q.clauses:
+                find_collection_clauses(inner_q)
+        elif isinstance(q, SubQuery):
+            field = get_field(q)
+            if field in main_config.fields and main_config.fields[field].collection:
+                collection_field_clauses[field].add((q.op, q.value))
+
+    find_collection_clauses(outer_q)
+
     def recurse(q) -> tuple[ReadyQuery, bool]:
         """
         Returns a tuple of
@@ -122,30 +413,38 @@ def get_query(
             else:
                 return (f" {q.op} ".join(parts), tuple(params)), True
         elif isinstance(q, SubQuery):
-            # If the field is entry_word / entryWord, use the specified word_column, as it can differ across resources.
-            if q.field in ["entry_word", "entryWord"]:
-                field = word_column
-            else:
-                field = q.field
+            if q.op == "freetext" and q.field == FREETEXT_FIELD:
+                # there are no fields with a fulltext index to search
+                return ("FALSE", ()), False
+            field = get_field(q)
             fields.add(field)
             if field not in main_config.fields:
                 raise errors.UserError(f"{field} does not exist in system")
-            field_type: str = main_config.fields[field].type
-            where_part, params = to_where_clause(field, field_type, q)
+            where_part, params = to_where_clause(field, main_config.fields[field], q)
             if main_config.fields[field].collection:
-                count = collection_field_count[field]
-                collection_queries.append((field, count, (where_part, (params,))))
-
-                # TABLE_PREFIX will be replaced
-                where_part = (
-                    f"EXISTS (SELECT 1 FROM `{field}{f'_{count}'}__where` WHERE TABLE_PREFIX__id = __parent_id)"
-                )
+                clause_key = (field, q.op, q.value)
+                if clause_key in collection_clause_idx:
+                    count = collection_clause_idx[clause_key]
+                else:
+                    count = collection_field_count[field]
+                    collection_clause_idx[clause_key] = count
+                    collection_field_count[field] += 1
+                    collection_queries.append((field, count, (where_part, params)))
+
+                if len(collection_field_clauses[field]) > 1:
+                    # <field>__where has a column for each clause and is LEFT JOINed with the main table
+                    where_part = f"IFNULL(`{field}__where`.`__match_{count}`, 0)"
+                else:
+                    # TABLE_PREFIX will be replaced
+                    where_part = (
+                        f"EXISTS (SELECT 1 FROM `{field}{f'_{count}'}__where` WHERE TABLE_PREFIX__id = __parent_id)"
+                    )
                 params = ()
-                collection_field_count[field] += 1
-            else:
-                params = (params,)
 
             return (where_part, params), False
+        elif isinstance(q, NullQuery):
+            # an empty group inside the query, matches every entry
+            return ("TRUE", ()), False
         else:
             raise RuntimeError("cannot happen")
 
@@ -154,6 +453,188 @@ def get_query(
     return fields, main_query, collection_queries
 
 
+def get_trigrams(val: str) -> list[str]:
+    """
+    Trigrams that cover val, without overlapping except the last one. Every value that contains
+    val contains all of them.
+    """
+    if len(val) < 3:
+        return []
+    starts = list(range(0, len(val) - 2, 3))
+    if starts[-1] != len(val) - 3:
+        starts.append(len(val) - 3)
+    return list(dict.fromkeys(val[start : start + 3] for start in starts))
+
+
+def _trigram_where_clause(field: str, field_config: Field, trigrams: list[str], like_val: str) -> ReadyQuery:
+    """
+    Uses the trigram table of the field (see karps.database.text_index) to find the entries that contains
+    all the trigrams, then checks the candidates with LIKE.
+
+    TABLE_NAME and TABLE_PREFIX will be replaced, for collection fields the query is done on <resource>__<field>
+    """
+    if field_config.collection:
+        id_column = "`__parent_id`"
+        trigram_table = "`TABLE_NAME__trigram`"
+    else:
+        id_column = "TABLE_PREFIX__id"
+        trigram_table = f"`TABLE_NAME__{field}__trigram`"
+    candidates = [f"{id_column} IN (SELECT `__id` FROM {trigram_table} WHERE `trigram` = %s)" for _ in trigrams]
+    return f"({' AND '.join(candidates)} AND `{field}` LIKE %s)", (*trigrams, like_val)
+
+
+# characters that are not literals in a regular expression, when not escaped
+_regexp_special = set(".^$*+?{}[]()|\\")
+
+
+def _skip_regexp_brackets(pattern: str, pos: int) -> int:
+    """
+    Returns the position after the character class that starts at pos, ] directly after [ or [^ is a literal
+    """
+    pos += 1
+    if pattern.startswith("^", pos):
+        pos += 1
+    if pattern.startswith("]", pos):
+        pos += 1
+    while pos < len(pattern) and pattern[pos] != "]":
+        pos += 2 if pattern[pos] == "\\" else 1
+    return pos + 1
+
+
+def _skip_regexp_group(pattern: str, pos: int) -> int:
+    """
+    Returns the position after the group that starts at pos
+    """
+    depth = 0
+    while pos < len(pattern):
+        char = pattern[pos]
+        if char == "\\":
+            pos += 2
+            continue
+        if char == "[":
+            pos = _skip_regexp_brackets(pattern, pos)
+            continue
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0:
+                return pos + 1
+        pos += 1
+    return pos
+
+
+def _skip_regexp_quantifier(pattern: str, pos: int) -> tuple[int, bool]:
+    """
+    If there is a quantifier at pos, returns the position after it and if the quantified atom is optional.
+    """
+    if pos >= len(pattern):
+        return pos, False
+    char = pattern[pos]
+    if char in "*?":
+        optional = True
+        pos += 1
+    elif char == "+":
+        optional = False
+        pos += 1
+    elif char == "{":
+        match = re.match(r"\{(\d*)(,\d*)?\}", pattern[pos:])
+        if not match:
+            # not a quantifier, "{" is a literal
+            return pos, False
+        optional = not match.group(1) or int(match.group(1)) == 0
+        pos += match.end()
+    else:
+        return pos, False
+    # lazy or possessive
+    if pos < len(pattern) and pattern[pos] in "?+":
+        pos += 1
+    return pos, optional
+
+
+def get_regexp_literals(pattern: str) -> tuple[str | None, str | None]:
+    """
+    Finds literal text that every value matching pattern must contain, so that cheaper conditions can be
+    added to the REGEXP. Returns a tuple of:
+    - the literal prefix, if the pattern is anchored with ^, every matching value starts with it
+    - the longest literal substring, every matching value contains it
+
+    Patterns with alternation on the top level, options, \\Q...\\E or escaped backslashes are not analyzed.
+    Groups, character classes and escapes like \\d are not literals.
+    """
+    if "(?" in pattern or "\\Q" in pattern or "\\\\" in pattern:
+        return None, None
+    anchored = pattern.startswith("^")
+    pos = 1 if anchored else 0
+    # the literal runs in the pattern, with the position they start at
+    runs: list[tuple[int, str]] = []
+    run_start = pos
+    run = ""
+
+    def end_run(next_start: int):
+        nonlocal run, run_start
+        if run:
+            runs.append((run_start, run))
+        run = ""
+        run_start = next_start
+
+    while pos < len(pattern):
+        char = pattern[pos]
+        if char == "|":
+            # alternation on the top level, nothing is required
+            return None, None
+        literal = None
+        if char == "\\":
+            escaped = pattern[pos + 1 : pos + 2]
+            if escaped and not escaped.isalnum():
+                literal = escaped
+            pos += 2
+        elif char == "[":
+            pos = _skip_regexp_brackets(pattern, pos)
+        elif char == "(":
+            pos = _skip_regexp_group(pattern, pos)
+        elif char == "{" and _skip_regexp_quantifier(pattern, pos)[0] == pos:
+            literal = char
+            pos += 1
+        elif char in _regexp_special:
+            pos += 1
+        else:
+            literal = char
+            pos += 1
+        atom_end = pos
+        pos, optional = _skip_regexp_quantifier(pattern, pos)
+        quantified = pos != atom_end
+        if literal is None or optional:
+            end_run(pos)
+            continue
+        run += literal
+        if quantified:
+            # the atom is repeated, the following literal is not directly after it
+            end_run(pos)
+
+    end_run(pos)
+    prefix = None
+    if anchored and runs and runs[0][0] == 1:
+        prefix = runs[0][1]
+    substring = max((run for _, run in runs), key=len, default=None)
+    return prefix, substring
+
+
+# the shortest word that is indexed by a fulltext index (innodb_ft_min_token_size)
+FULLTEXT_MIN_WORD_LENGTH = 3
+
+
+def _get_fulltext_words(val: str) -> list[str]:
+    """
+    The words in val that can be searched for in a fulltext index, operators of boolean mode are not words.
+    Returns an empty list if any word is too short to be indexed.
+    """
+    words = re.findall(r"\w+", val)
+    if any(len(word) < FULLTEXT_MIN_WORD_LENGTH for word in words):
+        return []
+    return words
+
+
 def _escape_wildcards(val: str):
     """
     MariaDB uses _ and & as wildcards when using the LIKE operator
@@ -161,28 +642,46 @@ def _escape_wildcards(val: str):
     return val.replace("%", "\\%").replace("_", "\\_")
 
 
-def to_where_clause(field: str, field_type: str, q: SubQuery) -> tuple[str, Any]:
+def _parse_number(value: Any) -> int | float:
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        raise errors.UserError(f"unsupported argument for numeric values: {value}")
+
+
+_numeric_ops = {"lt": "<", "lte": "<=", "gt": ">", "gte": ">="}
+
+
+def to_where_clause(field: str, field_config: Field, q: SubQuery) -> ReadyQuery:
+    """
+    Translates a clause on a field to an SQL condition with params. The column is compared directly
+    with the params, so that an index on the column can be used.
+    """
+    field_type = field_config.type
     if field_type == "float" or field_type == "integer":
-        val = q.value
-        if q.op == "equals":
-            return f"ABS(`{field}` - %s) < {get_epsilon(q.value)}", q.value
-        elif q.op == "lt":
-            op_arg = f"< %s + {get_epsilon(q.value)}"
-        elif q.op == "lte":
-            op_arg = f"<= %s + {get_epsilon(q.value)}"
-        elif q.op == "gt":
-            op_arg = f"> %s - {get_epsilon(q.value)}"
-        elif q.op == "gte":
-            op_arg = f">= %s - {get_epsilon(q.value)}"
-        else:
+        val = _parse_number(q.value)
+        if q.op not in ["equals", *_numeric_ops]:
             raise errors.UserError("unsupported operator for numeric values")
-        return f"`{field}` {op_arg}", val
+        if field_type == "integer":
+            # exact comparison
+            op = "=" if q.op == "equals" else _numeric_ops[q.op]
+            return f"`{field}` {op} %s", (val,)
+        epsilon = get_epsilon(field_config)
+        if q.op == "equals":
+            return f"`{field}` BETWEEN %s AND %s", (val - epsilon, val + epsilon)
+        # all four operators are padded by epsilon, so that they include values that are equal within epsilon
+        bound = val + epsilon if q.op in ["lt", "lte"] else val - epsilon
+        return f"`{field}` {_numeric_ops[q.op]} %s", (bound,)
     if field_type == "bool":
         if q.op != "equals":
             raise errors.UserError("unsupported operator for boolean values")
         if q.value not in ["true", "false"]:
             raise errors.UserError("unsupported argument for boolean values (must be true / false)")
-        return f"`{field}` = %s", "1" if q.value == "true" else "0"
+        return f"`{field}` = %s", ("1" if q.value == "true" else "0",)
     else:
         val = cast(str, q.value)
 
@@ -190,17 +689,56 @@ def to_where_clause(field: str, field_type: str, q: SubQuery) -> tuple[str, Any]
         # val = val.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
         if q.op == "equals":
             op = "="
+        elif q.op == "in":
+            # created by normalize_query, the value is a tuple
+            placeholders = ", ".join(["%s"] * len(cast(tuple, q.value)))
+            return f"`{field}` IN ({placeholders})", cast(tuple, q.value)
         elif q.op == "startswith":
             op = "LIKE"
             val = f"{_escape_wildcards(val)}%"
         elif q.op == "endswith":
             op = "LIKE"
+            if "reverse" in field_config.text_indexes:
+                # the reversed column is indexed and the LIKE on it can use the index, the LIKE on the column
+                # makes sure that the result is exact
+                return (
+                    f"(`{field}__reversed` LIKE %s AND `{field}` LIKE %s)",
+                    (f"{_escape_wildcards(val[::-1])}%", f"%{_escape_wildcards(val)}"),
+                )
             val = f"%{_escape_wildcards(val)}"
         elif q.op == "contains":
             op = "LIKE"
+            trigrams = get_trigrams(val)
+            if "trigram" in field_config.text_indexes and trigrams:
+                return _trigram_where_clause(field, field_config, trigrams, f"%{_escape_wildcards(val)}%")
+            words = _get_fulltext_words(val)
+            if field_config.contains_mode == "fulltext" and words:
+                # the fulltext index finds the values with words starting with the words in val, LIKE makes
+                # sure that val is in the value
+                return (
+                    f"(MATCH(`{field}`) AGAINST (%s IN BOOLEAN MODE) AND `{field}` LIKE %s)",
+                    (" ".join(f"+{word}*" for word in words), f"%{_escape_wildcards(val)}%"),
+                )
             val = f"%{_escape_wildcards(val)}%"
+        elif q.op == "freetext":
+            if "fulltext" not in field_config.text_indexes:
+                # the fulltext index has not been built for the resource, find the values that contain val
+                return f"`{field}` LIKE %s", (f"%{_escape_wildcards(val)}%",)
+            return f"MATCH(`{field}`) AGAINST (%s)", (val,)
         elif q.op == "regexp":
             op = "REGEXP"
+            prefix, substring = get_regexp_literals(val)
+            if prefix:
+                # LIKE can use an index on the column to find the candidates, REGEXP makes sure the result is exact
+                return f"(`{field}` LIKE %s AND `{field}` REGEXP %s)", (f"{_escape_wildcards(prefix)}%", val)
+            if substring:
+                trigrams = get_trigrams(substring)
+                like_val = f"%{_escape_wildcards(substring)}%"
+                if "trigram" in field_config.text_indexes and trigrams:
+                    candidates, params = _trigram_where_clause(field, field_config, trigrams, like_val)
+                else:
+                    candidates, params = f"`{field}` LIKE %s", (like_val,)
+                return f"({candidates} AND `{field}` REGEXP %s)", (*params, val)
         elif q.op == "lt":
             op = "<"
         elif q.op == "lte":
@@ -212,4 +750,4 @@ def to_where_clause(field: str, field_type: str, q: SubQuery) -> tuple[str, Any]
         else:
             # this should not happen since the query parser would not accept other operators
             raise errors.InternalError("unknown operator in query")
-        return f"`{field}` {op} %s", val
+        return f"`{field}` {op} %s", (val,)
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# copyright: ignore
+#
+# CAVEAT UTILITOR
+#
+#  This file was automatically generated by 竜TatSu v5.18.0
+#
+#     https://pypi.python.org/pypi/tatsu/
+#
+#  Any changes you make to it will be overwritten the next time
+#  the file is generated.
+#
+# noqa # type: ignore # ruff: noqa
+# fmt: off
+
+from __future__ import annotations
+
+from typing import Any
+
+from tatsu import decorators as tatsu
+from tatsu.contexts import Ctx
+from tatsu.parserconfig import ParserConfig
+from tatsu.parsing import Parser, generic_main
+from tatsu.tokenizing.buffer import Buffer
+from tatsu.tokenizing.textlines import TextLinesTokenizer
+
+
+KEYWORDS: set[str] = set()
+
+
+class KarpQueryTokenizer(TextLinesTokenizer):
+    def __init__(
+        self,
+        text, /,
+        config: ParserConfig | None = None,
+        **settings,
+    ) -> None:
+        config = ParserConfig.new(
+            config=config,
+            whitespace=None,
+            nameguard=None,
+            ignorecase=False,
+            namechars='',
+            parseinfo=False,
+            comments=r'None',
+            eol_comments=r'None',
+            keywords=KEYWORDS,
+            start='start',
+        )
+        assert isinstance(config, ParserConfig)
+        config = config.override(**settings)
+
+        super().__init__(text, config=config)
+
+
+class KarpQueryBuffer(Buffer):  # NOTE: backwards compatibility
+    def __init__(
+        self,
+        text, /,
+        config: ParserConfig | None = None,
+        **settings,
+    ) -> None:
+        config = ParserConfig.new(
+            config=config,
+            whitespace=None,
+            nameguard=None,
+            ignorecase=False,
+            namechars='',
+            parseinfo=False,
+            comments=r'None',
+            eol_comments=r'None',
+            keywords=KEYWORDS,
+            start='start',
+        )
+        assert isinstance(config, ParserConfig)
+        config = config.override(**settings)
+
+        super().__init__(text, config=config)
+
+
+class KarpQueryParser(Parser):
+    def __init__(self, /, config: ParserConfig | None = None, **settings):
+        config = ParserConfig.new(config, **settings)
+        rulessource = KarpQueryRules()
+        assert isinstance(config, ParserConfig)
+        tokenizercls = config.tokenizercls or KarpQueryTokenizer
+
+        super().__init__(rulessource, config=config, tokenizercls=tokenizercls)
+
+
+class KarpQueryRules:
+    def __init__(self, /, config: ParserConfig | None = None, **settings):
+        config = ParserConfig.new(
+            config=config,
+            whitespace=None,
+            nameguard=None,
+            ignorecase=False,
+            namechars='',
+            parseinfo=False,
+            comments=r'None',
+            eol_comments=r'None',
+            keywords=KEYWORDS,
+            start='start',
+        )
+        assert isinstance(config, ParserConfig)
+        config = config.override(**settings)
+        self._config = config
+
+
+    @tatsu.rule
+    def start(self, ctx: Ctx) -> Any:
+        self.expression(ctx)
+        ctx.eofcheck()
+
+    @tatsu.rule
+    def expression(self, ctx: Ctx) -> Any:
+        with ctx.choice() as α:
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                self.logical_expression(ctx)
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                self.query_expression(ctx)
+
+    @tatsu.rule
+    def query_expression(self, ctx: Ctx) -> Any:
+        with ctx.choice() as α:
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                self.text_arg_expr(ctx)
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                self.any_arg_expr(ctx)
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                self.freetext_expr(ctx)
+
+    @tatsu.rule('TextArgExpression')
+    def text_arg_expr(self, ctx: Ctx) -> Any:
+        ctx.define(['arg', 'field', 'op'], [])
+        with ctx.nameset('op'):
+            self.text_value_op(ctx)
+        ctx.token('|')
+        with ctx.nameset('field'):
+            self.identifier(ctx)
+        ctx.token('|')
+        with ctx.nameset('arg'):
+            self.string_value(ctx)
+
+    @tatsu.rule
+    def text_value_op(self, ctx: Ctx) -> Any:
+        with ctx.choice() as α:
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                ctx.token('contains')
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                ctx.token('endswith')
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                ctx.token('regexp')
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                ctx.token('startswith')
+
+    @tatsu.rule('AnyArgExpression')
+    def any_arg_expr(self, ctx: Ctx) -> Any:
+        ctx.define(['arg', 'field', 'op'], [])
+        with ctx.nameset('op'):
+            self.any_arg_op(ctx)
+        ctx.token('|')
+        with ctx.nameset('field'):
+            self.identifier(ctx)
+        ctx.token('|')
+        with ctx.nameset('arg'):
+            self.any_value(ctx)
+
+    @tatsu.rule('FreetextExpression')
+    def freetext_expr(self, ctx: Ctx) -> Any:
+        ctx.define(['arg', 'op'], [])
+        with ctx.nameset('op'):
+            ctx.token('freetext')
+        ctx.token('|')
+        with ctx.nameset('arg'):
+            self.string_value(ctx)
+
+    @tatsu.rule
+    def any_arg_op(self, ctx: Ctx) -> Any:
+        with ctx.choice() as α:
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                ctx.token('equals')
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                ctx.token('gt')
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                ctx.token('gte')
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                ctx.token('lt')
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                ctx.token('lte')
+
+    @tatsu.rule
+    def logical_expression(self, ctx: Ctx) -> Any:
+        with ctx.choice() as α:
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                self.and_(ctx)
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                self.or_(ctx)
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                self.not_(ctx)
+
+    @tatsu.rule('Not')
+    def not_(self, ctx: Ctx) -> Any:
+        ctx.define(['args', 'op'], [])
+        with ctx.nameset('op'):
+            ctx.token('not')
+        ctx.token('(')
+        with ctx.nameset('args'):
+            with ctx.gatherplus() as g:
+                g.expecting('<expression>')
+
+                @g.sep
+                def _(ctx: Ctx) -> Any:
+                    ctx.token('||')
+
+                @g.exp
+                def _(ctx: Ctx) -> Any:
+                    self.expression(ctx)
+        ctx.token(')')
+
+    @tatsu.rule('And')
+    def and_(self, ctx: Ctx) -> Any:
+        ctx.define(['args', 'op'], [])
+        with ctx.nameset('op'):
+            ctx.token('and')
+        ctx.token('(')
+        with ctx.nameset('args'):
+            with ctx.gatheropt() as g:
+                g.expecting('<expression>')
+
+                @g.sep
+                def _(ctx: Ctx) -> Any:
+                    ctx.token('||')
+
+                @g.exp
+                def _(ctx: Ctx) -> Any:
+                    self.expression(ctx)
+        ctx.token(')')
+
+    @tatsu.rule('Or')
+    def or_(self, ctx: Ctx) -> Any:
+        ctx.define(['args', 'op'], [])
+        with ctx.nameset('op'):
+            ctx.token('or')
+        ctx.token('(')
+        with ctx.nameset('args'):
+            with ctx.gatheropt() as g:
+                g.expecting('<expression>')
+
+                @g.sep
+                def _(ctx: Ctx) -> Any:
+                    ctx.token('||')
+
+                @g.exp
+                def _(ctx: Ctx) -> Any:
+                    self.expression(ctx)
+        ctx.token(')')
+
+    @tatsu.rule
+    def any_value(self, ctx: Ctx) -> Any:
+        with ctx.choice() as α:
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                self.integer_value(ctx)
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                self.string_value(ctx)
+
+    @tatsu.rule('StringValue')
+    def string_value(self, ctx: Ctx) -> Any:
+        with ctx.choice() as α:
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                self.unquoted_string_value(ctx)
+            @α.option
+            def _(ctx: Ctx) -> Any:
+                self.quoted_string_value(ctx)
+
+    @tatsu.rule
+    def unquoted_string_value(self, ctx: Ctx) -> Any:
+        with ctx.result():
+            ctx.pattern(r'[^|)("]+')
+
+    @tatsu.rule('QuotedStringValue')
+    def quoted_string_value(self, ctx: Ctx) -> Any:
+        ctx.token('"')
+        with ctx.result():
+            with ctx.loopopt() as cl:
+                cl.expecting('(?s)\\s+', '[^"]', '\\"')
+
+                @cl.exp
+                def _(ctx: Ctx) -> Any:
+                    with ctx.choice() as α:
+                        @α.option
+                        def _(ctx: Ctx) -> Any:
+                            ctx.pattern(r'(?s)\s+')
+                        @α.option
+                        def _(ctx: Ctx) -> Any:
+                            ctx.token('\\"')
+                        @α.option
+                        def _(ctx: Ctx) -> Any:
+                            ctx.pattern(r'[^"]')
+        ctx.token('"')
+
+    @tatsu.rule('int')
+    def integer_value(self, ctx: Ctx) -> Any:
+        ctx.pattern(r'\d+$')
+
+    @tatsu.rule('Identifier')
+    def identifier(self, ctx: Ctx) -> Any:
+        ctx.pattern(r'[^|]+')
+
+
+def main(filename, **kwargs):
+    if not filename or filename == '-':
+        import sys
+
+        text = sys.stdin.read()
+    else:
+        import pathlib
+
+        text = pathlib.Path(filename).read_text()
+
+    parser = KarpQueryParser()
+    return parser.parse(text, filename=filename, **kwargs)
+
+
+if __name__ == '__main__':
+    import json
+    from tatsu.util import asjson
+
+    ast = generic_main(main, KarpQueryParser, name='KarpQuery')
+    data = asjson(ast)
+    print(json.dumps(data, indent=2))
@@ -1,27 +1,178 @@
+import base64
+import binascii
 from collections import defaultdict
-from typing import Iterable, Sequence
+from dataclasses import asdict, dataclass
+import json
+import logging
+from typing import Any, Callable, Iterable, Sequence, cast
+
+from pydantic import TypeAdapter
+
 from karps.config import (
     Env,
     MainConfig,
     ResourceConfig,
+    ResourceSchema,
+    TextIndexVersions,
     format_hit,
     ensure_fields_exist,
-    get_bool_fields,
-    get_collection_fields,
-    get_table_fields,
+    uses_text_indexes,
 )
+from karps.database.cubes import cube_queries, get_cube_versions
 from karps.database.database import (
-    add_aggregation,
+    decode_value,
+    estimate_counts,
+    fetch_data_joins,
+    get_resource_sort,
+    group_counts,
     run_paged_searches,
     run_searches,
     get_search,
 )
-from karps.database.query import SQLQuery
-from karps.errors.errors import InternalError, UserError
-from karps.models import CountRequest, Header, HitResponse, SearchResult, ValueHeader
-from karps.query.query import parse_query
+from karps.database.text_index import get_text_index_versions
+from karps.database.query import SQLQuery, limit_clause, shape_fingerprint
+from karps.errors.errors import InternalError, SearchAfterError, UserError
+from karps.models import Header, HitResponse, SearchResult, Totals, ValueHeader
+from karps.query.query import NullQuery, Query, ReadyQuery, normalize_query, parse_query
+from karps.util.cache import LRUCache
 from karps.util.sorting import alphanumeric_key
 
+logger = logging.getLogger(__name__)
+
+# the hit rate of the SQL cache is logged every CACHE_STATS_INTERVAL lookups
+CACHE_STATS_INTERVAL = 1000
+
+
+def _cached[T](sql_cache: LRUCache[tuple, Any] | None, key: tuple, factory: Callable[[], T]) -> T:
+    """
+    The SQL for a request only depends on the configuration and the request parameters in key, so when
+    a cache is given (see ConfigSnapshot.sql_queries), the SQL is only generated once per key
+    """
+    if sql_cache is None:
+        return factory()
+    value = sql_cache.get_or_create(key, factory)
+    stats = sql_cache.stats()
+    if (stats.hits + stats.misses) % CACHE_STATS_INTERVAL == 0:
+        logger.info(
+            f"sql cache: {stats.hits} hits, {stats.misses} misses ({stats.hit_rate:.0%}),"
+            f" {stats.size}/{stats.maxsize} entries"
+        )
+    return value
+
+
+def _query_key(main_config: MainConfig, parsed_q: Query) -> str:
+    """
+    The part of the cache key for the query, queries that are written differently but are the same after
+    normalize_query (spacing, nesting, duplicate clauses) use the same SQL
+    """
+    return repr(normalize_query(main_config, parsed_q))
+
+
+def _get_text_index_versions(
+    env: Env, main_config: MainConfig, resources: Iterable[ResourceConfig], sql_cache: LRUCache[tuple, Any] | None
+) -> TextIndexVersions | None:
+    """
+    The text indexes that have been built, looked up once per configuration (like the SQL that uses them, the
+    configuration is reloaded by karp-s-cli after the indexes are built). None if no text indexes are configured.
+    """
+    if not uses_text_indexes(main_config, resources):
+        return None
+    return _cached(sql_cache, ("text_index_versions",), lambda: get_text_index_versions(env))
+
+
+def _resource_ids(resources: Iterable[ResourceConfig]) -> tuple[str, ...]:
+    return tuple(resource.resource_id for resource in resources)
+
+
+@dataclass
+class SearchAfter:
+    """
+    The position after the last hit of a page, returned as an opaque string in SearchResult.search_after
+    """
+
+    # the request that the position is for, see _request_key
+    request: str
+    resource_id: str
+    # the values of the sort columns of the last hit (see get_resource_sort), the last one is __id
+    sort_key: list[Any]
+    # the number of hits up to and including the last hit
+    position: int
+    # the counts of the first page, so that they do not need to be counted again, None if totals is none
+    resource_hits: dict[str, int] | None
+    totals: Totals = "exact"
+
+    def encode(self) -> str:
+        data = json.dumps(asdict(self), default=str, separators=(",", ":"))
+        return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+    @classmethod
+    def decode(cls, search_after: str, request: str) -> "SearchAfter":
+        """
+        Checks the types of the fields, the values of sort_key are checked against the sort columns by
+        check_sort_key
+        """
+        try:
+            result = _search_after_adapter.validate_json(
+                base64.urlsafe_b64decode(search_after.encode("ascii")), strict=True
+            )
+        except (binascii.Error, UnicodeError, ValueError):
+            raise SearchAfterError("is malformed")
+        if result.request != request:
+            raise SearchAfterError(_OTHER_SEARCH)
+        return result
+
+    def check_sort_key(self, main_config: MainConfig, resource_sort: Sequence[tuple[str, str]]):
+        if len(self.sort_key) != len(resource_sort):
+            raise SearchAfterError(_OTHER_SEARCH)
+        for (field, _), value in zip(resource_sort, self.sort_key):
+            field_type = "integer" if field == "__id" else main_config.fields[field].type
+            if not _is_sort_value(field_type, value) or (field == "__id" and value is None):
+                raise SearchAfterError("is malformed")
+
+
+_search_after_adapter = TypeAdapter(SearchAfter)
+
+_OTHER_SEARCH = "is from a search with other parameters (q, resources or sort)"
+
+
+def _is_sort_value(field_type: str, value: Any) -> bool:
+    """
+    If value can be a value of a sort column of type field_type, as encoded in SearchAfter (other values than
+    numbers and booleans are strings), None for NULL
+    """
+    if value is None:
+        return True
+    if field_type == "integer":
+        return type(value) is int
+    if field_type == "float":
+        return type(value) in (int, float)
+    if field_type == "bool":
+        return type(value) in (bool, int)
+    return isinstance(value, str)
+
+
+@dataclass
+class _SearchQueries:
+    """
+    The SQL for a search, that is cached for each q, resources and sort
+    """
+
+    used_resources: list[ResourceConfig]
+    # data and count query for each resource, see SQLQuery.to_string
+    sql_queries: list[tuple[ReadyQuery, ReadyQuery | None]]
+    # the columns and sort of each data query, see union_data_queries
+    page_columns: list[tuple[list[str], Sequence[tuple[str, str]]]]
+    # the data queries as deferred joins, see SQLQuery.to_deferred_join_string
+    deferred_join_queries: list[ReadyQuery | None]
+    # the collection fields fetched after the page, see _defer_data_joins
+    deferred_data_joins: list["DeferredDataJoins"]
+    # true if there is no query, so that all entries are hits
+    unfiltered: bool
+
+
+def _request_key(q: str | None, resources: list[ResourceConfig], sort: Sequence[tuple[str, str]]) -> str:
+    return shape_fingerprint(json.dumps([q, _resource_ids(resources), list(map(list, sort))]))
+
 
 def search(
     env: Env,
@@ -31,55 +182,319 @@ def search(
     size: int = 10,
     _from: int = 0,
     sort: Sequence[tuple[str, str]] = (),
+    schema: ResourceSchema | None = None,
+    sql_cache: LRUCache[tuple, Any] | None = None,
+    search_after: str | None = None,
+    totals: Totals = "exact",
 ) -> SearchResult:
+    """
+    Pages are given either by _from (with LIMIT and OFFSET in each resource) or by search_after from the
+    previous page (with a condition on the sort columns, see SQLQuery.after). A page after search_after takes about
+    as long as the first page, since the hits before it are not scanned and the resources are not counted again.
+
+    totals is how the number of hits in each resource is given: exact (counted), estimate (from the table
+    statistics, see estimate_counts) or none. Without a query the counts are the sizes of the resources, so
+    nothing is counted. Paging with _from needs the exact counts, so they are only skipped on the first page.
+    """
+    if schema is None:
+        schema = ResourceSchema.build(main_config, resources)
     resources = sorted(resources, key=lambda r: alphanumeric_key(r.resource_id))
-    used_resources, s = get_search(main_config, resources, parse_query(q), sort=sort)
+    request_key = _request_key(q, resources, sort)
+    text_index_versions = _get_text_index_versions(env, main_config, resources, sql_cache)
+    if search_after is not None:
+        if _from:
+            raise UserError("from cannot be used together with searchAfter")
+        return _search_after(
+            env,
+            main_config,
+            resources,
+            q,
+            size,
+            sort,
+            schema,
+            SearchAfter.decode(search_after, request_key),
+            text_index_versions,
+        )
 
-    results, count_results = run_paged_searches(
-        env,
-        s,
-        size=size,
-        _from=_from,
-        bool_fields=get_bool_fields(main_config, used_resources),
-        collection_fields=get_collection_fields(main_config, used_resources),
-        table_fields=get_table_fields(main_config, used_resources),
+    parsed_q = parse_query(q)
+
+    def get_sql_queries() -> _SearchQueries:
+        used_resources, s = get_search(
+            main_config,
+            resources,
+            parsed_q,
+            selection=("*", "__id"),
+            sort=sort,
+            schema=schema,
+            text_index_versions=text_index_versions,
+        )
+        deferred = [_defer_data_joins(env, sql_query) for sql_query in s]
+        return _SearchQueries(
+            used_resources=used_resources,
+            sql_queries=[sql_query.to_string(paged=True) for sql_query in s],
+            page_columns=[(sql_query.get_columns(), sql_query.get_order_by()) for sql_query in s],
+            deferred_join_queries=[sql_query.to_deferred_join_string() for sql_query in s],
+            deferred_data_joins=deferred,
+            unfiltered=isinstance(parsed_q, NullQuery),
+        )
+
+    key = ("search", _query_key(main_config, parsed_q), _resource_ids(resources), tuple(map(tuple, sort)))
+    search_queries = _cached(sql_cache, key, get_sql_queries)
+    used_resources, sql_queries = search_queries.used_resources, search_queries.sql_queries
+
+    # an unfiltered search hits all the entries of each resource
+    counts = [resource_config.size for resource_config in used_resources] if search_queries.unfiltered else None
+    search_kwargs: dict[str, Any] = dict(
+        bool_fields=schema.bool_fields, collection_fields=schema.collection_fields, table_fields=schema.table_fields
     )
+    count_results: Sequence[int] | None
+    if counts is None and totals != "exact" and _from == 0:
+        # the first page does not need the counts, take hits from each resource until the page is full
+        results, _ = run_paged_searches(env, _with_limit(sql_queries, size), paged=False, **search_kwargs)
+        count_results = None
+        if totals == "estimate":
+            count_queries = [cast(ReadyQuery, count_query) for _, count_query in sql_queries]
+            count_results = estimate_counts(env, used_resources, count_queries)
+    else:
+        results, count_results = run_paged_searches(
+            env,
+            sql_queries,
+            size=size,
+            _from=_from,
+            counts=counts,
+            page_columns=search_queries.page_columns,
+            deferred_join_queries=search_queries.deferred_join_queries,
+            **search_kwargs,
+        )
+        if totals == "none":
+            count_results = None
 
-    total = 0
     all_hits = []
-    resource_hits = {}
-    resource_order = []
     page_exists = _from == 0
-    for resource_config, resource_hit in zip(used_resources, results):
+    # the last hit of the page, for search_after
+    last_hit = None
+    for resource_config, resource_hit, resource_deferred in zip(
+        used_resources, results, search_queries.deferred_data_joins
+    ):
         if resource_hit is None:
             continue
         page_exists = True
-        (_, hits) = resource_hit
-        hits = [
+        (columns, hits) = resource_hit
+        hits = hits[: size - len(all_hits)]
+        columns, hits = _fetch_deferred(env, schema, resource_config, resource_deferred, columns, hits)
+        if hits:
+            last_hit = (resource_config, columns, hits[-1])
+        all_hits.extend(
             HitResponse(
-                **{
-                    "entry": format_hit(main_config, resource_config, hit),
-                    "resource_id": resource_config.resource_id,
-                }
+                entry=format_hit(schema, resource_config.resource_id, hit), resource_id=resource_config.resource_id
             )
             for hit in hits
-        ]
-
-        all_hits.extend(hits)
-        if len(all_hits) > size:
+        )
+        if len(all_hits) >= size:
             break
 
     if not page_exists:
         raise UserError(f"Requested from does not exist, value: {_from}")
 
-    for resource_config, lexicon_total in zip(used_resources, count_results):
-        resource_order.append(resource_config.resource_id)
-        if lexicon_total is None:
+    resource_order = [resource_config.resource_id for resource_config in used_resources]
+    resource_hits = None
+    total = None
+    if count_results is not None:
+        if len(count_results) != len(used_resources):
             raise InternalError("Count queries failed")
-        resource_hits[resource_config.resource_id] = lexicon_total
-        total += lexicon_total
+        resource_hits = dict(zip(resource_order, count_results))
+        total = sum(count_results)
 
-    return SearchResult(hits=all_hits, resource_hits=resource_hits, resource_order=resource_order, total=total)
+    next_search_after = None
+    if last_hit and _has_next_page(totals, _from + len(all_hits), total, len(all_hits), size):
+        next_search_after = _get_search_after(
+            request_key,
+            schema,
+            sort,
+            *last_hit,
+            position=_from + len(all_hits),
+            resource_hits=resource_hits,
+            totals=totals,
+        )
+    return SearchResult(
+        hits=all_hits,
+        resource_hits=resource_hits,
+        resource_order=resource_order,
+        total=total,
+        search_after=next_search_after,
+    )
+
+
+# the columns of a data query before SQLQuery.defer_data_joins and the removed data joins
+type DeferredDataJoins = tuple[list[str], dict[str, tuple[str | None, Sequence[str]]]]
+
+
+def _defer_data_joins(env: Env, sql_query: SQLQuery) -> DeferredDataJoins:
+    """
+    With TWO_PHASE_FETCH, the data query only selects the page, the values of the collection fields are fetched
+    for the hits of the page afterwards by _fetch_deferred. Fields that the hits are sorted on are kept in the
+    data query.
+    """
+    columns = sql_query.get_columns()
+    if not env.two_phase_fetch:
+        return columns, {}
+    return columns, sql_query.defer_data_joins(keep=[field for field, _ in sql_query.get_order_by()])
+
+
+def _fetch_deferred(
+    env: Env,
+    schema: ResourceSchema,
+    resource_config: ResourceConfig,
+    deferred: DeferredDataJoins,
+    columns: list[str],
+    hits: list[list[Any]],
+) -> tuple[list[str], list[list[Any]]]:
+    """
+    Adds the values of the deferred collection fields to hits, in the columns of the data query without
+    SQLQuery.defer_data_joins
+    """
+    all_columns, data_joins = deferred
+    if not data_joins:
+        return columns, hits
+    id_idx = columns.index("__id")
+    values = fetch_data_joins(env, resource_config.resource_id, data_joins, [hit[id_idx] for hit in hits])
+    result = []
+    for hit in hits:
+        hit_values = dict(zip(columns, hit))
+        for column, column_values in values.items():
+            hit_values[column] = decode_value(
+                column,
+                column_values.get(hit[id_idx]),
+                schema.bool_fields,
+                schema.collection_fields,
+                schema.table_fields,
+            )
+        result.append([hit_values[column] for column in all_columns])
+    return all_columns, result
+
+
+def _with_limit(sql_queries: Sequence[tuple[ReadyQuery, ReadyQuery | None]], size: int):
+    """
+    The data queries with LIMIT size and without count queries, for run_paged_searches with paged=False. A resource
+    never needs to give more hits than size, the results are only fetched until the page is full.
+    """
+    limit_str, limit_params = limit_clause(size, 0)
+    return [((data_sql + limit_str, data_params + limit_params), None) for (data_sql, data_params), _ in sql_queries]
+
+
+def _has_next_page(totals: Totals, position: int, total: int | None, page_hits: int, size: int) -> bool:
+    if totals == "exact" and total is not None:
+        return position < total
+    # estimated counts can be too small, so there may be more hits as long as the page is full
+    return page_hits == size
+
+
+def _get_search_after(
+    request_key: str,
+    schema: ResourceSchema,
+    sort: Sequence[tuple[str, str]],
+    resource_config: ResourceConfig,
+    columns: list[str],
+    hit: list[Any],
+    position: int,
+    resource_hits: dict[str, int] | None,
+    totals: Totals,
+) -> str | None:
+    """
+    Creates search_after for the position after hit. None if the hits are not sorted or are sorted on
+    collection fields, which cannot be compared with keyset conditions.
+    """
+    if not sort:
+        return None
+    resource_sort = get_resource_sort(resource_config, schema.field_names[resource_config.resource_id], sort)
+    if any(field in schema.collection_fields for field, _ in resource_sort):
+        return None
+    return SearchAfter(
+        request=request_key,
+        resource_id=resource_config.resource_id,
+        sort_key=[hit[columns.index(field)] for field, _ in resource_sort],
+        position=position,
+        resource_hits=resource_hits,
+        totals=totals,
+    ).encode()
+
+
+def _search_after(
+    env: Env,
+    main_config: MainConfig,
+    resources: list[ResourceConfig],
+    q: str | None,
+    size: int,
+    sort: Sequence[tuple[str, str]],
+    schema: ResourceSchema,
+    after: SearchAfter,
+    text_index_versions: TextIndexVersions | None = None,
+) -> SearchResult:
+    used_resources, s = get_search(
+        main_config,
+        resources,
+        parse_query(q),
+        selection=("*", "__id"),
+        sort=sort,
+        schema=schema,
+        text_index_versions=text_index_versions,
+    )
+    used_resource_ids = _resource_ids(used_resources)
+    if after.resource_id not in used_resource_ids:
+        raise SearchAfterError(_OTHER_SEARCH)
+    start = used_resource_ids.index(after.resource_id)
+    used_resources, s = used_resources[start:], s[start:]
+    resource_sort = get_resource_sort(used_resources[0], schema.field_names[after.resource_id], sort)
+    after.check_sort_key(main_config, resource_sort)
+    s[0].after(after.sort_key)
+    deferred = [_defer_data_joins(env, sql_query) for sql_query in s]
+
+    results, _ = run_paged_searches(
+        env,
+        _with_limit([sql_query.to_string() for sql_query in s], size),
+        paged=False,
+        bool_fields=schema.bool_fields,
+        collection_fields=schema.collection_fields,
+        table_fields=schema.table_fields,
+    )
+
+    all_hits = []
+    last_hit = None
+    for resource_config, resource_hit, resource_deferred in zip(used_resources, results, deferred):
+        (columns, hits) = cast(tuple[list[str], list[list[Any]]], resource_hit)
+        hits = hits[: size - len(all_hits)]
+        columns, hits = _fetch_deferred(env, schema, resource_config, resource_deferred, columns, hits)
+        if hits:
+            last_hit = (resource_config, columns, hits[-1])
+        all_hits.extend(
+            HitResponse(
+                entry=format_hit(schema, resource_config.resource_id, hit), resource_id=resource_config.resource_id
+            )
+            for hit in hits
+        )
+        if len(all_hits) == size:
+            break
+
+    total = sum(after.resource_hits.values()) if after.resource_hits is not None else None
+    position = after.position + len(all_hits)
+    next_search_after = None
+    if last_hit and _has_next_page(after.totals, position, total, len(all_hits), size):
+        next_search_after = _get_search_after(
+            after.request,
+            schema,
+            sort,
+            *last_hit,
+            position=position,
+            resource_hits=after.resource_hits,
+            totals=after.totals,
+        )
+    return SearchResult(
+        hits=all_hits,
+        resource_hits=after.resource_hits,
+        resource_order=list(used_resource_ids),
+        total=total,
+        search_after=next_search_after,
+    )
 
 
 def _make_column_data(data_column, column, entry_headers):
@@ -131,7 +546,14 @@ def count(
     compile: Sequence[str] = (),
     columns: Iterable[tuple[str, str]] = (),
     sort: Sequence[tuple[str, str]] = (),
+    schema: ResourceSchema | None = None,
+    sql_cache: LRUCache[tuple, Any] | None = None,
 ) -> tuple[list[Header], list[list[object]], list[object]]:
+    """
+    The rows, the columns and the total are computed from one query, that counts the hits grouped on all the
+    fields of compile and columns (see group_counts), the groups are combined here for each column. Without q,
+    the groups are taken from the tables of a cube with the same fields, if it is up to date (see create_cubes).
+    """
     compile = sorted(compile, key=alphanumeric_key)
     # sort columns by the "exploding" column
     columns = sorted(columns, key=lambda column: alphanumeric_key(column[0]))
@@ -141,89 +563,158 @@ def count(
     # add the column header for "total"
     final_headers.append(Header(type="total"))
 
-    query = parse_query(q)
-    rows = []
-    for column in columns:
-        model_headers = _count_subquery(main_config, env, resources, query, compile, column, sort, rows)
-        # add the column headers for extra columns
-        final_headers.extend(model_headers)
-    total_row = []
-    _count_subquery(main_config, env, resources, query, [], ("resource_id", "_count"), None, total_row)
+    if schema is None:
+        schema = ResourceSchema.build(main_config, resources)
+    # the total row has the number of hits in each resource
+    all_columns = columns + [("resource_id", "_count")]
+    fields = list(dict.fromkeys(compile + [field for column in all_columns for field in column if field != "_count"]))
+    ensure_fields_exist(schema, fields)
+    groupings: dict[str, list[str]] = {}
+    if compile:
+        groupings["__compile"] = compile
+    for idx, (column_field, cell_field) in enumerate(all_columns):
+        # the total row is not split on compile
+        grouping = compile if idx < len(columns) else []
+        groupings[f"__column_{idx}"] = grouping + [column_field]
+        if cell_field != "_count":
+            groupings[f"__cell_{idx}"] = grouping + [column_field, cell_field]
 
-    # create the final total row, with "-" for each compile column
-    total = ["-" for _ in compile] + total_row[0]
+    parsed_q = parse_query(q)
 
-    return final_headers, rows, total
+    def get_sql_query() -> ReadyQuery:
+        # without q, the groups may already be counted in a cube, the version check is cached with the query
+        cube = main_config.get_cube(fields) if isinstance(parsed_q, NullQuery) else None
+        if cube:
+            queries = cube_queries(cube, resources, get_cube_versions(env, cube))
+            if queries is not None:
+                return group_counts(queries, fields, groupings, compile, sort=sort, count="SUM(`count`)").to_string()[0]
+        configs, s = get_search(
+            main_config,
+            resources,
+            parsed_q,
+            selection=fields,
+            sort=[],
+            schema=schema,
+            text_index_versions=_get_text_index_versions(env, main_config, resources, sql_cache),
+        )
+        s2: Sequence[tuple[ResourceConfig, SQLQuery]] = list(zip(configs, s))
+        return group_counts(s2, fields, groupings, compile, sort=sort).to_string()[0]
 
+    key = (
+        "count",
+        _query_key(main_config, parsed_q),
+        _resource_ids(resources),
+        tuple(compile),
+        tuple(columns),
+        tuple(map(tuple, sort or ())),
+    )
+    sql_query = _cached(sql_cache, key, get_sql_query)
+    result_columns, result = next(run_searches(env, [sql_query]))
+    groups = [dict(zip(result_columns, row)) for row in result]
 
-def _count_subquery(main_config, env, resources, query, compile, column, sort, rows):
-    selection = set(compile + ([column[0]] + ([column[1]] if column[1] != "_count" else []) if column else []))
-    ensure_fields_exist(resources, selection)
-    configs, s = get_search(main_config, resources, query, selection=selection, sort=[])
-    s2: Sequence[tuple[ResourceConfig, SQLQuery]] = list(zip(configs, s))
+    # the groups of each row, in the order of the query
+    compile_groups: dict[Any, list[dict[str, Any]]] = {}
+    for group in groups:
+        compile_groups.setdefault(group["__compile"] if compile else None, []).append(group)
+    if not compile and not compile_groups:
+        # without compile, there is a row also when there are no hits
+        compile_groups[None] = []
 
-    agg_s = add_aggregation(s2, compile, column, sort=sort)
+    rows: list[list[object]] = []
+    if columns:
+        for row_groups in compile_groups.values():
+            # the values of compile are the same for all the groups of the row
+            row: list[object] = [
+                decode_value(
+                    field, row_groups[0][field], schema.bool_fields, schema.collection_fields, schema.table_fields
+                )
+                for field in compile
+            ]
+            rows.append(row + [sum(group["count"] for group in row_groups)])
+    for idx, column in enumerate(columns):
+        # collect the headers caused by using columns-parameter (not known at query time)
+        columns_headers = defaultdict(set)
+        entries_data = [
+            _make_column_data(_get_column_data(schema, row_groups, idx, column), column, columns_headers)
+            for row_groups in compile_groups.values()
+        ]
+        # add the column headers for extra columns
+        final_headers.extend(_create_columns_headers(columns_headers))
+        for row, entry_data in zip(rows, entries_data):
+            row.extend(_get_column_cells(columns_headers, entry_data, column))
 
-    _, res = next(
-        run_searches(
-            env,
-            [agg_s],
-            CountRequest(compile=compile, columns=column),
-            bool_fields=get_bool_fields(main_config, resources),
-            collection_fields=get_collection_fields(main_config, resources),
-            table_fields=get_table_fields(main_config, resources),
-        )
+    total_column = all_columns[-1]
+    total_headers = defaultdict(set)
+    total_data = _make_column_data(
+        _get_column_data(schema, groups, len(columns), total_column), total_column, total_headers
+    )
+    # create the final total row, with "-" for each compile column
+    total = (
+        ["-" for _ in compile]
+        + [sum(group["count"] for group in groups)]
+        + _get_column_cells(total_headers, total_data, total_column)
     )
 
-    # collect the headers caused by using columns-parameter (not known at query time)
-    columns_headers = defaultdict(set)
+    return final_headers, rows, total
 
-    def handle_row(row):
-        if column:
-            entry_data = _make_column_data(row[-1], column, columns_headers)
-        else:
-            entry_data = {}
-        # append total directly after compile columns
-        return list(row[1:-1]) + [int(row[0])], entry_data
 
-    result = []
-    for row in res:
-        result.append(handle_row(row))
+def _get_column_data(
+    schema: ResourceSchema, groups: list[dict[str, Any]], idx: int, column: tuple[str, str]
+) -> list[dict[str, Any]]:
+    """
+    Combines the groups of a row into the data for column number idx: a count for each value of the column field
+    and, unless the cell field is _count, a count for each value of the cell field, see _make_column_data
+    """
+    column_field, cell_field = column
+    column_data: dict[Any, dict[str, Any]] = {}
+    cells: dict[Any, dict[Any, dict[str, Any]]] = defaultdict(dict)
+    for group in groups:
+        column_key = group[f"__column_{idx}"]
+        if column_key not in column_data:
+            column_data[column_key] = {column_field: group[column_field], "count": 0}
+        column_data[column_key]["count"] += group["count"]
+        if cell_field != "_count":
+            cell_key = group[f"__cell_{idx}"]
+            if cell_key not in cells[column_key]:
+                # values of collection fields are split, but not parsed as booleans
+                cell_val = decode_value(
+                    cell_field,
+                    group[cell_field],
+                    collection_fields=schema.collection_fields,
+                    table_fields=schema.table_fields,
+                )
+                cells[column_key][cell_key] = {cell_field: cell_val, "count": 0}
+            cells[column_key][cell_key]["count"] += group["count"]
+    if cell_field != "_count":
+        for column_key, elem in column_data.items():
+            elem[cell_field] = list(cells[column_key].values())
+    return list(column_data.values())
 
-    # add the column headers for extra columns
-    model_headers = _create_columns_headers(columns_headers)
 
-    append_to_existing = bool(rows)
-    for i, (row, entry_data) in enumerate(result):
-        if append_to_existing:
-            use_row = []
-        else:
-            use_row = row
-        for (explode_field, col_val), explode_values in columns_headers.items():
-            for explode_value in sorted(explode_values, key=alphanumeric_key):
-                cell_content = entry_data.get((explode_field, explode_value, col_val))
-                if cell_content:
-                    if column[1] == "_count":
-                        use_row.append({"count": cell_content["count"]})
-                    else:
-                        # TODO sort values
-                        use_row.append(
-                            {
-                                "count": cell_content["count"],
-                                "values": [
-                                    {"count": val["count"], "value": val[col_val]} for val in cell_content["values"]
-                                ],
-                            }
-                        )
+def _get_column_cells(columns_headers, entry_data, column) -> list[dict[str, Any]]:
+    """
+    The cells of a row for one column, one for each header
+    """
+    cells = []
+    for (explode_field, col_val), explode_values in columns_headers.items():
+        for explode_value in sorted(explode_values, key=alphanumeric_key):
+            cell_content = entry_data.get((explode_field, explode_value, col_val))
+            if cell_content:
+                if column[1] == "_count":
+                    cells.append({"count": cell_content["count"]})
                 else:
-                    if column[1] == "_count":
-                        use_row.append({"count": 0})
-                    else:
-                        use_row.append({"count": 0, "values": []})
-        if append_to_existing:
-            # for the succeding requests, append columns data to preexisting rows
-            rows[i].extend(use_row)
-        else:
-            # for the first request, add rows
-            rows.append(use_row)
-    return model_headers
+                    # TODO sort values
+                    cells.append(
+                        {
+                            "count": cell_content["count"],
+                            "values": [
+                                {"count": val["count"], "value": val[col_val]} for val in cell_content["values"]
+                            ],
+                        }
+                    )
+            else:
+                if column[1] == "_count":
+                    cells.append({"count": 0})
+                else:
+                    cells.append({"count": 0, "values": []})
+    return cells
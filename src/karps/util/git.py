@@ -21,6 +21,35 @@ class GitRepo:
             if "nothing to commit" not in result.stdout:
                 raise RuntimeError("Error when calling Git", result.stdout + ", " + result.stderr)
 
+    def head(self) -> str | None:
+        """
+        Returns the commit that HEAD points to by reading the files in .git directly, cheap enough to
+        be called for every request. Returns None if the repo is not initialized or has no commits.
+        """
+        git_dir = self.repo_path / ".git"
+        try:
+            head = (git_dir / "HEAD").read_text().strip()
+        except OSError:
+            return None
+        if not head.startswith("ref: "):
+            # detached HEAD
+            return head
+        ref = head[len("ref: ") :]
+        try:
+            return (git_dir / ref).read_text().strip()
+        except OSError:
+            pass
+        # the ref may only be available in packed-refs (after git gc)
+        try:
+            with open(git_dir / "packed-refs") as fp:
+                for line in fp:
+                    parts = line.split()
+                    if len(parts) == 2 and parts[1] == ref:
+                        return parts[0]
+        except OSError:
+            pass
+        return None
+
     def init(self):
         if not self.initialized:
             self._run("init")
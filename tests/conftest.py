@@ -0,0 +1,169 @@
+from pathlib import Path
+from typing import Any, Iterator, Sequence
+
+import environs
+import mysql.connector
+import pytest
+from mysql.connector.cursor import MySQLCursor
+
+from karps import search as search_module
+from karps.config import EntryWord, Env, Field, MainConfig, MultiLang, ResourceConfig, ResourceField, get_env
+from karps.database.database import get_connection, get_cursor
+from karps.util import yaml
+
+
+@pytest.fixture(scope="session")
+def db_env() -> Env:
+    """
+    The database configured with DB_HOST etc., tests that use it are skipped if it is not available
+    """
+    try:
+        env = get_env()
+    except environs.EnvError:
+        pytest.skip("no database configured")
+    try:
+        get_connection(env).close()
+    except mysql.connector.Error as e:
+        pytest.skip(f"cannot connect to database: {e}")
+    return env
+
+
+@pytest.fixture
+def db_cursor(db_env: Env) -> Iterator[MySQLCursor]:
+    with get_cursor(db_env) as cursor:
+        yield cursor
+
+
+def explain(cursor: MySQLCursor, sql: str, params: tuple) -> list[dict]:
+    """
+    Returns the rows of EXPLAIN as dicts, for checking that the indexes are used
+    """
+    cursor.execute(f"EXPLAIN {sql}", params)
+    columns = [desc[0] for desc in cursor.description or ()]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def make_resource(resource_id: str, fields: Sequence[str] = ("baseform", "pos"), **kwargs: Any) -> ResourceConfig:
+    """
+    A resource with the given fields, the first one is the entry word. kwargs replace the other defaults.
+    """
+    return ResourceConfig(
+        **{
+            "resource_id": resource_id,
+            "label": MultiLang(resource_id),
+            "fields": [ResourceField(name=field, primary=True) for field in fields],
+            "entry_word": EntryWord(field=fields[0], description=MultiLang(fields[0])),
+            "updated": 0,
+            "size": 0,
+            "link": "",
+            **kwargs,
+        }
+    )
+
+
+@pytest.fixture
+def env() -> Env:
+    """
+    For tests that replace the database functions
+    """
+    return Env(host="", user="", password="", database="", base_path="")
+
+
+@pytest.fixture
+def main_config() -> MainConfig:
+    return MainConfig(
+        tags={},
+        fields={
+            "baseform": Field(name="baseform", type="string"),
+            "pos": Field(name="pos", type="string"),
+        },
+    )
+
+
+@pytest.fixture
+def collection_config(main_config: MainConfig) -> MainConfig:
+    """
+    pos is a collection field, with the values in a table of their own
+    """
+    fields = main_config.fields | {"pos": Field(name="pos", type="string", collection=True)}
+    return main_config.model_copy(update={"fields": fields})
+
+
+@pytest.fixture
+def resource_configs() -> list[ResourceConfig]:
+    return [make_resource("r1"), make_resource("r2")]
+
+
+@pytest.fixture
+def search_calls(monkeypatch: pytest.MonkeyPatch) -> list:
+    """
+    The queries of each run_paged_searches of search, which finds no hits
+    """
+    calls = []
+
+    def run_paged_searches(env, sql_queries, **kwargs):
+        calls.append(sql_queries)
+        return [([], []) for _ in sql_queries], [0 for _ in sql_queries]
+
+    monkeypatch.setattr(search_module, "run_paged_searches", run_paged_searches)
+    return calls
+
+
+def fake_run_searches(monkeypatch: pytest.MonkeyPatch, columns: list[str], rows: list[list]) -> list:
+    """
+    Replaces run_searches of count, every query gives the rows. Returns the queries of each call.
+    """
+    calls = []
+
+    def run_searches(env, sql_queries, **kwargs):
+        calls.append(sql_queries)
+        yield columns, rows
+
+    monkeypatch.setattr(search_module, "run_searches", run_searches)
+    return calls
+
+
+@pytest.fixture
+def count_resources(db_cursor: MySQLCursor) -> Iterator[list[ResourceConfig]]:
+    """
+    Two resources with baseform and pos in the database, for /count
+    """
+    for table, values in [
+        ("test_count_r1", "(1, 'a', 'nn'), (2, 'b', 'nn'), (3, 'a', 'NN'), (4, 'c', 'vb')"),
+        ("test_count_r2", "(1, 'a', 'vb')"),
+    ]:
+        db_cursor.execute(f"DROP TABLE IF EXISTS `{table}`")
+        db_cursor.execute(
+            f"CREATE TABLE `{table}` (`__id` INT PRIMARY KEY, `baseform` VARCHAR(10), `pos` VARCHAR(10))"
+            " COLLATE utf8mb4_general_ci"
+        )
+        db_cursor.execute(f"INSERT INTO `{table}` VALUES {values}")
+    db_cursor.execute("COMMIT")
+    yield [make_resource("test_count_r1"), make_resource("test_count_r2")]
+    db_cursor.execute("DROP TABLE `test_count_r1`, `test_count_r2`")
+
+
+def create_config(base_path: Path, resource_ids: list[str]):
+    """
+    Writes a configuration with the given resources to base_path/config, for ConfigRegistry
+    """
+    config_dir = base_path / "config"
+    (config_dir / "resources").mkdir(parents=True, exist_ok=True)
+    with open(config_dir / "config.yaml", "w") as fp:
+        yaml.dump({"tags": {}}, fp)
+    with open(config_dir / "fields.yaml", "w") as fp:
+        yaml.dump([{"name": "baseform", "type": "text", "resource_id": resource_ids}], fp)
+    for resource_id in resource_ids:
+        with open(config_dir / "resources" / f"{resource_id}.yaml", "w") as fp:
+            yaml.dump(
+                {
+                    "resource_id": resource_id,
+                    "label": resource_id,
+                    "fields": [{"name": "baseform", "primary": True}],
+                    "entry_word": {"field": "baseform", "description": "baseform"},
+                    "updated": 0,
+                    "size": 0,
+                    "link": "",
+                },
+                fp,
+            )
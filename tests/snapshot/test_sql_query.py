@@ -1,7 +1,8 @@
 import itertools
 
-from karps.config import EntryWord, Field, MainConfig, MultiLang, ResourceConfig, ResourceField
-from karps.database.database import add_aggregation, get_search
+from karps import search as search_module
+from karps.config import Cube, EntryWord, Env, Field, MainConfig, MultiLang, ResourceConfig, ResourceField
+from karps.database.database import get_search
 from karps.query.query import NullQuery, Query, parse_query
 
 # NOTE in this code, snapshot is a fixture from the Syrupy snapshot testing library
@@ -53,7 +54,7 @@ PATTERNS = {
 }
 
 
-def get_queries(values) -> list[tuple[list[str], Query]]:
+def get_queries(values) -> list[tuple[list[str], str]]:
     queries = []
     for r in range(len(values) + 1):
         for combo in itertools.combinations(values, r):
@@ -67,17 +68,17 @@ def get_queries(values) -> list[tuple[list[str], Query]]:
                 elif clause == ENTRY_WORD:
                     clauses.append("equals|entry_word|1")
             if len(elems) == 1:
-                queries.append((elems, parse_query(clauses[0])))
-                queries.append((elems + ["NOT"], parse_query(f"not({clauses[0]})")))
+                queries.append((elems, clauses[0]))
+                queries.append((elems + ["NOT"], f"not({clauses[0]})"))
             elif len(elems) == 0:
-                queries.append((elems, NullQuery()))
+                queries.append((elems, ""))
             else:
                 for key, pattern in PATTERNS.items():
                     if key != "AND":
                         elems2 = elems + [key]
                     else:
                         elems2 = elems
-                    queries.append((elems2, parse_query(pattern(clauses))))
+                    queries.append((elems2, pattern(clauses)))
     return queries
 
 
@@ -94,7 +95,9 @@ def create_search_queries(query: Query = NullQuery(), resource_configs=(), selec
         return get_search(main_config, resource_configs, query)
 
 
-def create_count_query(compile_type=None, columns_type=None, query: Query = NullQuery()):
+def create_count_query(
+    monkeypatch, compile_type=None, columns_type=None, q: str = "", config: MainConfig = main_config
+):
     if compile_type is ENTRY_WORD:
         compile = ["entry_word"]
     elif compile_type == SCALAR:
@@ -104,29 +107,44 @@ def create_count_query(compile_type=None, columns_type=None, query: Query = Null
     else:
         raise RuntimeError("missing compile type given")
     if columns_type is None:
-        columns = None
+        columns = []
     elif columns_type == SCALAR:
-        columns = ("resource_id", "data3")
+        columns = [("resource_id", "data3")]
     elif columns_type == COLLECTION:
-        columns = ("resource_id", "col1")
+        columns = [("resource_id", "col1")]
     elif columns_type == ENTRY_WORD:
-        columns = ("resource_id", "entry_word")
+        columns = [("resource_id", "entry_word")]
     else:
         raise RuntimeError("missing comulmns type given")
 
-    # TODO these to rows are copied from search.py to add whatever was in compile and columns to the selection
-    selection = set(list(compile) + list(columns) if columns else ())
+    # capture the statement that count runs
+    sql_queries = []
 
-    rcs, queries = create_search_queries(query, resource_configs=resource_configs, selection=sorted(list(selection)))
-    return add_aggregation(
-        queries=list(zip(rcs, queries)), compile=compile, column=columns or ("resource_id", "_count"), sort=()
-    ).to_string()
+    def run_searches(env, queries, **kwargs):
+        sql_queries.extend(queries)
+        yield [], []
+
+    monkeypatch.setattr(search_module, "run_searches", run_searches)
+    # all cubes are up to date
+    monkeypatch.setattr(
+        search_module, "get_cube_versions", lambda env, cube: {rc.resource_id: rc.updated for rc in resource_configs}
+    )
+    search_module.count(
+        Env(host="", user="", password="", database="", base_path=""),
+        config,
+        resource_configs,
+        q=q,
+        compile=compile,
+        columns=columns,
+    )
+    [sql_query] = sql_queries
+    return sql_query
 
 
 # function for generating pytest functions, useful for reporting and being able to update single snapshots
-def make_test_search(query_type: list[str], query: Query):
+def make_test_search(query_type: list[str], q: str):
     def test(snapshot):
-        asdf = create_search_query(query=query)
+        asdf = create_search_query(query=parse_query(q))
         assert asdf == snapshot(
             # using the configuration to name snapshot
             name=f"s{','.join(query_type)}"
@@ -141,9 +159,9 @@ for idx_query, (query_type, q) in enumerate(get_queries([SCALAR, COLLECTION, ENT
 
 
 # function for generating pytest functions, useful for reporting and being able to update single snapshots
-def make_test_count(compile_type, columns_type, query_type: list[str], q: Query):
-    def test(snapshot):
-        assert create_count_query(compile_type=compile_type, columns_type=columns_type, query=q) == snapshot(
+def make_test_count(compile_type, columns_type, query_type: list[str], q: str):
+    def test(snapshot, monkeypatch):
+        assert create_count_query(monkeypatch, compile_type=compile_type, columns_type=columns_type, q=q) == snapshot(
             # using the configuration to name snapshot
             name=f"c{compile_type}_{columns_type}_{query_type}"
         )
@@ -159,3 +177,27 @@ for idx_compile, compile_type in enumerate([ENTRY_WORD, SCALAR, COLLECTION]):
             globals()[f"test_count_compile-{compile_type}_columns-{columns_type}_query-{','.join(query_type)}"] = (
                 make_test_count(compile_type, columns_type, query_type, q)
             )
+
+
+# without q, count uses a cube with the same fields
+cube_config = main_config.model_copy(
+    update={
+        "cubes": [
+            Cube(name=name, compile=[field], columns=["resource_id"])
+            for name, field in [("scalar", "data3"), ("collection", "col1")]
+        ]
+    }
+)
+
+
+def make_test_count_cube(compile_type):
+    def test(snapshot, monkeypatch):
+        assert create_count_query(monkeypatch, compile_type=compile_type, config=cube_config) == snapshot(
+            name=f"cube{compile_type}"
+        )
+
+    return test
+
+
+for compile_type in [SCALAR, COLLECTION]:
+    globals()[f"test_count_cube_compile-{compile_type}"] = make_test_count_cube(compile_type)
@@ -0,0 +1,133 @@
+import os
+from pathlib import Path
+
+from karps import config
+from karps.config import ConfigRegistry, Env, get_config_version, load_bundle_snapshot, write_bundle
+from tests.conftest import create_config
+
+
+def create_env(base_path: Path) -> Env:
+    return Env(host="", user="", password="", database="", base_path=str(base_path))
+
+
+def test_registry_reuses_snapshot(tmp_path):
+    create_config(tmp_path, ["r1", "r2"])
+    registry = ConfigRegistry(create_env(tmp_path))
+    snapshot = registry.get()
+    assert list(snapshot.resources) == ["r1", "r2"]
+    assert "baseform" in snapshot.main_config.fields
+    assert registry.get() is snapshot
+
+
+def test_registry_reloads_on_change(tmp_path):
+    create_config(tmp_path, ["r1"])
+    # check the fingerprint on every get
+    registry = ConfigRegistry(create_env(tmp_path), check_interval=0)
+    snapshot = registry.get()
+    create_config(tmp_path, ["r1", "r2"])
+    # make sure that the modification time differs even on file systems with coarse timestamps
+    resources_dir = tmp_path / "config" / "resources"
+    mtime = resources_dir.stat().st_mtime_ns + 1_000_000_000
+    os.utime(resources_dir, ns=(mtime, mtime))
+    new_snapshot = registry.get()
+    assert new_snapshot is not snapshot
+    assert list(new_snapshot.resources) == ["r1", "r2"]
+    # the old snapshot is not changed
+    assert list(snapshot.resources) == ["r1"]
+
+
+def test_registry_reloads_on_resource_edit(tmp_path):
+    create_config(tmp_path, ["r1"])
+    # check the fingerprint on every get
+    registry = ConfigRegistry(create_env(tmp_path), check_interval=0)
+    snapshot = registry.get()
+    resource_file = tmp_path / "config" / "resources" / "r1.yaml"
+    resources_dir_mtime = resource_file.parent.stat().st_mtime_ns
+    resource_file.write_text(resource_file.read_text().replace("size: 0", "size: 5"))
+    mtime = resource_file.stat().st_mtime_ns + 1_000_000_000
+    os.utime(resource_file, ns=(mtime, mtime))
+    # an edit in place does not change the directory
+    assert resource_file.parent.stat().st_mtime_ns == resources_dir_mtime
+    assert registry.get().resources["r1"].size == 5
+    assert snapshot.resources["r1"].size == 0
+
+
+def test_schema_is_built_once_per_resource_set(tmp_path):
+    create_config(tmp_path, ["r1", "r2"])
+    snapshot = ConfigRegistry(create_env(tmp_path)).get()
+    r1, r2 = snapshot.resources["r1"], snapshot.resources["r2"]
+    schema = snapshot.get_schema([r1, r2])
+    assert snapshot.get_schema([r2, r1]) is schema
+    assert snapshot.get_schema([r1]) is not schema
+    assert schema.field_names["r1"] == frozenset(["baseform"])
+    assert schema.hit_keys["r2"] == ("baseform",)
+    assert schema.collection_fields == frozenset()
+
+
+def test_bundle_is_used_when_up_to_date(tmp_path, monkeypatch):
+    create_config(tmp_path, ["r1"])
+    env = create_env(tmp_path)
+    write_bundle(env)
+
+    def fail(*args):
+        raise AssertionError("YAML should not be read")
+
+    monkeypatch.setattr(config, "load_yaml_snapshot", fail)
+    snapshot = ConfigRegistry(env).get()
+    assert list(snapshot.resources) == ["r1"]
+
+
+def test_stale_bundle_is_ignored(tmp_path):
+    create_config(tmp_path, ["r1"])
+    env = create_env(tmp_path)
+    write_bundle(env)
+    assert load_bundle_snapshot(env, get_config_version(env)) is not None
+    assert load_bundle_snapshot(env, "another version") is None
+
+
+def test_config_response_per_scope(tmp_path):
+    create_config(tmp_path, ["r1", "r2"])
+    with open(tmp_path / "config" / "resources" / "r2.yaml", "a") as fp:
+        fp.write("protected_metadata: true\n")
+    snapshot = ConfigRegistry(create_env(tmp_path)).get()
+    public = snapshot.get_config_response()
+    # access to resources without protected metadata does not change the response
+    assert snapshot.get_config_response(allowed=["r1", "unknown"]) is public
+    with_access = snapshot.get_config_response(allowed=["r2"])
+    assert b'"r2"' in with_access.body and b'"r2"' not in public.body
+    assert with_access.etag != public.etag
+
+
+def test_invalidate_forces_reload(tmp_path):
+    create_config(tmp_path, ["r1"])
+    registry = ConfigRegistry(create_env(tmp_path))
+    snapshot = registry.get()
+    registry.invalidate()
+    new_snapshot = registry.get()
+    assert new_snapshot is not snapshot
+    assert registry.get() is new_snapshot
+
+
+def test_version_is_checked_once_per_interval(tmp_path, monkeypatch):
+    create_config(tmp_path, ["r1"])
+    now = [100.0]
+    versions = []
+
+    def get_config_version(env):
+        versions.append(now[0])
+        return "v1"
+
+    monkeypatch.setattr(config.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(config, "get_config_version", get_config_version)
+    registry = ConfigRegistry(create_env(tmp_path), check_interval=5)
+    snapshot = registry.get()
+    now[0] += 4
+    assert registry.get() is snapshot
+    assert versions == [100.0]
+    now[0] += 2
+    assert registry.get() is snapshot
+    assert versions == [100.0, 106.0]
+    # an invalidation is not delayed
+    registry.invalidate()
+    assert registry.get() is not snapshot
+    assert versions == [100.0, 106.0, 106.0]
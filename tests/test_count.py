@@ -0,0 +1,73 @@
+from karps import search as search_module
+from karps.database.database import get_search, group_counts
+from karps.models import ValueHeader
+from karps.query.query import parse_query
+from tests.conftest import fake_run_searches
+
+
+def test_group_counts_sql(main_config, resource_configs):
+    configs, queries = get_search(
+        main_config, resource_configs, parse_query("equals|pos|nn"), selection=["pos", "baseform", "resource_id"]
+    )
+    sql, _ = group_counts(
+        list(zip(configs, queries)),
+        ["pos", "baseform", "resource_id"],
+        {"__compile": ["pos"], "__column_0": ["pos", "baseform"]},
+        ["pos"],
+    ).to_string()[0]
+    assert sql.startswith(
+        "SELECT `count`, `pos`, `baseform`, `resource_id`, DENSE_RANK() OVER (ORDER BY `pos`) AS `__compile`,"
+        " DENSE_RANK() OVER (ORDER BY `pos`, `baseform`) AS `__column_0`"
+        " FROM (SELECT COUNT(*) AS count, `pos`, `baseform`, `resource_id` FROM (SELECT"
+    )
+    assert sql.endswith(") as innerq GROUP BY `pos`, `baseform`, `resource_id`) as innerq ORDER BY `pos`")
+
+
+def test_count_in_one_statement(monkeypatch, env, main_config, resource_configs):
+    columns = ["count", "pos", "baseform", "resource_id", "__compile", "__column_0", "__cell_0", "__column_1"]
+    rows = [
+        # "nn" and "NN" are equal in the database, so they have the same numbers
+        [2, "nn", "a", "r1", 1, 1, 1, 1],
+        [1, "NN", "b", "r1", 1, 1, 2, 1],
+        [1, "nn", "a", "r2", 1, 1, 1, 2],
+        [3, "vb", "a", "r2", 2, 2, 3, 2],
+    ]
+    calls = fake_run_searches(monkeypatch, columns, rows)
+    headers, table, total = search_module.count(
+        env, main_config, resource_configs, q="", compile=["pos"], columns=[("pos", "baseform")]
+    )
+    assert len(calls) == 1
+    assert headers[2:] == [
+        ValueHeader(type="value", header_value="nn", header_field="pos", column_field="baseform"),
+        ValueHeader(type="value", header_value="vb", header_field="pos", column_field="baseform"),
+    ]
+    assert table == [
+        [
+            "nn",
+            4,
+            {"count": 4, "values": [{"count": 3, "value": "a"}, {"count": 1, "value": "b"}]},
+            {"count": 0, "values": []},
+        ],
+        ["vb", 3, {"count": 0, "values": []}, {"count": 3, "values": [{"count": 3, "value": "a"}]}],
+    ]
+    assert total == ["-", 7, {"count": 3}, {"count": 4}]
+
+
+def test_count_without_hits(monkeypatch, env, main_config, resource_configs):
+    fake_run_searches(monkeypatch, [], [])
+    _, table, total = search_module.count(env, main_config, resource_configs, columns=[("pos", "_count")])
+    # without compile there is always a row
+    assert table == [[0]]
+    assert total == [0]
+
+
+def test_count_result(db_env, main_config, count_resources):
+    headers, table, total = search_module.count(
+        db_env, main_config, count_resources, compile=["pos"], columns=[("resource_id", "_count")]
+    )
+    assert [header.header_value for header in headers[2:]] == ["test_count_r1", "test_count_r2"]
+    assert [[row[0].lower(), *row[1:]] for row in table] == [
+        ["nn", 3, {"count": 3}, {"count": 0}],
+        ["vb", 2, {"count": 1}, {"count": 1}],
+    ]
+    assert total == ["-", 5, {"count": 4}, {"count": 1}]
@@ -0,0 +1,72 @@
+import pytest
+
+from karps import search as search_module
+from karps.config import Cube
+from karps.database.cubes import create_cubes
+from tests.conftest import fake_run_searches
+
+cube = Cube(name="pos", compile=["pos"], columns=["resource_id"])
+
+
+@pytest.fixture
+def cube_config(main_config):
+    return main_config.model_copy(update={"cubes": [cube]})
+
+
+def test_get_cube(cube_config):
+    assert cube_config.get_cube(["pos", "resource_id"]) == cube
+    assert cube_config.get_cube(["pos", "baseform", "resource_id"]) is None
+
+
+@pytest.mark.parametrize(
+    "q,versions,from_cube",
+    [
+        ("", {"r1": 0, "r2": 0}, True),
+        ("equals|pos|nn", {"r1": 0, "r2": 0}, False),
+        # r2 has been updated since the cube was built
+        ("", {"r1": 0, "r2": -1}, False),
+        ("", {"r1": 0}, False),
+    ],
+)
+def test_count_from_cube(monkeypatch, env, cube_config, resource_configs, q, versions, from_cube):
+    calls = fake_run_searches(monkeypatch, [], [])
+    monkeypatch.setattr(search_module, "get_cube_versions", lambda env, cube: versions)
+    search_module.count(env, cube_config, resource_configs, q=q, compile=["pos"], columns=[("resource_id", "_count")])
+    [(sql, _)] = calls[0]
+    assert (
+        "FROM `r1__cube__pos` UNION ALL SELECT `count`, `pos`, `resource_id` FROM `r2__cube__pos`" in sql
+    ) == from_cube
+    assert ("SUM(`count`) AS count" in sql) == from_cube
+
+
+def test_count_without_cube_fields(monkeypatch, env, cube_config, resource_configs):
+    calls = fake_run_searches(monkeypatch, [], [])
+
+    def get_cube_versions(env, cube):
+        raise AssertionError("not used")
+
+    monkeypatch.setattr(search_module, "get_cube_versions", get_cube_versions)
+    search_module.count(env, cube_config, resource_configs, compile=["pos"], columns=[("baseform", "_count")])
+    assert "__cube__" not in calls[0][0][0]
+
+
+def test_cube_same_result(db_env, db_cursor, main_config, count_resources):
+    config = main_config.model_copy(update={"cubes": [Cube(name="test", compile=["pos"], columns=["resource_id"])]})
+
+    def count():
+        return search_module.count(
+            db_env, config, count_resources, compile=["pos"], columns=[("resource_id", "_count")]
+        )
+
+    expected = count()
+    for resource in count_resources:
+        create_cubes(db_env, config, resource)
+    try:
+        db_cursor.execute("DELETE FROM `test_count_r1`")
+        db_cursor.execute("COMMIT")
+        # the cube still has the counts from before the rows were deleted
+        assert count() == expected
+    finally:
+        db_cursor.execute("DROP TABLE IF EXISTS `test_count_r1__cube__test`, `test_count_r2__cube__test`")
+        db_cursor.execute("DELETE FROM `__cubes` WHERE `cube` = 'test'")
+        db_cursor.execute("COMMIT")
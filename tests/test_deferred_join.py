@@ -0,0 +1,105 @@
+from contextlib import contextmanager
+from dataclasses import replace
+
+import pytest
+
+from karps.config import MainConfig
+from karps.database import database
+from karps.database.query import ELEMENT_SEPARATOR, limit_clause, select
+from karps.query.query import get_query, parse_query
+
+
+def get_data_query(main_config: MainConfig, table: str, q: str, sort: list[tuple[str, str]]):
+    _, where, collection_queries = get_query(main_config, "", parse_query(q))
+    sql_q = select([("baseform", None), ("pos", None), ("__id", None)]).from_table(table).join("pos")
+    for where_field, count, collection_where in collection_queries:
+        sql_q.join(where_field, count=count, where=collection_where)
+    return sql_q.where(where).order_by(sort)
+
+
+def test_deferred_join_sql(collection_config):
+    sql, params = get_data_query(
+        collection_config, "r", "and(equals|pos|nn||startswith|baseform|a)", [("baseform", "asc"), ("__id", "asc")]
+    ).to_deferred_join_string()  # pyright: ignore[reportGeneralTypeIssues]
+    # the page is selected without the data of pos, which is only joined for the ids of the page
+    assert (
+        "`__page` AS (SELECT `__id` AS `__page_id` FROM `r` WHERE EXISTS (SELECT 1 FROM `pos_0__where`"
+        " WHERE `r`.__id = __parent_id) AND `baseform` LIKE %s ORDER BY `baseform`, `__id` LIMIT %s OFFSET %s)"
+    ) in sql
+    assert sql.endswith(
+        " SELECT `baseform`, `pos`, `__id` FROM `r` LEFT JOIN `pos__data` ON `pos__data`.__parent_id = `r`.__id"
+        " WHERE `r`.__id IN (SELECT `__page_id` FROM `__page`) ORDER BY `baseform`, `__id`"
+    )
+    assert params == ("nn", "a%")
+
+
+def test_deferred_join_keeps_sort_data(collection_config):
+    sql, _ = get_data_query(
+        collection_config, "r", "equals|baseform|a", [("pos", "desc"), ("__id", "asc")]
+    ).to_deferred_join_string()  # pyright: ignore[reportGeneralTypeIssues]
+    assert "`__page` AS (SELECT `__id` AS `__page_id` FROM `r` LEFT JOIN `pos__data`" in sql
+
+
+def test_deferred_join_needs_sort(collection_config):
+    assert get_data_query(collection_config, "r", "equals|baseform|a", []).to_deferred_join_string() is None
+
+
+@pytest.mark.parametrize("_from,deferred", [(5, False), (100, True), (150, True)])
+def test_deferred_join_above_offset(monkeypatch, env, collection_config, _from, deferred):
+    statements = []
+
+    @contextmanager
+    def get_query_cursor(config):
+        yield None
+
+    def fetchall(cursor, sql, params, cost_budget=None):
+        statements.append((sql, params))
+        return ["baseform"], []
+
+    monkeypatch.setattr(database, "get_query_cursor", get_query_cursor)
+    monkeypatch.setattr(database, "fetchall", fetchall)
+    sql_q = get_data_query(collection_config, "r", "equals|baseform|a", [("baseform", "asc"), ("__id", "asc")])
+    deferred_join_query = sql_q.to_deferred_join_string()
+    results, _ = database.run_paged_searches(
+        replace(env, deferred_join_offset=100),
+        [sql_q.to_string(paged=True)],
+        size=10,
+        _from=_from,
+        counts=[1000],
+        deferred_join_queries=[deferred_join_query],
+    )
+    list(results)
+    [(sql, params)] = statements
+    assert ("`__page` AS" in sql) == deferred
+    assert params[-2:] == limit_clause(10, _from)[1]
+
+
+@pytest.fixture
+def deferred_join_table(db_cursor):
+    db_cursor.execute("DROP TABLE IF EXISTS `test_deferred`, `test_deferred__pos`")
+    db_cursor.execute("CREATE TABLE `test_deferred` (`__id` INT PRIMARY KEY, `baseform` VARCHAR(10))")
+    db_cursor.execute("CREATE TABLE `test_deferred__pos` (`__parent_id` INT, `pos` VARCHAR(10))")
+    db_cursor.execute("INSERT INTO `test_deferred` SELECT seq, CONCAT('w', seq % 50) FROM seq_1_to_500")
+    db_cursor.execute(
+        "INSERT INTO `test_deferred__pos` SELECT seq % 400 + 1, ELT(1 + seq % 3, 'nn', 'vb', 'av') FROM seq_1_to_600"
+    )
+    db_cursor.execute("COMMIT")
+    yield db_cursor
+    db_cursor.execute("DROP TABLE `test_deferred`, `test_deferred__pos`")
+
+
+def normalize(rows):
+    # the order of the values of a collection field is not given
+    return [(baseform, sorted((pos or "").split(ELEMENT_SEPARATOR)), entry_id) for baseform, pos, entry_id in rows]
+
+
+@pytest.mark.parametrize("sort", [[("baseform", "desc"), ("__id", "asc")], [("baseform", "asc"), ("__id", "desc")]])
+def test_deferred_join_same_result(collection_config, deferred_join_table, sort):
+    sql_q = get_data_query(collection_config, "test_deferred", "or(equals|pos|nn||startswith|baseform|w1)", sort)
+    limit_str, limit_params = limit_clause(20, 130)
+    (sql, params), _ = sql_q.to_string()
+    deferred_join_table.execute(sql + limit_str, params + limit_params)
+    expected = normalize(deferred_join_table.fetchall())
+    deferred_sql, deferred_params = sql_q.to_deferred_join_string()  # pyright: ignore[reportGeneralTypeIssues]
+    deferred_join_table.execute(deferred_sql, deferred_params + limit_params)
+    assert normalize(deferred_join_table.fetchall()) == expected
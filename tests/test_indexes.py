@@ -0,0 +1,95 @@
+from contextlib import contextmanager
+import json
+
+import pytest
+
+from karps.database import indexes
+from karps.database.indexes import MissingIndex, create_indexes, find_missing_indexes
+from karps.logging import read_sql_log
+from tests.conftest import make_resource
+
+
+class FakeCursor:
+    """
+    Answers the queries of find_missing_indexes: r has baseform (indexed) and r__pos has pos and __parent_id
+    """
+
+    columns = {("r", "baseform"), ("r__pos", "pos"), ("r__pos", "__parent_id")}
+    indexed = {("r", "baseform")}
+
+    def execute(self, sql, params=()):
+        self.sql, self.params = sql, params
+
+    def fetchone(self):
+        if "information_schema.COLUMNS" in self.sql:
+            return ("varchar(100)",) if self.params in self.columns else None
+        return (1000, 10)
+
+    def fetchall(self):
+        return [(1,)] if self.params in self.indexed else []
+
+
+@pytest.fixture
+def fake_cursor(monkeypatch):
+    @contextmanager
+    def get_cursor(env):
+        yield FakeCursor()
+
+    monkeypatch.setattr(indexes, "get_cursor", get_cursor)
+
+
+def test_find_missing_indexes(env, collection_config, fake_cursor):
+    missing = find_missing_indexes(env, collection_config, [make_resource("r")])
+    assert [(index.table, index.column, index.uses) for index in missing] == [
+        ("r__pos", "__parent_id", {"join"}),
+        ("r__pos", "pos", {"query"}),
+    ]
+    assert missing[1].benefit() == "a lookup reads ~100 rows instead of 1000"
+
+
+def test_find_missing_indexes_from_log(env, collection_config, fake_cursor):
+    sql_log = [
+        {"q": "SELECT `baseform` FROM `r` WHERE `baseform` = %s", "execute_took_s": 0.5},
+        {
+            "q": "WITH `pos__data` AS (SELECT __parent_id, GROUP_CONCAT(`pos`) AS `pos` FROM `r__pos`"
+            " GROUP BY __parent_id) SELECT `baseform` FROM `r` LEFT JOIN `pos__data`"
+            " ON `pos__data`.__parent_id = `r`.__id ORDER BY `baseform`",
+            "execute_took_s": 2.0,
+        },
+    ]
+    missing = find_missing_indexes(env, collection_config, [make_resource("r")], sql_log=sql_log)
+    # pos is not queried in the log
+    [index] = missing
+    assert (index.table, index.column, index.statements, index.seconds) == ("r__pos", "__parent_id", 1, 2.0)
+    assert index.benefit() == "a lookup reads ~100 rows instead of 1000, used by 1 logged statements that took 2.00 s"
+
+
+def test_read_sql_log(tmp_path):
+    (tmp_path / "sql.jsonl").write_text(json.dumps({"q": "SELECT 2"}) + "\n" + '{"q": "SEL')
+    (tmp_path / "sql.jsonl.1").write_text(json.dumps({"q": "SELECT 1"}) + "\n")
+    assert [record["q"] for record in read_sql_log(str(tmp_path))] == ["SELECT 2", "SELECT 1"]
+
+
+@pytest.fixture
+def index_table(db_cursor):
+    db_cursor.execute("DROP TABLE IF EXISTS `test_indexes`")
+    db_cursor.execute("CREATE TABLE `test_indexes` (`__id` INT PRIMARY KEY, `baseform` TEXT)")
+    db_cursor.execute("INSERT INTO `test_indexes` SELECT seq, CONCAT('w', seq % 20) FROM seq_1_to_100")
+    db_cursor.execute("COMMIT")
+    yield db_cursor
+    db_cursor.execute("DROP TABLE `test_indexes`")
+
+
+def test_create_indexes(db_env, collection_config, index_table):
+    resource = make_resource("test_indexes", fields=["baseform"])
+    missing = find_missing_indexes(db_env, collection_config, [resource])
+    assert [(index.column, index.uses, index.rows, index.distinct) for index in missing] == [
+        ("baseform", {"query", "sort"}, 100, 20)
+    ]
+    create_indexes(db_env, missing)
+    assert find_missing_indexes(db_env, collection_config, [resource]) == []
+
+
+def test_missing_index_benefit_sort():
+    index = MissingIndex("r", "baseform", uses={"sort"}, rows=1000, distinct=10)
+    assert index.benefit() == "a sorted page is read without sorting 1000 rows"
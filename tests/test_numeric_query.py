@@ -0,0 +1,71 @@
+import pytest
+
+from karps.config import Field
+from karps.errors import errors
+from karps.query.query import SubQuery, to_where_clause
+from tests.conftest import explain
+
+frequency = Field(name="frequency", type="integer")
+score = Field(name="score", type="float")
+score_epsilon = Field(name="score", type="float", epsilon=0.5)
+
+
+@pytest.mark.parametrize(
+    "field,op,value,expected",
+    [
+        (frequency, "equals", "10", ("`frequency` = %s", (10,))),
+        (frequency, "gte", "10", ("`frequency` >= %s", (10,))),
+        (frequency, "lt", "1.5", ("`frequency` < %s", (1.5,))),
+        (score, "equals", "2", ("`score` BETWEEN %s AND %s", (1.99, 2.01))),
+        (score, "lt", "2", ("`score` < %s", (2.01,))),
+        (score, "gt", "2", ("`score` > %s", (1.99,))),
+        (score_epsilon, "equals", "2.5", ("`score` BETWEEN %s AND %s", (2.0, 3.0))),
+        (score_epsilon, "lte", "2.5", ("`score` <= %s", (3.0,))),
+    ],
+)
+def test_numeric_where_clause(field, op, value, expected):
+    assert to_where_clause(field.name, field, SubQuery(op=op, field=field.name, value=value)) == expected
+
+
+@pytest.mark.parametrize(
+    "op,sql_op,bound", [("gt", ">", 2.0), ("gte", ">=", 2.0), ("lt", "<", 3.0), ("lte", "<=", 3.0)]
+)
+def test_float_bounds_include_equal_values(op, sql_op, bound):
+    # gt and gte use value - epsilon, lt and lte use value + epsilon, so values equal within epsilon are included
+    clause = to_where_clause("score", score_epsilon, SubQuery(op=op, field="score", value="2.5"))
+    assert clause == (f"`score` {sql_op} %s", (bound,))
+
+
+def test_numeric_value_must_be_number():
+    with pytest.raises(errors.UserError):
+        to_where_clause("frequency", frequency, SubQuery(op="equals", field="frequency", value="many"))
+
+
+@pytest.fixture
+def numeric_table(db_cursor):
+    db_cursor.execute("DROP TABLE IF EXISTS `test_numeric`")
+    db_cursor.execute(
+        "CREATE TABLE `test_numeric` (`__id` INT PRIMARY KEY, `frequency` INT, `score` DOUBLE,"
+        " INDEX `frequency_idx` (`frequency`), INDEX `score_idx` (`score`))"
+    )
+    db_cursor.execute("INSERT INTO `test_numeric` SELECT seq, seq, seq / 7 FROM seq_1_to_10000")
+    db_cursor.execute("ANALYZE TABLE `test_numeric`")
+    db_cursor.fetchall()
+    yield db_cursor
+    db_cursor.execute("DROP TABLE `test_numeric`")
+
+
+@pytest.mark.parametrize(
+    "field,op,value,key",
+    [
+        (frequency, "equals", "10", "frequency_idx"),
+        (frequency, "lt", "10", "frequency_idx"),
+        (score, "equals", "2", "score_idx"),
+        (score, "gte", "1400", "score_idx"),
+    ],
+)
+def test_numeric_query_uses_index(numeric_table, field, op, value, key):
+    where, params = to_where_clause(field.name, field, SubQuery(op=op, field=field.name, value=value))
+    (plan,) = explain(numeric_table, f"SELECT `__id` FROM `test_numeric` WHERE {where}", params)
+    assert plan["key"] == key
+    assert plan["type"] in ["range", "ref"]
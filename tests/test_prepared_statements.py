@@ -0,0 +1,66 @@
+from karps.database.database import PreparedStatementCursor, fetchall
+from karps.database.query import limit_clause, select, shape_fingerprint
+
+
+class FakePreparedCursor:
+    def __init__(self):
+        self.executed: list[tuple[str, tuple]] = []
+        self.closed = False
+        self.description = [("word",)]
+        self.statement = None
+        self.warnings = None
+
+    def execute(self, sql, params):
+        self.executed.append((sql, params))
+
+    def fetchall(self):
+        return [("value",)]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self):
+        self.cursors: list[FakePreparedCursor] = []
+
+    def cursor(self, prepared=False):
+        assert prepared
+        cursor = FakePreparedCursor()
+        self.cursors.append(cursor)
+        return cursor
+
+
+def test_shape_fingerprint_ignores_values():
+    def get_sql(value, _from):
+        sql_q = select([("word", None)]).from_table("r").where(("`word` = %s", (value,)))
+        sql, params = sql_q.to_string()[0]
+        limit_str, _ = limit_clause(10, _from)
+        return sql + limit_str
+
+    assert shape_fingerprint(get_sql("a", 0)) == shape_fingerprint(get_sql("b", 10))
+    assert shape_fingerprint(get_sql("a", 0)) != shape_fingerprint("SELECT `word` FROM `r`")
+
+
+def test_statement_prepared_once_per_shape():
+    connection = FakeConnection()
+    cursor = PreparedStatementCursor(connection)  # pyright: ignore[reportArgumentType]
+    sql = "SELECT `word` FROM `r` WHERE `word` = %s"
+    fetchall(cursor, sql, ("a",))  # pyright: ignore[reportArgumentType]
+    # built again for the next request, equal but not the same object
+    assert fetchall(cursor, "".join(sql), ("b",)) == (["word"], [("value",)])  # pyright: ignore[reportArgumentType]
+    fetchall(cursor, "SELECT `word` FROM `r`", ())  # pyright: ignore[reportArgumentType]
+
+    assert len(connection.cursors) == 2
+    first_cursor = connection.cursors[0]
+    assert first_cursor.executed == [(sql, ("a",)), (sql, ("b",))]
+    # the connector only reuses the statement if it is the same object
+    assert first_cursor.executed[0][0] is first_cursor.executed[1][0]
+
+
+def test_least_recently_used_statement_closed():
+    connection = FakeConnection()
+    cursor = PreparedStatementCursor(connection, maxsize=2)  # pyright: ignore[reportArgumentType]
+    for sql in ["SELECT 1", "SELECT 2", "SELECT 1", "SELECT 3"]:
+        cursor.execute(sql)
+    assert [c.closed for c in connection.cursors] == [False, True, False]
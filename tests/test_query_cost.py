@@ -0,0 +1,88 @@
+import pytest
+
+from karps.database.database import estimate_rows_examined, fetchall
+from karps.errors.errors import QueryCostError
+from karps.logging import get_sql_logger, read_sql_log, setup_sql_logger
+
+
+class FakeCursor:
+    """
+    Returns plan for EXPLAIN-statements and one row for other statements
+    """
+
+    def __init__(self, plan: list[tuple[int, int | None]]):
+        self.plan = plan
+        self.executed: list[str] = []
+        self.description = None
+        self.statement = None
+        self.warnings = None
+
+    def execute(self, sql, params):
+        self.executed.append(sql)
+        self.statement = sql
+        if sql.startswith("EXPLAIN"):
+            self.description = [("id",), ("select_type",), ("rows",)]
+            self.rows = [(select_id, "SIMPLE", rows) for select_id, rows in self.plan]
+        else:
+            self.description = [("count",)]
+            self.rows = [(1,)]
+
+    def fetchall(self):
+        return self.rows
+
+
+@pytest.mark.parametrize(
+    "plan,expected",
+    [
+        ([(1, 1000)], 1000),
+        # joined tables in the same SELECT are multiplied
+        ([(1, 1000), (1, 5)], 5000),
+        # the parts of a UNION are added, rows is NULL for the union result
+        ([(1, 1000), (2, 300), (None, None)], 1301),
+    ],
+)
+def test_estimate_rows_examined(plan, expected):
+    assert estimate_rows_examined(FakeCursor(plan), "SELECT 1", ()) == expected  # pyright: ignore[reportArgumentType]
+
+
+def test_fetchall_within_budget():
+    cursor = FakeCursor([(1, 1000)])
+    assert fetchall(cursor, "SELECT COUNT(*) FROM r", (), cost_budget=1000) == (["count"], [(1,)])  # pyright: ignore[reportArgumentType]
+    assert cursor.executed == ["EXPLAIN SELECT COUNT(*) FROM r", "SELECT COUNT(*) FROM r"]
+
+
+def test_fetchall_over_budget():
+    cursor = FakeCursor([(1, 1000), (1, 5)])
+    with pytest.raises(QueryCostError) as e:
+        fetchall(cursor, "SELECT COUNT(*) FROM r", (), cost_budget=1000)  # pyright: ignore[reportArgumentType]
+    assert e.value.code == 5
+    assert e.value.details == {"estimate": 5000, "budget": 1000}
+    # the query itself is not executed
+    assert cursor.executed == ["EXPLAIN SELECT COUNT(*) FROM r"]
+
+
+def test_fetchall_without_budget():
+    cursor = FakeCursor([(1, 1000)])
+    fetchall(cursor, "SELECT COUNT(*) FROM r", ())  # pyright: ignore[reportArgumentType]
+    assert cursor.executed == ["SELECT COUNT(*) FROM r"]
+
+
+@pytest.fixture
+def sql_log_dir(tmp_path):
+    setup_sql_logger(str(tmp_path))
+    yield tmp_path
+    logger = get_sql_logger()
+    for handler in list(logger.handlers):
+        handler.close()
+        logger.removeHandler(handler)
+
+
+def test_rejected_query_is_logged(sql_log_dir):
+    with pytest.raises(QueryCostError):
+        fetchall(FakeCursor([(1, 5000)]), "SELECT COUNT(*) FROM r", (), cost_budget=1000)  # pyright: ignore[reportArgumentType]
+    fetchall(FakeCursor([(1, 10)]), "SELECT 1", (), cost_budget=1000)  # pyright: ignore[reportArgumentType]
+    rejected, executed = read_sql_log(str(sql_log_dir))
+    assert (rejected["q"], rejected["rejected"], rejected["estimate"]) == ("SELECT COUNT(*) FROM r", True, 5000)
+    assert rejected["execute_took_s"] is None
+    assert executed["q"] == "SELECT 1" and "rejected" not in executed
+    assert executed["execute_took_s"] >= 0
@@ -1,5 +1,14 @@
+import importlib.resources
+
+import pytest
+import tatsu
+import tatsu.exceptions
+
 from karps.config import Field, MainConfig
-from karps.query.query import SubQuery, parse_query, get_query
+from karps.database.query import select
+from karps.errors import errors
+from karps.query.query import NullQuery, SubQuery, get_query, normalize_query, parse_query
+from karps.query import query
 
 
 dummy_config = MainConfig(
@@ -91,14 +100,198 @@ def test_collection_field():
 def test_collection_field_multi_clause():
     """
     Test that query will get the correct WHERE clause when searching in
-    field3 - with collection: true - twice in a logical query.
+    field3 - with collection: true - twice in a logical query. The clauses are
+    evaluated in one CTE, with a column for each clause.
     """
     ast = parse_query("or(equals|field3|value0||equals|field3|value1)")
     fields, (query, params), collection_queries = get_query(dummy_config, "", ast)
-    q_out = "EXISTS (SELECT 1 FROM `field3_{idx}__where` WHERE TABLE_PREFIX__id = __parent_id)"
+    q_out = "IFNULL(`field3__where`.`__match_{idx}`, 0)"
     assert query == f"{q_out.format(idx=0)} OR {q_out.format(idx=1)}"
     assert params == ()
     assert len(collection_queries) == 2
     for idx in range(2):
         assert collection_queries[idx] == ("field3", idx, ("`field3` = %s", (f"value{idx}",)))
     assert fields == {"field3"}
+
+
+def test_collection_field_multi_clause_not():
+    ast = parse_query("or(equals|field3|value0||not(equals|field3|value1))")
+    fields, (query, params), collection_queries = get_query(dummy_config, "", ast)
+    q_out = "IFNULL(`field3__where`.`__match_{idx}`, 0)"
+    assert query == f"{q_out.format(idx=0)} OR (NOT {q_out.format(idx=1)})"
+    assert params == ()
+    for idx in range(2):
+        assert collection_queries[idx] == ("field3", idx, ("`field3` = %s", (f"value{idx}",)))
+    assert fields == {"field3"}
+
+
+def test_collection_field_same_clause_twice():
+    ast = parse_query("or(equals|field3|value||and(equals|field3|value||equals|field|value))")
+    _, (query, params), collection_queries = get_query(dummy_config, "", ast)
+    q_out = "EXISTS (SELECT 1 FROM `field3_0__where` WHERE TABLE_PREFIX__id = __parent_id)"
+    assert query == f"{q_out} OR ({q_out} AND `field` = %s)"
+    assert collection_queries == [("field3", 0, ("`field3` = %s", ("value",)))]
+
+
+def test_collection_field_multi_clause_sql():
+    sql_q = select([("field", None)]).from_table("r")
+    _, where, collection_queries = get_query(
+        dummy_config, "", parse_query("and(equals|field3|a||not(startswith|field3|b))")
+    )
+    for where_field, count, collection_where in collection_queries:
+        sql_q.join(where_field, count=count, where=collection_where)
+    (sql, params), (count_sql, count_params) = sql_q.where(where).to_string(paged=True)
+    cte = (
+        "WITH `field3__where` AS (SELECT `__parent_id`, MAX(`field3` = %s) AS `__match_0`,"
+        " MAX(`field3` LIKE %s) AS `__match_1` FROM `r__field3` WHERE (`field3` = %s) OR (`field3` LIKE %s)"
+        " GROUP BY `__parent_id`)"
+    )
+    join = "LEFT JOIN `field3__where` ON `field3__where`.__parent_id = `r`.__id"
+    where_str = "WHERE IFNULL(`field3__where`.`__match_0`, 0) AND (NOT IFNULL(`field3__where`.`__match_1`, 0))"
+    assert sql == f"{cte} SELECT `field` FROM `r` {join} {where_str}"
+    assert count_sql == f"{cte} SELECT COUNT(*) FROM `r` {join} {where_str}"
+    assert params == count_params == ("a", "b%", "a", "b%")
+
+
+@pytest.fixture(scope="module")
+def compiled_parser():
+    with importlib.resources.files("karps.query").joinpath("query.ebnf").open() as fp:
+        return tatsu.compile(fp.read())
+
+
+@pytest.mark.parametrize(
+    "q",
+    [
+        "equals|field|value",
+        "gt|field|10",
+        'equals|field|"a \\" b"',
+        "and()",
+        "not(equals|field|value)",
+        "and(equals|field1|value1||or(contains|field2|x||regexp|field3|^a.*))",
+    ],
+)
+def test_generated_parser_is_up_to_date(compiled_parser, q):
+    """
+    The parser module is generated from query.ebnf with `make generate-parser`, check that it
+    gives the same result as the grammar
+    """
+    assert query.parser.parse(q) == compiled_parser.parse(q)
+
+
+def test_parse_error_message():
+    with pytest.raises(errors.UserError) as e:
+        parse_query("unknown|field|value")
+    assert str(e.value).startswith("Parse error: Expected one of: ")
+
+
+def _as_tuple(q):
+    """
+    Query objects do not compare equal by value if they contain a NullQuery
+    """
+    if isinstance(q, query.LogicalQuery):
+        return (q.op, [_as_tuple(clause) for clause in q.clauses])
+    if isinstance(q, query.SubQuery):
+        return (q.op, q.field, q.value)
+    return type(q).__name__
+
+
+@pytest.mark.parametrize(
+    "q",
+    [
+        "equals|field|value",
+        "gte|field|10",
+        "gt|field|10\n",
+        "and(gt|field|10)",
+        " equals | field | value ",
+        'equals|field|"a \\" b"',
+        'contains|field|" (|) "',
+        'equals|field|""',
+        "and()",
+        "or( )",
+        "and(and())",
+        "not(equals|field|value)",
+        "and( equals|field1|value1 || or(contains|field2|x||regexp|field3|^a.*))",
+        "freetext|word",
+        'and(freetext|"two words"||equals|field|value)',
+    ],
+)
+def test_parser_same_as_grammar(q):
+    assert _as_tuple(parse_query(q)) == _as_tuple(query.parse_query_tatsu(q))
+
+
+# queries that the grammar does not accept
+invalid_queries = [
+    "unknown|field|value",
+    "andx()",
+    "not()",
+    "equals|field",
+    "equals|field|",
+    "and(equals|field|value",
+    "equals|field|value)",
+    'equals|field|"value',
+    'equals|field|"value"x',
+    "and(equals|field|value||)",
+    "contains|field|(",
+    "freetext|field|value",
+    "freetext|",
+    "freetextx|value",
+]
+
+
+# accepted by the grammar, but not supported
+@pytest.mark.parametrize("q", invalid_queries + ["not(equals|field|value||equals|field|value)"])
+def test_parse_error_same_as_grammar(q):
+    with pytest.raises(errors.UserError) as e:
+        parse_query(q)
+    with pytest.raises(errors.UserError) as tatsu_e:
+        query.parse_query_tatsu(q)
+    assert str(e.value) == str(tatsu_e.value)
+
+
+@pytest.mark.parametrize("q", invalid_queries)
+def test_parse_error_message_same_as_compiled_grammar(compiled_parser, q):
+    """
+    The messages of the generated parser are completed with the expected alternatives of query.ebnf
+    """
+    with pytest.raises(tatsu.exceptions.FailedParse) as e:
+        compiled_parser.parse(q)
+    with pytest.raises(errors.UserError) as tatsu_e:
+        query.parse_query_tatsu(q)
+    assert str(tatsu_e.value) == "Parse error: " + e.value.message
+
+
+@pytest.mark.parametrize(
+    "q,expected",
+    [
+        ("and(and(equals|field1|x)||or(equals|field2|y||equals|field2|y))", "`field1` = %s AND `field2` = %s"),
+        ("and(equals|field1|x||and(equals|field2|y||equals|field1|x))", "`field1` = %s AND `field2` = %s"),
+        ("or(equals|field|x||or(equals|field|y||equals|field1|z))", "`field` IN (%s, %s) OR `field1` = %s"),
+        ("and(and()||equals|field|x)", "`field` = %s"),
+        ("not(not(equals|field|x))", "`field` = %s"),
+        ("not(and())", "NOT TRUE"),
+        ("or(equals|field3|x||equals|field3|y)", None),
+    ],
+)
+def test_normalize_query(q, expected):
+    fields, (query, params), collection_queries = get_query(
+        dummy_config, "", normalize_query(dummy_config, parse_query(q))
+    )
+    if expected:
+        assert query == expected
+    else:
+        # collection fields are not merged
+        assert len(collection_queries) == 2
+
+
+def test_normalize_query_in_params():
+    q = normalize_query(dummy_config, parse_query("or(equals|entry_word|x||equals|field|y||equals|field|x)"), "field")
+    assert q == SubQuery(op="in", field="field", value=("x", "y"))
+    _, (query, params), _ = get_query(dummy_config, "field", q)
+    assert query == "`field` IN (%s, %s)"
+    assert params == ("x", "y")
+
+
+def test_normalize_empty_groups():
+    assert isinstance(normalize_query(dummy_config, parse_query("and(and()||or())")), NullQuery)
+    # an empty group in an or-group matches everything
+    assert isinstance(normalize_query(dummy_config, parse_query("or(equals|field|x||and())")), NullQuery)
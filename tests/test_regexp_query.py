@@ -0,0 +1,79 @@
+import pytest
+
+from karps.config import Field
+from karps.query.query import SubQuery, get_regexp_literals, to_where_clause
+from tests.conftest import explain
+
+word = Field(name="word", type="text")
+word_trigram = Field(name="word", type="text", text_indexes=["trigram"])
+
+
+@pytest.mark.parametrize(
+    "pattern,expected",
+    [
+        ("^bord.*", ("bord", "bord")),
+        ("bord", (None, "bord")),
+        ("^ab?c", ("a", "a")),
+        ("^ab+c", ("ab", "ab")),
+        ("^a\\.b", ("a.b", "a.b")),
+        ("^[ab]cd", (None, "cd")),
+        ("x(ab)yz", (None, "yz")),
+        ("^\\w+ing$", (None, "ing")),
+        ("^a{0,2}b", (None, "b")),
+        ("^bo|rd", (None, None)),
+        ("^(?i)bord", (None, None)),
+        (".*", (None, None)),
+    ],
+)
+def test_get_regexp_literals(pattern, expected):
+    assert get_regexp_literals(pattern) == expected
+
+
+def test_regexp_with_prefix():
+    clause = to_where_clause("word", word, SubQuery(op="regexp", field="word", value="^bo_rd.*"))
+    assert clause == ("(`word` LIKE %s AND `word` REGEXP %s)", ("bo\\_rd%", "^bo_rd.*"))
+
+
+def test_regexp_with_substring():
+    clause = to_where_clause("word", word, SubQuery(op="regexp", field="word", value="^\\w+ing$"))
+    assert clause == ("(`word` LIKE %s AND `word` REGEXP %s)", ("%ing%", "^\\w+ing$"))
+
+
+def test_regexp_with_substring_trigram():
+    clause = to_where_clause("word", word_trigram, SubQuery(op="regexp", field="word", value=".ning$"))
+    assert clause == (
+        "((TABLE_PREFIX__id IN (SELECT `__id` FROM `TABLE_NAME__word__trigram` WHERE `trigram` = %s)"
+        " AND TABLE_PREFIX__id IN (SELECT `__id` FROM `TABLE_NAME__word__trigram` WHERE `trigram` = %s)"
+        " AND `word` LIKE %s) AND `word` REGEXP %s)",
+        ("nin", "ing", "%ning%", ".ning$"),
+    )
+
+
+def test_regexp_without_literals():
+    clause = to_where_clause("word", word, SubQuery(op="regexp", field="word", value="^(a|b)"))
+    assert clause == ("`word` REGEXP %s", ("^(a|b)",))
+
+
+@pytest.fixture
+def word_table(db_cursor):
+    db_cursor.execute("DROP TABLE IF EXISTS `test_regexp`")
+    db_cursor.execute(
+        "CREATE TABLE `test_regexp` (`__id` INT PRIMARY KEY, `word` VARCHAR(100), INDEX `word_idx` (`word`))"
+    )
+    db_cursor.execute("INSERT INTO `test_regexp` SELECT seq, CONCAT('w', HEX(seq * 7919)) FROM seq_1_to_10000")
+    db_cursor.execute("ANALYZE TABLE `test_regexp`")
+    db_cursor.fetchall()
+    yield db_cursor
+    db_cursor.execute("DROP TABLE `test_regexp`")
+
+
+def test_regexp_uses_index(word_table):
+    where, params = to_where_clause("word", word, SubQuery(op="regexp", field="word", value="^w1F.*A$"))
+    (plan,) = explain(word_table, f"SELECT `__id` FROM `test_regexp` WHERE {where}", params)
+    assert plan["key"] == "word_idx"
+    assert plan["type"] == "range"
+
+    word_table.execute(f"SELECT `__id` FROM `test_regexp` WHERE {where}", params)
+    ids = sorted(row[0] for row in word_table.fetchall())
+    word_table.execute("SELECT `__id` FROM `test_regexp` WHERE `word` REGEXP %s", ("^w1F.*A$",))
+    assert ids == sorted(row[0] for row in word_table.fetchall())
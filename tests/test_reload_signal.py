@@ -0,0 +1,59 @@
+import os
+import subprocess
+import sys
+
+from karps.cli.cli import RELOAD_SIGNAL
+from tests.conftest import create_config
+
+# a worker of the API: gunicorn resets the signal handlers after forking a worker, then the app starts
+WORKER = """
+import asyncio
+import signal
+import sys
+
+from karps import api
+
+signal.signal(api.RELOAD_SIGNAL, signal.SIG_DFL)
+
+
+async def main():
+    async with api.lifespan(api.app):
+        snapshot = api.config_registry.get()
+        print("started", flush=True)
+        # wait for the signal, which is handled between reads
+        sys.stdin.readline()
+        print("reloaded" if api.config_registry.get() is not snapshot else "not reloaded", flush=True)
+
+
+asyncio.run(main())
+"""
+
+
+def test_reload_signal_in_worker(tmp_path):
+    create_config(tmp_path, ["r1"])
+    environ = os.environ | {
+        "DB_HOST": "",
+        "DB_USER": "",
+        "DB_PASSWORD": "",
+        "DB_DATABASE": "",
+        "BASE_PATH": str(tmp_path),
+        "SQL_QUERY_LOGGING": "false",
+    }
+    worker = subprocess.Popen(
+        [sys.executable, "-c", WORKER],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        env=environ,
+        cwd=tmp_path,
+        encoding="utf-8",
+    )
+    try:
+        assert worker.stdout and worker.stdin
+        assert worker.stdout.readline() == "started\n"
+        worker.send_signal(RELOAD_SIGNAL)
+        worker.stdin.write("\n")
+        worker.stdin.flush()
+        assert worker.stdout.readline() == "reloaded\n"
+    finally:
+        worker.kill()
+        worker.wait()
@@ -0,0 +1,195 @@
+import base64
+import json
+
+import pytest
+
+from karps import search as search_module
+from karps.database.query import keyset_clause, select
+from karps.errors import errors
+from karps.errors.errors import SearchAfterError, UserError
+
+columns = ["baseform", "pos", "__id"]
+sort = [("_default", "asc")]
+
+
+def fake_database(monkeypatch, rows: dict[str, list[list]]) -> list:
+    """
+    rows are returned for each query on a resource, the resource is recognized by its table name
+    """
+    calls = []
+
+    def run_paged_searches(env, sql_queries, size=10, _from=0, paged=True, **kwargs):
+        calls.append((sql_queries, paged))
+        resource_ids = ["r1" if "FROM `r1`" in sql else "r2" for (sql, _), _ in sql_queries]
+        if not paged:
+            return [(columns, rows[resource_id]) for resource_id in resource_ids], []
+        # the hits from _from to _from + size over all resources, None for resources without hits on the page
+        all_rows = [(resource_id, row) for resource_id in resource_ids for row in rows[resource_id]]
+        page = all_rows[_from : _from + size]
+        results = []
+        for resource_id in resource_ids:
+            resource_rows = [row for page_resource_id, row in page if page_resource_id == resource_id]
+            results.append((columns, resource_rows) if resource_rows else None)
+        return results, [len(rows[resource_id]) for resource_id in resource_ids]
+
+    monkeypatch.setattr(search_module, "run_paged_searches", run_paged_searches)
+    return calls
+
+
+@pytest.fixture
+def search(env, main_config, resource_configs):
+    def search(**kwargs):
+        return search_module.search(env, main_config, resource_configs, q="equals|pos|nn", sort=sort, **kwargs)
+
+    return search
+
+
+def test_first_page_gives_search_after(monkeypatch, search, resource_configs):
+    fake_database(monkeypatch, {"r1": [["a", "nn", 1], ["b", "nn", 2], ["c", "nn", 3]], "r2": [["a", "nn", 1]]})
+    result = search(size=2)
+    assert [hit.entry["baseform"] for hit in result.hits] == ["a", "b"]
+    assert result.search_after
+    after = search_module.SearchAfter.decode(
+        result.search_after, search_module._request_key("equals|pos|nn", resource_configs, sort)
+    )
+    assert (after.resource_id, after.sort_key, after.position) == ("r1", ["b", 2], 2)
+    assert after.resource_hits == {"r1": 3, "r2": 1}
+
+
+def test_last_page_has_no_search_after(monkeypatch, search):
+    fake_database(monkeypatch, {"r1": [["a", "nn", 1]], "r2": [["a", "nn", 1]]})
+    assert search(size=2).search_after is None
+
+
+def test_next_page_uses_keyset(monkeypatch, search):
+    rows = {"r1": [["a", "nn", 1], ["b", "nn", 2], ["c", "nn", 3]], "r2": [["a", "nn", 1], ["b", "nn", 2]]}
+    calls = fake_database(monkeypatch, rows)
+    first_page = search(size=2)
+    # the fake database ignores the keyset condition, return the rest of r1
+    rows["r1"] = rows["r1"][2:]
+    second_page = search(size=2, search_after=first_page.search_after)
+
+    (sql_queries, paged) = calls[1]
+    assert not paged
+    (r1_sql, r1_params), _ = sql_queries[0]
+    assert "WHERE (`pos` = %s) AND ((`baseform` > %s) OR (`baseform` = %s AND `__id` > %s))" in r1_sql
+    assert r1_sql.endswith("ORDER BY `baseform`, `__id` LIMIT %s OFFSET %s")
+    assert r1_params == ("nn", "b", "b", 2, 2, 0)
+    # r2 is searched from the start
+    assert "`__id` >" not in sql_queries[1][0][0]
+
+    assert [(hit.resource_id, hit.entry["baseform"]) for hit in second_page.hits] == [("r1", "c"), ("r2", "a")]
+    assert (second_page.total, second_page.resource_hits) == (5, {"r1": 3, "r2": 2})
+    assert second_page.search_after
+
+    rows["r1"] = []
+    rows["r2"] = rows["r2"][1:]
+    third_page = search(size=2, search_after=second_page.search_after)
+    # only r2 is searched
+    assert len(calls[2][0]) == 1
+    assert [hit.entry["baseform"] for hit in third_page.hits] == ["b"]
+    assert third_page.search_after is None
+
+
+@pytest.mark.parametrize("search_after", ["not a search_after", "eyJ4IjogMX0="])
+def test_invalid_search_after(monkeypatch, search, search_after):
+    fake_database(monkeypatch, {"r1": [], "r2": []})
+    with pytest.raises(SearchAfterError):
+        search(search_after=search_after)
+
+
+def test_search_after_from_other_search(monkeypatch, search, env, main_config, resource_configs):
+    fake_database(monkeypatch, {"r1": [["a", "nn", 1], ["b", "nn", 2]], "r2": []})
+    search_after = search(size=1).search_after
+    with pytest.raises(SearchAfterError):
+        search_module.search(
+            env, main_config, resource_configs, q="equals|pos|vb", sort=sort, search_after=search_after
+        )
+    with pytest.raises(UserError):
+        search(_from=1, search_after=search_after)
+
+
+@pytest.mark.parametrize(
+    "changes",
+    [
+        {"sort_key": [1, 1]},
+        {"sort_key": ["a", "1"]},
+        {"sort_key": ["a", None]},
+        {"sort_key": [["a"], 1]},
+        {"sort_key": ["a"]},
+        {"sort_key": "a"},
+        {"position": "1"},
+        {"resource_hits": {"r1": "3"}},
+        {"resource_id": "r3"},
+        {"totals": "all"},
+    ],
+)
+def test_tampered_search_after(monkeypatch, search, changes):
+    fake_database(monkeypatch, {"r1": [["a", "nn", 1], ["b", "nn", 2]], "r2": []})
+    data = json.loads(base64.urlsafe_b64decode(search(size=1).search_after or ""))
+    search_after = base64.urlsafe_b64encode(json.dumps(data | changes).encode()).decode()
+    with pytest.raises(SearchAfterError):
+        search(search_after=search_after)
+    assert errors.error_codes[SearchAfterError].status_code == 400
+
+
+def test_search_after_null_sort_value(monkeypatch, search):
+    fake_database(monkeypatch, {"r1": [[None, "nn", 1], [None, "nn", 2]], "r2": []})
+    search_after = search(size=1).search_after
+    # the fake database ignores the keyset condition
+    assert [hit.entry["pos"] for hit in search(size=1, search_after=search_after).hits] == ["nn"]
+
+
+@pytest.mark.parametrize(
+    "order_by,values,expected",
+    [
+        ([("a", "asc"), ("__id", "asc")], ["x", 3], ("((`a` > %s) OR (`a` = %s AND `__id` > %s))", ("x", "x", 3))),
+        (
+            [("a", "desc"), ("__id", "asc")],
+            [None, 3],
+            ("((`a` IS NULL AND `__id` > %s))", (3,)),
+        ),
+        (
+            [("a", "asc"), ("__id", "asc")],
+            [None, 3],
+            ("((`a` IS NOT NULL) OR (`a` IS NULL AND `__id` > %s))", (3,)),
+        ),
+    ],
+)
+def test_keyset_clause(order_by, values, expected):
+    assert keyset_clause(order_by, values) == expected
+
+
+@pytest.fixture
+def keyset_table(db_cursor):
+    db_cursor.execute("DROP TABLE IF EXISTS `test_keyset`")
+    db_cursor.execute("CREATE TABLE `test_keyset` (`__id` INT PRIMARY KEY, `a` VARCHAR(10), `b` INT)")
+    # duplicates and NULLs in both columns
+    db_cursor.execute(
+        "INSERT INTO `test_keyset` SELECT seq, IF(seq % 7 = 0, NULL, CHAR(97 + seq % 5)),"
+        " IF(seq % 11 = 0, NULL, seq % 3) FROM seq_1_to_200"
+    )
+    yield db_cursor
+    db_cursor.execute("DROP TABLE `test_keyset`")
+
+
+@pytest.mark.parametrize("order_a,order_b", [("asc", "asc"), ("asc", "desc"), ("desc", "asc"), ("desc", "desc")])
+def test_keyset_pages_same_as_offset(keyset_table, order_a, order_b):
+    order_by = [("a", order_a), ("b", order_b), ("__id", "asc")]
+
+    def get_page(after=None):
+        sql_q = select([("a", None), ("b", None), ("__id", None)]).from_table("test_keyset").order_by(order_by)
+        if after:
+            sql_q.after(after)
+        sql, params = sql_q.add_size(15).to_string()[0]
+        keyset_table.execute(sql, params)
+        return keyset_table.fetchall()
+
+    keyset_rows = []
+    page = get_page()
+    while page:
+        keyset_rows.extend(page)
+        page = get_page(page[-1])
+    order_str = ", ".join(f"`{field}` {order.upper()}" for field, order in order_by)
+    keyset_table.execute(f"SELECT `a`, `b`, `__id` FROM `test_keyset` ORDER BY {order_str}")
+    assert keyset_rows == keyset_table.fetchall()
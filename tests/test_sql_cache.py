@@ -0,0 +1,59 @@
+from karps import search as search_module
+from karps.util.cache import LRUCache
+
+
+def test_search_sql_is_cached(env, main_config, resource_configs, search_calls):
+    sql_cache = LRUCache(maxsize=10)
+    for _from in [0, 0, 10]:
+        search_module.search(env, main_config, resource_configs, q="equals|pos|nn", _from=_from, sql_cache=sql_cache)
+    assert search_calls[0] == search_calls[1] == search_calls[2]
+    # paging does not change the signature
+    stats = sql_cache.stats()
+    assert (stats.hits, stats.misses, stats.size) == (2, 1, 1)
+
+    search_module.search(env, main_config, resource_configs, q="equals|pos|vb", sql_cache=sql_cache)
+    search_module.search(env, main_config, resource_configs[0:1], q="equals|pos|nn", sql_cache=sql_cache)
+    assert sql_cache.stats().misses == 3
+    assert search_calls[3][0][0][1] == ("vb",)
+    assert len(search_calls[4]) == 1
+
+
+def test_search_sql_same_without_cache(env, main_config, resource_configs, search_calls):
+    search_module.search(env, main_config, resource_configs, q="equals|pos|nn", sql_cache=LRUCache())
+    search_module.search(env, main_config, resource_configs, q="equals|pos|nn")
+    assert search_calls[0] == search_calls[1]
+
+
+def test_count_sql_is_cached(monkeypatch, env, main_config, resource_configs):
+    calls = []
+
+    def run_searches(env, sql_queries, **kwargs):
+        calls.append(sql_queries)
+        yield ["count", "resource_id", "__column_0"], [[1, "r1", 1]]
+
+    monkeypatch.setattr(search_module, "run_searches", run_searches)
+    sql_cache = LRUCache(maxsize=10)
+    for q in ["equals|baseform|a", "equals|baseform|a", "equals|baseform|b"]:
+        search_module.count(env, main_config, resource_configs, q=q, sql_cache=sql_cache)
+    assert calls[0] == calls[1] != calls[2]
+    stats = sql_cache.stats()
+    assert (stats.hits, stats.misses) == (1, 2)
+    assert stats.hit_rate == 1 / 3
+
+
+def test_equivalent_queries_share_sql(env, main_config, resource_configs, search_calls):
+    sql_cache = LRUCache(maxsize=10)
+    for q in ["equals|pos|nn", "and(equals|pos|nn)", "and(equals|pos|nn||equals|pos|nn)", "equals|pos|vb"]:
+        search_module.search(env, main_config, resource_configs, q=q, sql_cache=sql_cache)
+    assert search_calls[0] == search_calls[1] == search_calls[2] != search_calls[3]
+    stats = sql_cache.stats()
+    assert (stats.hits, stats.misses) == (2, 2)
+
+
+def test_cache_stats_are_logged(monkeypatch, caplog, env, main_config, resource_configs, search_calls):
+    monkeypatch.setattr(search_module, "CACHE_STATS_INTERVAL", 4)
+    sql_cache = LRUCache(maxsize=10)
+    with caplog.at_level("INFO", logger=search_module.__name__):
+        for _ in range(5):
+            search_module.search(env, main_config, resource_configs, q="equals|pos|nn", sql_cache=sql_cache)
+    assert [record.getMessage() for record in caplog.records] == ["sql cache: 3 hits, 1 misses (75%), 1/10 entries"]
@@ -0,0 +1,255 @@
+import pytest
+
+from karps import search as search_module
+from karps.config import Field, MainConfig, ResourceField, with_text_indexes
+from karps.database.query import select
+from karps.database.text_index import create_text_indexes
+from karps.query.query import SubQuery, get_query, get_trigrams, normalize_query, parse_query, to_where_clause
+from karps.util.cache import LRUCache
+from tests.conftest import explain, make_resource
+
+word = Field(name="word", type="text", text_indexes=["reverse", "trigram"])
+words = Field(name="words", type="text", collection=True, text_indexes=["trigram", "fulltext"])
+plain = Field(name="plain", type="text")
+definition = Field(name="definition", type="text", text_indexes=["fulltext"], contains_mode="fulltext")
+
+text_config = MainConfig(tags={}, fields={"word": word, "words": words, "plain": plain, "definition": definition})
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("ab", []),
+        ("abc", ["abc"]),
+        ("abcd", ["abc", "bcd"]),
+        ("abcdef", ["abc", "def"]),
+        ("abcdefg", ["abc", "def", "efg"]),
+        ("aaaaaa", ["aaa"]),
+    ],
+)
+def test_get_trigrams(value, expected):
+    assert get_trigrams(value) == expected
+
+
+def test_endswith_uses_reversed_column():
+    clause = to_where_clause("word", word, SubQuery(op="endswith", field="word", value="a%c"))
+    assert clause == ("(`word__reversed` LIKE %s AND `word` LIKE %s)", ("c\\%a%", "%a\\%c"))
+
+
+def test_contains_uses_trigrams():
+    clause = to_where_clause("word", word, SubQuery(op="contains", field="word", value="abcd"))
+    candidates = "TABLE_PREFIX__id IN (SELECT `__id` FROM `TABLE_NAME__word__trigram` WHERE `trigram` = %s)"
+    assert clause == (f"({candidates} AND {candidates} AND `word` LIKE %s)", ("abc", "bcd", "%abcd%"))
+
+
+@pytest.mark.parametrize(
+    "field,op,value",
+    [(word, "contains", "ab"), (plain, "contains", "abc"), (plain, "endswith", "abc"), (words, "endswith", "abc")],
+)
+def test_text_index_not_used(field, op, value):
+    where, _ = to_where_clause(field.name, field, SubQuery(op=op, field=field.name, value=value))
+    assert where == f"`{field.name}` LIKE %s"
+
+
+def test_trigram_sql():
+    _, where, _ = get_query(text_config, "", parse_query("contains|word|abc"))
+    sql, params = select([("word", None)]).from_table("r").where(where).to_string()[0]
+    assert sql == (
+        "SELECT `word` FROM `r` WHERE (`r`.__id IN (SELECT `__id` FROM `r__word__trigram` WHERE `trigram` = %s)"
+        " AND `word` LIKE %s)"
+    )
+    assert params == ("abc", "%abc%")
+
+
+def test_trigram_sql_collection_field():
+    sql_q = select([("word", None)]).from_table("r")
+    _, where, collection_queries = get_query(text_config, "", parse_query("contains|words|abc"))
+    for where_field, count, collection_where in collection_queries:
+        sql_q.join(where_field, count=count, where=collection_where)
+    sql, params = sql_q.where(where).to_string()[0]
+    assert "FROM `r__words` WHERE (`__parent_id` IN (SELECT `__id` FROM `r__words__trigram`" in sql
+    assert params == ("abc", "%abc%")
+
+
+def test_contains_uses_fulltext():
+    clause = to_where_clause("definition", definition, SubQuery(op="contains", field="definition", value="big dog"))
+    assert clause == (
+        "(MATCH(`definition`) AGAINST (%s IN BOOLEAN MODE) AND `definition` LIKE %s)",
+        ("+big* +dog*", "%big dog%"),
+    )
+
+
+def test_contains_fulltext_short_word():
+    # words shorter than FULLTEXT_MIN_WORD_LENGTH are not in the index
+    where, _ = to_where_clause("definition", definition, SubQuery(op="contains", field="definition", value="a dog"))
+    assert where == "`definition` LIKE %s"
+
+
+@pytest.mark.parametrize(
+    "freetext_fields,expected",
+    [
+        (["definition"], ("MATCH(`definition`) AGAINST (%s)", ("dog",))),
+        (["definition", "words"], None),
+        ([], ("FALSE", ())),
+    ],
+)
+def test_freetext(freetext_fields, expected):
+    q = normalize_query(text_config, parse_query("freetext|dog"), freetext_fields=freetext_fields)
+    fields, where, collection_queries = get_query(text_config, "", q)
+    assert fields == set(freetext_fields)
+    if expected:
+        assert where == expected
+    else:
+        assert where == (
+            "MATCH(`definition`) AGAINST (%s)"
+            " OR EXISTS (SELECT 1 FROM `words_0__where` WHERE TABLE_PREFIX__id = __parent_id)",
+            ("dog",),
+        )
+        assert collection_queries == [("words", 0, ("MATCH(`words`) AGAINST (%s)", ("dog",)))]
+
+
+word_resource = make_resource("r", fields=["word"], updated=2)
+
+
+@pytest.mark.parametrize(
+    "versions,expected",
+    [
+        (None, ["reverse", "trigram"]),
+        ({("r", "word", "reverse"): 2, ("r", "word", "trigram"): 2}, ["reverse", "trigram"]),
+        # the data has been updated since the indexes were built, the reverse column is kept up to date
+        ({("r", "word", "reverse"): 1, ("r", "word", "trigram"): 1}, ["reverse"]),
+        # built for another resource
+        ({("r2", "word", "reverse"): 2, ("r2", "word", "trigram"): 2}, []),
+        ({}, []),
+    ],
+)
+def test_with_text_indexes(versions, expected):
+    config = with_text_indexes(text_config, word_resource, versions)
+    assert config.fields["word"].text_indexes == expected
+    assert (config is text_config) == (expected == word.text_indexes)
+
+
+def test_missing_text_indexes_use_like():
+    config = with_text_indexes(text_config, word_resource, {})
+    for op, value in [("endswith", "%abc"), ("contains", "%abc%")]:
+        clause = to_where_clause("word", config.fields["word"], SubQuery(op=op, field="word", value="abc"))
+        assert clause == ("`word` LIKE %s", (value,))
+
+
+def test_missing_fulltext_index_uses_like():
+    resource = word_resource.model_copy(update={"fields": [ResourceField(name="definition", primary=True)]})
+    field = with_text_indexes(text_config, resource, {}).fields["definition"]
+    assert field.contains_mode == "like"
+    for op in ["contains", "freetext"]:
+        clause = to_where_clause("definition", field, SubQuery(op=op, field="definition", value="big dog"))
+        assert clause == ("`definition` LIKE %s", ("%big dog%",))
+
+
+def test_search_looks_up_built_text_indexes_once(monkeypatch, env, search_calls):
+    lookups = []
+
+    def get_text_index_versions(env):
+        lookups.append(env)
+        return {("r", "word", "trigram"): 2}
+
+    monkeypatch.setattr(search_module, "get_text_index_versions", get_text_index_versions)
+    sql_cache = LRUCache(maxsize=10)
+    for q in ["endswith|word|abc", "contains|word|abc"]:
+        search_module.search(env, text_config, [word_resource], q=q, sql_cache=sql_cache)
+    assert len(lookups) == 1
+    # the reverse column has not been built
+    assert "`word` LIKE %s" in search_calls[0][0][0][0] and "__reversed" not in search_calls[0][0][0][0]
+    assert "`r__word__trigram`" in search_calls[1][0][0][0]
+
+
+@pytest.fixture
+def text_table(db_env, db_cursor):
+    db_cursor.execute("DROP TABLE IF EXISTS `test_text`, `test_text__word__trigram`")
+    db_cursor.execute("CREATE TABLE `test_text` (`__id` INT PRIMARY KEY, `word` VARCHAR(100))")
+    db_cursor.execute("INSERT INTO `test_text` SELECT seq, CONCAT('w', HEX(seq * 7919)) FROM seq_1_to_10000")
+    db_cursor.execute("COMMIT")
+    resource_config = make_resource("test_text", fields=["word"], size=10000)
+    create_text_indexes(db_env, text_config, resource_config)
+    db_cursor.execute("ANALYZE TABLE `test_text`, `test_text__word__trigram`")
+    db_cursor.fetchall()
+    yield db_cursor
+    db_cursor.execute("DELETE FROM `__text_indexes` WHERE `resource_id` = %s", ("test_text",))
+    db_cursor.execute("DROP TABLE `test_text`, `test_text__word__trigram`")
+
+
+@pytest.mark.parametrize(
+    "op,value", [("endswith", "7F"), ("contains", "A3B"), ("contains", "1F4A"), ("contains", "W1")]
+)
+def test_text_index_same_result(text_table, op, value):
+    def get_ids(field):
+        _, where, _ = get_query(
+            MainConfig(tags={}, fields={"word": field}), "", SubQuery(op=op, field="word", value=value)
+        )
+        sql, params = select([("__id", None)]).from_table("test_text").where(where).to_string()[0]
+        text_table.execute(sql, params)
+        return sorted(row[0] for row in text_table.fetchall())
+
+    assert get_ids(word) == get_ids(plain)
+
+
+def test_endswith_uses_index(text_table):
+    where, params = to_where_clause("word", word, SubQuery(op="endswith", field="word", value="7F"))
+    (plan,) = explain(text_table, f"SELECT `__id` FROM `test_text` WHERE {where}", params)
+    assert plan["key"] == "word__reversed_idx"
+
+
+@pytest.fixture
+def fulltext_table(db_env, db_cursor):
+    db_cursor.execute("DROP TABLE IF EXISTS `test_fulltext`")
+    db_cursor.execute("CREATE TABLE `test_fulltext` (`__id` INT PRIMARY KEY, `definition` TEXT) ENGINE=InnoDB")
+    db_cursor.executemany(
+        "INSERT INTO `test_fulltext` VALUES (%s, %s)",
+        [(1, "a big dog"), (2, "a small dog"), (3, "a bigger cat"), (4, "underdog")],
+    )
+    db_cursor.execute("COMMIT")
+    resource_config = make_resource("test_fulltext", fields=["definition"], size=4)
+    create_text_indexes(db_env, text_config, resource_config)
+    yield db_cursor
+    db_cursor.execute("DELETE FROM `__text_indexes` WHERE `resource_id` = %s", ("test_fulltext",))
+    db_cursor.execute("DROP TABLE `test_fulltext`")
+
+
+@pytest.mark.parametrize(
+    "q,expected",
+    [
+        ("freetext|dog", [1, 2]),
+        ("freetext|cat", [3]),
+        ("contains|definition|big", [1, 3]),
+        ("contains|definition|big dog", [1]),
+        # underdog is not found, since dog is not at the start of a word
+        ("contains|definition|dog", [1, 2]),
+    ],
+)
+def test_fulltext_result(fulltext_table, q, expected):
+    normalized = normalize_query(text_config, parse_query(q), freetext_fields=["definition"])
+    _, where, _ = get_query(text_config, "", normalized)
+    sql, params = select([("__id", None)]).from_table("test_fulltext").where(where).to_string()[0]
+    fulltext_table.execute(sql, params)
+    assert sorted(row[0] for row in fulltext_table.fetchall()) == expected
+
+
+@pytest.mark.parametrize(
+    "q,expected",
+    [
+        ("freetext|dog", [1, 2]),
+        ("contains|definition|dog", [1, 2]),
+    ],
+)
+def test_fulltext_search(db_env, fulltext_table, q, expected):
+    resource_config = make_resource("test_fulltext", fields=["definition"], size=4)
+
+    def search():
+        result = search_module.search(db_env, text_config, [resource_config], q=q, size=10)
+        return sorted(hit.entry["definition"] for hit in result.hits)
+
+    definitions = {1: "a big dog", 2: "a small dog", 3: "a bigger cat", 4: "underdog"}
+    assert search() == sorted(definitions[entry_id] for entry_id in expected)
+    # without the index, LIKE finds the values that contain the value (also underdog) instead of failing
+    fulltext_table.execute("DELETE FROM `__text_indexes` WHERE `resource_id` = %s", ("test_fulltext",))
+    fulltext_table.execute("COMMIT")
+    assert search() == ["a big dog", "a small dog", "underdog"]
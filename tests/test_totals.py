@@ -0,0 +1,158 @@
+from contextlib import contextmanager
+from dataclasses import replace
+
+import pytest
+
+from karps import search as search_module
+from karps.database import database
+from karps.database.query import select
+from karps.errors.errors import QueryCostError
+
+columns = ["baseform", "pos", "__id"]
+rows = {"r1": [["a", "nn", 1], ["b", "nn", 2], ["c", "nn", 3]], "r2": [["a", "nn", 1]]}
+sizes = {"r1": 10, "r2": 20}
+
+
+def fake_database(monkeypatch) -> list:
+    calls = []
+
+    def run_paged_searches(env, sql_queries, size=10, _from=0, paged=True, counts=None, **kwargs):
+        calls.append({"paged": paged, "counts": counts, "sql_queries": sql_queries})
+        resource_ids = ["r1" if "FROM `r1`" in sql else "r2" for (sql, _), _ in sql_queries]
+        if not paged:
+            return [(columns, rows[resource_id]) for resource_id in resource_ids], []
+        results = [(columns, rows[resource_id]) if idx == 0 else None for idx, resource_id in enumerate(resource_ids)]
+        return results, counts if counts is not None else [len(rows[resource_id]) for resource_id in resource_ids]
+
+    def estimate_counts(config, resources, count_queries):
+        calls.append({"estimate": [resource.resource_id for resource in resources]})
+        return [5 for _ in count_queries]
+
+    monkeypatch.setattr(search_module, "run_paged_searches", run_paged_searches)
+    monkeypatch.setattr(search_module, "estimate_counts", estimate_counts)
+    return calls
+
+
+@pytest.fixture
+def sized_resources(resource_configs):
+    return [resource.model_copy(update={"size": sizes[resource.resource_id]}) for resource in resource_configs]
+
+
+@pytest.fixture
+def search(env, main_config):
+    def search(resources, **kwargs):
+        return search_module.search(env, main_config, resources, sort=[("_default", "asc")], **kwargs)
+
+    return search
+
+
+@pytest.mark.parametrize("totals", ["exact", "estimate"])
+def test_unfiltered_counts_from_config(monkeypatch, search, sized_resources, totals):
+    calls = fake_database(monkeypatch)
+    result = search(sized_resources, size=2, totals=totals)
+    assert (result.total, result.resource_hits) == (30, sizes)
+    (call,) = calls
+    assert call["counts"] == [10, 20]
+
+
+def test_totals_none(monkeypatch, search, sized_resources):
+    calls = fake_database(monkeypatch)
+    result = search(sized_resources, q="equals|pos|nn", size=2, totals="none")
+    assert (result.total, result.resource_hits) == (None, None)
+    assert result.resource_order == ["r1", "r2"]
+    assert [hit.entry["baseform"] for hit in result.hits] == ["a", "b"]
+    (call,) = calls
+    # the first page is fetched without count queries
+    assert not call["paged"]
+    assert all(count_query is None for _, count_query in call["sql_queries"])
+    assert result.search_after
+
+
+def test_totals_estimate(monkeypatch, search, sized_resources):
+    calls = fake_database(monkeypatch)
+    result = search(sized_resources, q="equals|pos|nn", size=5, totals="estimate")
+    assert (result.total, result.resource_hits) == (10, {"r1": 5, "r2": 5})
+    assert [hit.entry["baseform"] for hit in result.hits] == ["a", "b", "c", "a"]
+    assert calls[1] == {"estimate": ["r1", "r2"]}
+    # the page is not full, so it is the last one even if the estimate is larger
+    assert result.search_after is None
+
+
+def test_totals_none_later_page_is_counted(monkeypatch, search, sized_resources):
+    calls = fake_database(monkeypatch)
+    result = search(sized_resources, q="equals|pos|nn", size=2, _from=2, totals="none")
+    assert result.total is None
+    (call,) = calls
+    assert call["paged"] and call["counts"] is None
+
+
+def test_known_counts_are_not_queried(monkeypatch, env):
+    statements = []
+
+    @contextmanager
+    def get_query_cursor(config):
+        yield None
+
+    def fetchall(cursor, sql, params, cost_budget=None):
+        statements.append(sql)
+        return ["baseform"], [("a",)]
+
+    monkeypatch.setattr(database, "get_query_cursor", get_query_cursor)
+    monkeypatch.setattr(database, "fetchall", fetchall)
+    sql_queries = [select([("baseform", None)]).from_table(table).to_string(paged=True) for table in ["r1", "r2"]]
+    results, counts = database.run_paged_searches(env, sql_queries, size=2, _from=3, counts=[3, 4])
+    assert counts == [3, 4]
+    assert [result[0] if result else None for result in results] == [None, ["baseform"]]
+    (sql,) = statements
+    assert "COUNT(*)" not in sql
+
+
+@pytest.mark.parametrize("counts", [None, [3, 4]])
+def test_data_queries_checked_without_count_query(monkeypatch, env, counts):
+    budgets = []
+
+    @contextmanager
+    def get_query_cursor(config):
+        yield None
+
+    def fetchall(cursor, sql, params, cost_budget=None):
+        budgets.append(("COUNT(*)" in sql, cost_budget))
+        # every statement is estimated to examine more rows than the budget
+        if cost_budget is not None:
+            raise QueryCostError(1000, cost_budget)
+        return ["idx", "count"], [(0, 3), (1, 4)]
+
+    monkeypatch.setattr(database, "get_query_cursor", get_query_cursor)
+    monkeypatch.setattr(database, "fetchall", fetchall)
+    sql_queries = [select([("baseform", None)]).from_table(table).to_string(paged=True) for table in ["r1", "r2"]]
+    with pytest.raises(QueryCostError):
+        results, _ = database.run_paged_searches(
+            replace(env, query_cost_budget=100), sql_queries, size=2, counts=counts
+        )
+        list(results)
+    # the budget is checked once, on the count query if there is one, otherwise on the data query
+    assert budgets == [(counts is None, 100)]
+
+
+class FakeCursor:
+    def __init__(self, plan: list[dict]):
+        self.plan = plan
+        self.description = [(column,) for column in plan[0]]
+
+    def execute(self, sql, params):
+        self.sql = sql
+
+    def fetchall(self):
+        return [tuple(row.values()) for row in self.plan]
+
+
+def test_estimate_count():
+    cursor = FakeCursor(
+        [
+            {"id": 1, "table": "<derived2>", "rows": 7, "filtered": 100.0},
+            {"id": 1, "table": "r1", "rows": 1000, "filtered": 12.5},
+            {"id": 2, "table": "r1__pos", "rows": 50, "filtered": 100.0},
+        ]
+    )
+    assert database.estimate_count(cursor, "SELECT COUNT(*) FROM `r1`", (), "r1") == 125  # pyright: ignore[reportArgumentType]
+    assert cursor.sql == "EXPLAIN EXTENDED SELECT COUNT(*) FROM `r1`"
@@ -0,0 +1,87 @@
+from dataclasses import replace
+
+import pytest
+
+from karps import search as search_module
+from karps.database.query import ELEMENT_SEPARATOR, data_join_query, select
+from tests.conftest import make_resource
+
+
+def test_defer_data_joins():
+    sql_q = select([("baseform", None), ("pos", None), ("__id", None)]).from_table("r").join("pos")
+    assert sql_q.defer_data_joins() == {"pos": (None, ["pos"])}
+    assert sql_q.get_columns() == ["baseform", "__id"]
+    assert sql_q.to_string()[0] == ("SELECT `baseform`, `__id` FROM `r`", ())
+
+
+def test_defer_data_joins_keeps_sort_field():
+    sql_q = select([("baseform", None), ("pos", None)]).from_table("r").join("pos")
+    assert sql_q.defer_data_joins(keep=["pos"]) == {}
+    assert "`pos__data`" in sql_q.to_string()[0][0]
+
+
+def test_data_join_query_for_ids():
+    sql, params = (
+        data_join_query("r", "pos", (None, ["pos"])).where(("`__parent_id` IN (%s, %s)", (3, 5))).to_string()[0]
+    )
+    assert sql == (
+        f"SELECT `__parent_id`, GROUP_CONCAT(`pos` ORDER BY __parent_id SEPARATOR '{ELEMENT_SEPARATOR}') AS `pos`"
+        " FROM `r__pos` WHERE `__parent_id` IN (%s, %s) GROUP BY `__parent_id`"
+    )
+    assert params == (3, 5)
+
+
+def test_search_fetches_collection_fields_for_page(monkeypatch, env, collection_config):
+    calls = []
+
+    def run_paged_searches(env, sql_queries, **kwargs):
+        calls.append(sql_queries)
+        return [(["baseform", "__id"], [["a", 1], ["b", 2]])], [2]
+
+    def fetch_data_joins(env, table, data_joins, ids):
+        calls.append((table, data_joins, ids))
+        return {"pos": {1: f"nn{ELEMENT_SEPARATOR}vb"}}
+
+    monkeypatch.setattr(search_module, "run_paged_searches", run_paged_searches)
+    monkeypatch.setattr(search_module, "fetch_data_joins", fetch_data_joins)
+    result = search_module.search(
+        replace(env, two_phase_fetch=True), collection_config, [make_resource("r1")], q="equals|baseform|a"
+    )
+    [(data_sql, _), _] = calls[0][0]
+    assert "pos__data" not in data_sql
+    assert calls[1] == ("r1", {"pos": (None, ["pos"])}, [1, 2])
+    assert [hit.entry for hit in result.hits] == [
+        {"baseform": "a", "pos": ["nn", "vb"]},
+        {"baseform": "b", "pos": []},
+    ]
+
+
+@pytest.fixture
+def two_phase_resource(db_cursor):
+    db_cursor.execute("DROP TABLE IF EXISTS `test_two_phase`, `test_two_phase__pos`")
+    db_cursor.execute("CREATE TABLE `test_two_phase` (`__id` INT PRIMARY KEY, `baseform` VARCHAR(10))")
+    db_cursor.execute("CREATE TABLE `test_two_phase__pos` (`__parent_id` INT, `pos` VARCHAR(10))")
+    db_cursor.execute("INSERT INTO `test_two_phase` SELECT seq, CONCAT('w', seq) FROM seq_1_to_30")
+    db_cursor.execute(
+        "INSERT INTO `test_two_phase__pos` SELECT seq % 20 + 1, ELT(1 + seq % 3, 'nn', 'vb', 'av') FROM seq_1_to_40"
+    )
+    db_cursor.execute("COMMIT")
+    yield make_resource("test_two_phase")
+    db_cursor.execute("DROP TABLE `test_two_phase`, `test_two_phase__pos`")
+
+
+@pytest.mark.parametrize("sort", [[("_default", "asc")], [("pos", "desc")]])
+def test_two_phase_fetch_same_result(db_env, collection_config, two_phase_resource, sort):
+    def search(two_phase_fetch):
+        result = search_module.search(
+            replace(db_env, two_phase_fetch=two_phase_fetch),
+            collection_config,
+            [two_phase_resource],
+            q="or(equals|pos|nn||startswith|baseform|w1)",
+            size=5,
+            _from=3,
+            sort=sort,
+        )
+        return [{**hit.entry, "pos": sorted(hit.entry["pos"])} for hit in result.hits]  # pyright: ignore[reportArgumentType]
+
+    assert search(True) == search(False)
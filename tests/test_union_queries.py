@@ -0,0 +1,157 @@
+from contextlib import contextmanager
+from dataclasses import replace
+
+import pytest
+
+from karps.database import database
+from karps.database.query import limit_clause, select, union_counts, union_data_queries
+from karps.query.query import get_query, parse_query
+from tests.test_query_parser import dummy_config
+
+
+def get_count_query(table: str, q: str):
+    _, where, collection_queries = get_query(dummy_config, "", parse_query(q))
+    sql_q = select([("field", None)]).from_table(table)
+    for where_field, count, collection_where in collection_queries:
+        sql_q.join(where_field, count=count, where=collection_where)
+    _, count_query = sql_q.where(where).to_string(paged=True)
+    assert count_query
+    return count_query
+
+
+def test_union_counts():
+    r1 = get_count_query("r1", "equals|field|a")
+    r2 = get_count_query("r2", "equals|field3|b")
+    sql, params = union_counts([r1, r2])
+    assert sql == (
+        f"SELECT 0 AS `__resource`, `__count_0`.* FROM ({r1[0]}) AS `__count_0`"
+        f" UNION ALL SELECT 1 AS `__resource`, `__count_1`.* FROM ({r2[0]}) AS `__count_1`"
+    )
+    # the CTE of the collection field is kept in its branch
+    assert "(WITH `field3_0__where` AS" in sql
+    assert params == ("a", "b")
+
+
+def test_counts_in_one_statement(monkeypatch, env):
+    statements = []
+
+    @contextmanager
+    def get_query_cursor(config):
+        yield None
+
+    def fetchall(cursor, sql, params, cost_budget=None):
+        statements.append((sql, params))
+        # the order of the rows of UNION ALL is not guaranteed
+        return ["__resource", "COUNT(*)"], [(1, 5), (0, 3)]
+
+    monkeypatch.setattr(database, "get_query_cursor", get_query_cursor)
+    monkeypatch.setattr(database, "fetchall", fetchall)
+    sql_queries = [(("SELECT 1", ()), get_count_query(table, "equals|field|a")) for table in ["r1", "r2"]]
+    _, counts = database.run_paged_searches(env, sql_queries, size=0)
+    assert counts == [3, 5]
+    assert len(statements) == 1
+
+
+@pytest.fixture
+def count_tables(db_cursor):
+    for table in ["test_union_r1", "test_union_r2"]:
+        db_cursor.execute(f"DROP TABLE IF EXISTS `{table}`, `{table}__field3`")
+        db_cursor.execute(f"CREATE TABLE `{table}` (`__id` INT PRIMARY KEY, `field` VARCHAR(10))")
+        db_cursor.execute(f"CREATE TABLE `{table}__field3` (`__parent_id` INT, `field3` VARCHAR(10))")
+    db_cursor.execute("INSERT INTO `test_union_r1` SELECT seq, IF(seq % 2, 'a', 'b') FROM seq_1_to_10")
+    db_cursor.execute("INSERT INTO `test_union_r1__field3` SELECT seq, IF(seq % 5, 'a', 'b') FROM seq_1_to_10")
+    db_cursor.execute("INSERT INTO `test_union_r2` SELECT seq, 'a' FROM seq_1_to_4")
+    db_cursor.execute("INSERT INTO `test_union_r2__field3` SELECT seq, 'b' FROM seq_1_to_4")
+    yield db_cursor
+    for table in ["test_union_r1", "test_union_r2"]:
+        db_cursor.execute(f"DROP TABLE `{table}`, `{table}__field3`")
+
+
+def test_union_counts_same_as_separate(count_tables):
+    count_queries = [
+        get_count_query(table, q)
+        for table in ["test_union_r1", "test_union_r2"]
+        for q in ["equals|field|a", "and(equals|field|a||equals|field3|b)"]
+    ]
+    separate = []
+    for sql, params in count_queries:
+        count_tables.execute(sql, params)
+        separate.append(count_tables.fetchall()[0][0])
+    count_tables.execute(*union_counts(count_queries))
+    assert sorted(count_tables.fetchall()) == list(enumerate(separate))
+
+
+def get_data_query(table: str, columns: list[str], sort: list[tuple[str, str]], size: int, _from: int):
+    sql_q = select([(column, None) for column in columns]).from_table(table).order_by(sort)
+    (data_sql, data_params), _ = sql_q.to_string(paged=True)
+    limit_str, limit_params = limit_clause(size, _from)
+    return (data_sql + limit_str, data_params + limit_params), sql_q.get_columns(), sql_q.get_order_by()
+
+
+def test_union_data_queries():
+    r1 = get_data_query("r1", ["field", "__id"], [("field", "desc"), ("__id", "asc")], 2, 3)
+    r3 = get_data_query("r3", ["field2", "__id"], [], 5, 0)
+    (sql, params), all_columns = union_data_queries([r1, None, r3])
+    assert all_columns == ["field", "__id", "field2"]
+    assert sql == (
+        "SELECT 0 AS `__resource`, ROW_NUMBER() OVER (ORDER BY `__data_0`.`field` DESC, `__data_0`.`__id`)"
+        " AS `__row`, `__data_0`.`field` AS `field`, `__data_0`.`__id` AS `__id`, NULL AS `field2`"
+        f" FROM ({r1[0][0]}) AS `__data_0`"
+        " UNION ALL SELECT 2 AS `__resource`, ROW_NUMBER() OVER () AS `__row`, NULL AS `field`,"
+        f" `__data_2`.`__id` AS `__id`, `__data_2`.`field2` AS `field2` FROM ({r3[0][0]}) AS `__data_2`"
+        " ORDER BY `__resource`, `__row`"
+    )
+    assert params == (2, 3, 5, 0)
+
+
+def test_page_in_one_statement(monkeypatch, env):
+    statements = []
+
+    @contextmanager
+    def get_query_cursor(config):
+        yield None
+
+    def fetchall(cursor, sql, params, cost_budget=None):
+        statements.append(sql)
+        if "COUNT(*)" in sql:
+            return ["__resource", "COUNT(*)"], [(0, 2), (1, 1), (2, 3)]
+        columns = ["__resource", "__row", "field", "__id", "field2"]
+        return columns, [(0, 1, "a", 1, None), (0, 2, "b", 2, None), (1, 1, None, 7, "c")]
+
+    monkeypatch.setattr(database, "get_query_cursor", get_query_cursor)
+    monkeypatch.setattr(database, "fetchall", fetchall)
+    tables = {"r1": ["field", "__id"], "r2": ["field2", "__id"], "r3": ["field", "__id"]}
+    sql_queries = []
+    page_columns = []
+    for table, columns in tables.items():
+        sql_q = select([(column, None) for column in columns]).from_table(table)
+        sql_queries.append(sql_q.to_string(paged=True))
+        page_columns.append((sql_q.get_columns(), sql_q.get_order_by()))
+    results, counts = database.run_paged_searches(
+        replace(env, merge_page_queries=True), sql_queries, size=3, page_columns=page_columns
+    )
+    assert list(results) == [(["field", "__id"], [["a", 1], ["b", 2]]), (["field2", "__id"], [["c", 7]]), None]
+    assert counts == [2, 1, 3]
+    # one statement for the counts and one for the data
+    assert len(statements) == 2
+
+
+def test_union_data_queries_same_as_separate(count_tables):
+    data_queries = [
+        get_data_query("test_union_r1", ["field", "__id"], [("field", "desc"), ("__id", "asc")], 4, 3),
+        None,
+        get_data_query("test_union_r2", ["__id"], [("__id", "desc")], 3, 0),
+    ]
+    separate = []
+    for idx, data_query in enumerate(data_queries):
+        if data_query:
+            (sql, params), _, _ = data_query
+            count_tables.execute(sql, params)
+            separate.extend((idx, row) for row in count_tables.fetchall())
+    (sql, params), all_columns = union_data_queries(data_queries)
+    count_tables.execute(sql, params)
+    merged = []
+    for row in count_tables.fetchall():
+        columns = data_queries[row[0]][1]
+        merged.append((row[0], tuple(row[2 + all_columns.index(column)] for column in columns)))
+    assert merged == separate